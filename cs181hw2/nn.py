@@ -6,9 +6,23 @@ nn.py -- implement artifical neural networks.
 work module for hw2.
 """
 
+import array
+import itertools
+try:
+    import json
+except ImportError:
+    from tfutils import simplejson as json
 import math
-
+import mmap
+import multiprocessing
+import operator
+import os
+import Queue
 import random
+import struct
+import sys
+import tempfile
+import threading
 
 def sigmoid(dblX):
     """The sigmoid function.  Given input dblX, sigmoid(dblX).
@@ -22,8 +36,160 @@ def sigmoid(dblX):
     """
     return 1 / (1 + math.exp(-dblX))
 
+# Inputs below -SIGMOID_CLAMP are treated as -SIGMOID_CLAMP by the clamped
+# backends. The sigmoid of -SIGMOID_CLAMP is about 7e-218, and math.exp
+# overflows a little beyond 709.
+SIGMOID_CLAMP = 500.0
+SIGMOID_BACKENDS = ("exact", "clamped", "table")
+SIGMOID_TABLE_ERROR = 1e-4
+
+class ExactSigmoid(object):
+    """The sigmoid backend computing exactly what sigmoid does.
+
+    A sigmoid backend is called with one input, like sigmoid, and its
+    vector method returns the sigmoid of every element of a list of
+    inputs in one call, which is what the whole-layer code uses. Its
+    apply method overwrites every element of an array with its sigmoid
+    instead, for code that must not allocate."""
+    sName = "exact"
+    def __call__(self, dblX):
+        return 1 / (1 + math.exp(-dblX))
+    def vector(self, listDblX):
+        exp = math.exp
+        return [1 / (1 + exp(-dblX)) for dblX in listDblX]
+    def apply(self, arrDblX):
+        exp = math.exp
+        for ix in xrange(len(arrDblX)):
+            arrDblX[ix] = 1 / (1 + exp(-arrDblX[ix]))
+
+class ClampedSigmoid(object):
+    """The exact sigmoid, except that inputs below -dblLimit are raised to
+    -dblLimit, so math.exp cannot overflow.
+
+    >>> ClampedSigmoid()(-100000.0) < 1.0e-200
+    True"""
+    sName = "clamped"
+    def __init__(self, dblLimit=SIGMOID_CLAMP):
+        self.dblLimit = dblLimit
+    def __call__(self, dblX):
+        if dblX < -self.dblLimit:
+            dblX = -self.dblLimit
+        return 1 / (1 + math.exp(-dblX))
+    def vector(self, listDblX):
+        exp = math.exp
+        dblLimit = self.dblLimit
+        return [1 / (1 + exp(dblLimit if dblX < -dblLimit else -dblX))
+                for dblX in listDblX]
+    def apply(self, arrDblX):
+        exp = math.exp
+        dblLimit = self.dblLimit
+        for ix in xrange(len(arrDblX)):
+            dblX = arrDblX[ix]
+            arrDblX[ix] = 1 / (1 + exp(dblLimit if dblX < -dblLimit
+                                       else -dblX))
+
+class TableSigmoid(object):
+    """The sigmoid interpolated linearly from a table of precomputed values,
+    erring by at most dblMaxError.
+
+    The table covers the inputs whose sigmoid is more than dblMaxError
+    from 0 and 1; outside it the clamped sigmoid is computed instead.
+    Linear interpolation between points h apart errs by at most h*h/8
+    times the largest second derivative of the sigmoid, 1/(6*sqrt(3)),
+    which sets the spacing of the table.
+
+    This bounds the error, not the time: in CPython the lookup costs more
+    than math.exp, and the table runs at about half the speed of the
+    exact backend (see the sigmoid benchmarks in benchnn.py).
+
+    >>> abs(TableSigmoid(1e-6)(0.3) - sigmoid(0.3)) <= 1e-6
+    True"""
+    sName = "table"
+    def __init__(self, dblMaxError=SIGMOID_TABLE_ERROR):
+        if not 0.0 < dblMaxError < 0.5:
+            raise ValueError("Table error must be between 0 and 0.5.")
+        self.dblMaxError = dblMaxError
+        self.dblLimit = math.log(1.0/dblMaxError - 1.0)
+        dblStep = math.sqrt(8.0*dblMaxError*6.0*math.sqrt(3.0))
+        self.cSteps = int(math.ceil(2.0*self.dblLimit/dblStep))
+        self.dblScale = self.cSteps/(2.0*self.dblLimit)
+        listDblValue = [sigmoid(ix/self.dblScale - self.dblLimit)
+                        for ix in xrange(self.cSteps + 1)]
+        self.listDblValue = listDblValue[:-1]
+        self.listDblSlope = [dblHi - dblLo for dblLo,dblHi
+                             in zip(listDblValue[:-1], listDblValue[1:])]
+        self.clamped = ClampedSigmoid()
+    def __call__(self, dblX):
+        dblT = (dblX + self.dblLimit)*self.dblScale
+        if 0.0 <= dblT < self.cSteps:
+            ix = int(dblT)
+            return self.listDblValue[ix] + self.listDblSlope[ix]*(dblT - ix)
+        return self.clamped(dblX)
+    def vector(self, listDblX):
+        dblLimit = self.dblLimit
+        dblScale = self.dblScale
+        cSteps = self.cSteps
+        listDblValue = self.listDblValue
+        listDblSlope = self.listDblSlope
+        clamped = self.clamped
+        listDblY = []
+        for dblX in listDblX:
+            dblT = (dblX + dblLimit)*dblScale
+            if 0.0 <= dblT < cSteps:
+                ix = int(dblT)
+                listDblY.append(listDblValue[ix]
+                                + listDblSlope[ix]*(dblT - ix))
+            else:
+                listDblY.append(clamped(dblX))
+        return listDblY
+    def apply(self, arrDblX):
+        dblLimit = self.dblLimit
+        dblScale = self.dblScale
+        cSteps = self.cSteps
+        listDblValue = self.listDblValue
+        listDblSlope = self.listDblSlope
+        clamped = self.clamped
+        for ixX in xrange(len(arrDblX)):
+            dblX = arrDblX[ixX]
+            dblT = (dblX + dblLimit)*dblScale
+            if 0.0 <= dblT < cSteps:
+                ix = int(dblT)
+                arrDblX[ixX] = listDblValue[ix] + listDblSlope[ix]*(dblT - ix)
+            else:
+                arrDblX[ixX] = clamped(dblX)
+
+def make_sigmoid(sName, dblMaxError=SIGMOID_TABLE_ERROR):
+    """Build the sigmoid backend named sName, one of SIGMOID_BACKENDS. A
+    table backend errs by at most dblMaxError."""
+    if sName == "exact":
+        return ExactSigmoid()
+    if sName == "clamped":
+        return ClampedSigmoid()
+    if sName == "table":
+        return TableSigmoid(dblMaxError)
+    raise ValueError("Unknown sigmoid backend: %s" % sName)
+
+# The sigmoid backend of every network whose sigmoid attribute is None.
+DEFAULT_SIGMOID = ExactSigmoid()
+
+def set_default_sigmoid(backend):
+    """Make backend, a sigmoid backend or the name of one, the default for
+    every network without a backend of its own."""
+    global DEFAULT_SIGMOID
+    if isinstance(backend, basestring):
+        backend = make_sigmoid(backend)
+    DEFAULT_SIGMOID = backend
+
+def net_sigmoid(net):
+    """Returns the sigmoid backend net computes its activations with."""
+    return net.sigmoid or DEFAULT_SIGMOID
+
 class Perceptron(object):
-    """Implements a node in a feed-forward neural network."""
+    """Implements a node in a feed-forward neural network.
+
+    The weights are kept in a typed array of doubles rather than a list of
+    float objects, and the class has no per-instance __dict__."""
+    __slots__ = ("listDblW", "dblW0", "ix")
     def __init__(self, listDblW, dblW0, ix):
         """Arguments:
         listDblW
@@ -34,9 +200,13 @@ class Perceptron(object):
             the index of this perceptron in it's layer (for computing
             the error of hidden nodes).
         """
-        self.listDblW = map(float,listDblW)
+        self.listDblW = array.array('d', listDblW)
         self.dblW0 = float(dblW0)
         self.ix = int(ix)
+    def __getstate__(self):
+        return (self.listDblW, self.dblW0, self.ix)
+    def __setstate__(self, tplState):
+        self.listDblW,self.dblW0,self.ix = tplState
     def __repr__(self):
         tplSFormat = (list(self.listDblW), self.dblW0, self.ix)
         return "Perceptron(%r, %r, %r)" % tplSFormat
@@ -115,19 +285,12 @@ def hidden_error(listDblDownstreamDelta, pcpt, layerNext):
     >>> hidden_error([1.0, 0.75], pcpt, layer)
     3.0"""
 
-    # zip the two lists together so that each delta is tupled with a Perceptron
-    zipped = zip(listDblDownstreamDelta, layerNext.listPcpt)
-    
-    # sum the weights in each perceptron
-    # del_wt = map ((lambda (a,b): (a, sum(b.listDblW))), zipped)
-    del_wt = map ((lambda (a,b): (a, b.listDblW[pcpt.ix])), zipped)
-    
-    # multiply each delta times the summed list of weights for each Perceptron
-    multiplied = map ((lambda (c,d): c*d), del_wt)
-    
-    # add the whole list together to get the weighted total sum
-    return sum(multiplied)
-    
+    # multiply each downstream delta by the weight on the edge from pcpt
+    # into that downstream perceptron, and add the products together
+    ixPcpt = pcpt.ix
+    return sum([dblDelta*pcptNext.listDblW[ixPcpt] for dblDelta,pcptNext
+                in itertools.izip(listDblDownstreamDelta, layerNext.listPcpt)])
+
 def compute_delta(dblActivation, dblError):
     """Computes a delta value from activation and error.
 
@@ -167,17 +330,13 @@ def update_pcpt(pcpt, listDblInputs, dblDelta, dblLearningRate):
     >>> print pcpt
     Perceptron([1.25, 2.25, 3.25], 4.5, 0)"""
 
-    #multiplies each element in listDblInputs by the dblDelta
-    new_weights = []
-    for dblW, dblInput in zip(pcpt.listDblW, listDblInputs):
-        updt_wt = update_weight(dblW, dblLearningRate, dblInput, dblDelta)
-        new_weights.append(updt_wt)
+    #applies update_weight's rule to each weight, overwriting it in place
+    listDblW = pcpt.listDblW
+    for ix,dblInput in enumerate(listDblInputs):
+        listDblW[ix] += dblLearningRate * dblInput * dblDelta
 
-    #adds each element in new_weights with the perceptron's original weights
-    new_dblW0 = pcpt.dblW0 + (dblDelta * dblLearningRate)
-    
-    pcpt.listDblW = new_weights
-    pcpt.dblW0 = new_dblW0    
+    #updates the perceptron's fixed-input weight
+    pcpt.dblW0 += dblDelta * dblLearningRate
 
 def pcpt_activation(pcpt, listDblInput):
     """Compute a perceptron's activation function.
@@ -185,12 +344,12 @@ def pcpt_activation(pcpt, listDblInput):
     >>> pcpt = Perceptron([0.5,0.5,-1.5], 0.75, 0)
     >>> pcpt_activation(pcpt, [0.5,1.0,1.0])
     0.5"""
-    
-    return sigmoid(dot(pcpt.listDblW, listDblInput) + pcpt.dblW0)
+    return DEFAULT_SIGMOID(dot(pcpt.listDblW, listDblInput) + pcpt.dblW0)
 
-def feed_forward_layer(layer, listDblInput):
+def feed_forward_layer(layer, listDblInput, backend=None):
     """Build a list of activation levels for the perceptrons
-    in the layer recieving input listDblInput.
+    in the layer recieving input listDblInput, computing the sigmoid with
+    backend (by default, DEFAULT_SIGMOID).
 
     >>> pcpt1 = Perceptron([-1.0,2.0], 0.0, 0)
     >>> pcpt2 = Perceptron([-2.0,4.0], 0.0, 1)
@@ -199,12 +358,11 @@ def feed_forward_layer(layer, listDblInput):
     >>> feed_forward_layer(layer, listDblInput)
     [0.5, 0.5]"""
 
-    list_act_fun = []
-    #returns a list of activation functions for every pcpt in the layer
-    for pcpt in layer.listPcpt:
-        act_level = pcpt_activation(pcpt, listDblInput)
-        list_act_fun.append(act_level)
-    return list_act_fun
+    #the activation of every pcpt in the layer, as pcpt_activation
+    #computes it, with one call to the sigmoid backend for the whole layer
+    backend = backend or DEFAULT_SIGMOID
+    return backend.vector([dot(pcpt.listDblW, listDblInput) + pcpt.dblW0
+                           for pcpt in layer.listPcpt])
 
 class NeuralNet(object):
     """An artificial neural network."""
@@ -220,6 +378,8 @@ class NeuralNet(object):
                 raise TypeError("NeuralNet layers must be of type "
                                 "NeuralNetLayer.")
         self.listLayer = listLayer
+        # the sigmoid backend of this network, or None for DEFAULT_SIGMOID
+        self.sigmoid = None
     @classmethod
     def check_layers(cls, cInputs, listLayer):
         if not listLayer:
@@ -249,12 +409,15 @@ def build_layer_inputs_and_outputs(net, listDblInput):
     >>> net = init_net(listCLayerSize)
     >>> build_layer_inputs_and_outputs(net, [-1.0, 1.0]) # doctest: +ELLIPSIS
     ([[...], [...]], [[...], [...]])"""
+    if isinstance(net, MatrixNet):
+        return matrix_build_layer_inputs_and_outputs(net, listDblInput)
     lstInputs = []
     lstOutputs = []
     list_new_inputs = listDblInput
+    backend = net_sigmoid(net)
     for i in net.listLayer:
         lstInputs.append(list_new_inputs)
-        layerOutputs = feed_forward_layer(i, list_new_inputs)
+        layerOutputs = feed_forward_layer(i, list_new_inputs, backend)
         lstOutputs.append(layerOutputs)
         list_new_inputs = layerOutputs
     return (lstInputs, lstOutputs)
@@ -270,9 +433,8 @@ def layer_deltas(listDblActivation, listDblError):
     >>> layer_deltas([0.5, 0.25], [0.125, 0.0625])
     [0.03125, 0.01171875]"""
 
-    zipped = zip(listDblActivation, listDblError)
-    deltas = map((lambda (a,b): compute_delta(a,b)), zipped)
-    return deltas
+    return [compute_delta(dblActivation, dblError) for dblActivation,dblError
+            in itertools.izip(listDblActivation, listDblError)]
 
 def update_layer(layer, listDblInputs, listDblDelta,  dblLearningRate):
     """Update all perceptrons in the neural net layer.
@@ -288,10 +450,8 @@ def update_layer(layer, listDblInputs, listDblDelta,  dblLearningRate):
     >>> print layer.listPcpt
     [Perceptron([1.5, -1.5], 1.0, 0), Perceptron([-0.5, 0.5], 1.0, 1)]"""
     
-    zipped = zip(layer.listPcpt,listDblDelta)
-    updated_pcpts = map((lambda (pcpt,dblDelta): \
-    update_pcpt(pcpt, listDblInputs, dblDelta, dblLearningRate)), zipped)   
-
+    for pcpt,dblDelta in itertools.izip(layer.listPcpt, listDblDelta):
+        update_pcpt(pcpt, listDblInputs, dblDelta, dblLearningRate)
 
 def hidden_layer_error(layer, listDblDownstreamDelta, layerDownstream):
     """Determine the error produced by each node in a hidden layer, given the
@@ -303,8 +463,8 @@ def hidden_layer_error(layer, listDblDownstreamDelta, layerDownstream):
     >>> hidden_layer_error(layer, [2.0], layerDownstream)
     [1.5, 0.5]"""
     
-    return map((lambda x: \
-    hidden_error(listDblDownstreamDelta, x, layerDownstream)), layer.listPcpt)
+    return [hidden_error(listDblDownstreamDelta, pcpt, layerDownstream)
+            for pcpt in layer.listPcpt]
     
 
 class Instance(object):
@@ -326,6 +486,14 @@ class ImageInstance(Instance):
             for dblCol in listDblRow:
                 listDblFeatures.append(dblCol)
         super(ImageInstance,self).__init__(iLabel,listDblFeatures)
+    @classmethod
+    def from_features(cls, iLabel, listDblFeatures, cRow, cCol):
+        """Build an ImageInstance directly from its 1D features."""
+        inst = cls.__new__(cls)
+        Instance.__init__(inst, iLabel, listDblFeatures)
+        inst.cRow = cRow
+        inst.cCol = cCol
+        return inst
     def reconstruct_image(self):
         pass
 
@@ -416,6 +584,60 @@ def binary_decode_net_output(listDblOutput):
     
     return sum(lst)
 
+# The number of distinct labels in the data.
+LABEL_COUNT = 10
+
+class LabelEncoding(object):
+    """An immutable table of the encoding fxnEncode gives each of the
+    cLabels labels, computed once. Calling it encodes one label, like
+    fxnEncode, but returns the shared row of the table as a tuple rather
+    than building a new list."""
+    def __init__(self, fxnEncode, cLabels=LABEL_COUNT):
+        self.fxnEncode = fxnEncode
+        self.tplTplTarget = tuple(tuple(fxnEncode(iLabel))
+                                  for iLabel in xrange(cLabels))
+        self.cOutputs = len(self.tplTplTarget[0])
+    def __call__(self, iLabel):
+        return self.tplTplTarget[iLabel]
+    def encode_rows(self, listILabel):
+        """Returns the targets of a batch of labels, one row per label,
+        gathered from the table in one call."""
+        return map(self.tplTplTarget.__getitem__, listILabel)
+    def encode_block(self, listILabel):
+        """Returns the targets of a batch of labels as one row-major
+        matrix, in a flat double array."""
+        return array.array('d', itertools.chain.from_iterable(
+                self.encode_rows(listILabel)))
+
+# The LabelEncoding of each encoder passed to label_encoding, by encoder.
+LABEL_ENCODINGS = {}
+
+def label_encoding(fxnEncode):
+    """Returns the LabelEncoding of fxnEncode, building it on first use.
+
+    >>> label_encoding(distributed_encode_label)(2) == tuple(
+    ...     distributed_encode_label(2))
+    True"""
+    if isinstance(fxnEncode, LabelEncoding):
+        return fxnEncode
+    encoding = LABEL_ENCODINGS.get(fxnEncode)
+    if encoding is None:
+        encoding = LABEL_ENCODINGS[fxnEncode] = LabelEncoding(fxnEncode)
+    return encoding
+
+def decode_block(fxnDecode, listListDblOutput):
+    """Decode a batch of network outputs, one row per instance, by calling
+    fxnDecode on each row in turn, so that whatever fxnDecode currently
+    does is what decides the labels. Each call gets its own copy of the
+    row, since a decoder may overwrite its input, as
+    binary_decode_net_output does.
+
+    >>> decode_block(distributed_decode_net_output,
+    ...              [[0.1, 0.7, 0.2], [0.9, 0.05, 0.05]])
+    [1, 0]"""
+    return [fxnDecode(list(listDblOutput))
+            for listDblOutput in listListDblOutput]
+
 def get_weight(net, layer_id, perceptron_id, input_id):
     if input_id == -1:
         return net.listLayer[layer_id].listPcpt[perceptron_id].dblW0
@@ -435,27 +657,28 @@ def update_net(net, inst, dblLearningRate, listTargetOutputs):
     This function returns the list of outputs after feeding forward.  Weight
     updates are done in place.
     """
+    if isinstance(net, MatrixNet):
+        return matrix_update_net(net, inst, dblLearningRate, listTargetOutputs)
 
     l_ins, l_outs = build_layer_inputs_and_outputs(net, inst.listDblFeatures)
-    l_errs = []
-    l_acts = []
-    l_delts = []
+    l_errs = [None]*len(net.listLayer)
+    l_delts = [None]*len(net.listLayer)
 
     #builds the errors for the last layer (l_errs NOT COMPLETE AT THIS POINT)
     errs = []
     for i in range(len(l_outs[-1])):
         errs.append(output_error(l_outs[-1][i], listTargetOutputs[i]))
-    l_errs.append(errs)
+    l_errs[-1] = errs
 
     #calculates deltas for the last layer based on output error info
-    l_delts.append(layer_deltas(l_outs[-1], l_errs[-1]))
+    l_delts[-1] = layer_deltas(l_outs[-1], l_errs[-1])
 
     #calculates hidden errors for the rest of the layers and deltas
     for i in range(2, len(net.listLayer)+1): 
         cur_layer = net.listLayer[-i] 
         dwn_layr = net.listLayer[-i+1] 
-        l_errs.insert(0, hidden_layer_error(cur_layer, l_delts[-i+1], dwn_layr))
-        l_delts.insert(0, layer_deltas(l_outs[-i], l_errs[-i]))
+        l_errs[-i] = hidden_layer_error(cur_layer, l_delts[-i+1], dwn_layr)
+        l_delts[-i] = layer_deltas(l_outs[-i], l_errs[-i])
 
     #Finally, uses layers, inputs, deltas, and learning rate to update the net
     for i in range(len(net.listLayer)):
@@ -503,33 +726,1006 @@ def init_net(listCLayerSize, dblScale=0.01):
 
     return NeuralNet(num_inputs, list_layers)
 
-def load_data(sFilename, cMaxInstances=None):
-    """Load at most cMaxInstances instances from sFilename, or all instance
-    if cMaxInstances is None."""
-    listInst = []
+class MatrixLayer(object):
+    """A completely connected layer stored as one weight matrix and one
+    bias vector, rather than as a list of Perceptrons.
+
+    arrDblW is a flat, row-major array holding one row of cInputs weights
+    per unit, so the weight on input j of unit i is arrDblW[i*cInputs + j].
+    arrDblW0 holds the constant-input weight (w_0) of each unit."""
+    def __init__(self, cInputs, arrDblW, arrDblW0):
+        self.cInputs = int(cInputs)
+        if len(arrDblW) != self.cInputs*len(arrDblW0):
+            raise TypeError("Weight matrix size mismatch")
+        self.arrDblW = arrDblW
+        self.arrDblW0 = arrDblW0
+    def layer_input_size(self):
+        """Returns the number of inputs connected to each unit in this layer."""
+        return self.cInputs
+    def layer_output_size(self):
+        """Returns the number of units in this layer."""
+        return len(self.arrDblW0)
+    def row(self, ix):
+        """Returns a copy of the weights (w_1 to w_m) of unit ix."""
+        ixRow = ix*self.cInputs
+        return self.arrDblW[ixRow:ixRow + self.cInputs]
+    @classmethod
+    def from_layer(cls, layer):
+        """Copy the weights of a NeuralNetLayer into a new MatrixLayer."""
+        arrDblW = array.array('d')
+        for pcpt in layer.listPcpt:
+            arrDblW.extend(pcpt.listDblW)
+        arrDblW0 = array.array('d', [pcpt.dblW0 for pcpt in layer.listPcpt])
+        return cls(layer.cInputs, arrDblW, arrDblW0)
+    def to_layer(self):
+        """Copy the weights of this layer into a new NeuralNetLayer."""
+        listPcpt = [Perceptron(self.row(ix), dblW0, ix)
+                    for ix,dblW0 in enumerate(self.arrDblW0)]
+        return NeuralNetLayer(self.cInputs, listPcpt)
+
+class MatrixNet(object):
+    """An artificial neural network made of MatrixLayers.
+
+    This is an alternative engine for NeuralNet: feed_forward and
+    update_net accept either kind of network, but a MatrixNet runs each
+    step of backpropagation as one operation over the whole layer instead
+    of one call per perceptron. Use from_net and to_net to move between
+    the two representations."""
+    def __init__(self, cInputs, listLayer):
+        if not NeuralNet.check_layers(cInputs, listLayer):
+            raise TypeError("Incompatible neural network layers.")
+        for layer in listLayer:
+            if not isinstance(layer, MatrixLayer):
+                raise TypeError("MatrixNet layers must be of type "
+                                "MatrixLayer.")
+        self.cInputs = cInputs
+        self.listLayer = listLayer
+        self.scratch = None
+        self.sigmoid = None
+    def input_layer(self):
+        return self.listLayer[0]
+    def output_layer(self):
+        return self.listLayer[-1]
+    def get_scratch(self):
+        """Returns the NetScratch buffers for training this network,
+        allocating them on first use."""
+        if self.scratch is None:
+            self.scratch = NetScratch(self)
+        return self.scratch
+    @classmethod
+    def from_net(cls, net):
+        """Copy the weights and sigmoid backend of a NeuralNet into a new
+        MatrixNet."""
+        mnet = cls(net.cInputs, map(MatrixLayer.from_layer, net.listLayer))
+        mnet.sigmoid = net.sigmoid
+        return mnet
+    def to_net(self):
+        """Copy the weights of this network into a new NeuralNet, giving
+        the Perceptron/NeuralNetLayer view of the network."""
+        net = NeuralNet(self.cInputs,
+                        [layer.to_layer() for layer in self.listLayer])
+        net.sigmoid = self.sigmoid
+        return net
+    def copy_to(self, net):
+        """Overwrite the weights of the NeuralNet net, which must have the
+        same shape, with the weights of this network."""
+        for mlayer,layer in zip(self.listLayer, net.listLayer):
+            for pcpt in layer.listPcpt:
+                pcpt.listDblW[:] = mlayer.row(pcpt.ix)
+                pcpt.dblW0 = mlayer.arrDblW0[pcpt.ix]
+
+class NetScratch(object):
+    """Buffers matrix_update_net reuses for every instance it trains a
+    MatrixNet on: for each layer, the activations it produced, the deltas
+    of its units and its inputs scaled by the learning rate. They are
+    overwritten in place, so training one instance builds no lists."""
+    def __init__(self, net):
+        self.listArrDblOutput = []
+        self.listArrDblDelta = []
+        self.listArrDblScaled = []
+        for layer in net.listLayer:
+            cOutputs = layer.layer_output_size()
+            self.listArrDblOutput.append(array.array('d', [0.0])*cOutputs)
+            self.listArrDblDelta.append(array.array('d', [0.0])*cOutputs)
+            self.listArrDblScaled.append(
+                array.array('d', [0.0])*layer.cInputs)
+
+class WeightSnapshot(object):
+    """A buffer holding a copy of the weights of a NeuralNet or MatrixNet,
+    one weight matrix and bias vector per layer in the layout MatrixLayer
+    uses. The buffer is allocated once; save and restore copy weights
+    into and out of it in place, so keeping the best weights seen during
+    training does not deep-copy the network every time they improve."""
+    def __init__(self, net):
+        self.listArrDblW = []
+        self.listArrDblW0 = []
+        for layer in net.listLayer:
+            cOutputs = layer.layer_output_size()
+            self.listArrDblW.append(
+                array.array('d', [0.0])*(layer.cInputs*cOutputs))
+            self.listArrDblW0.append(array.array('d', [0.0])*cOutputs)
+        self.save(net)
+    def save(self, net):
+        """Copy the weights of net, which must have the shape the snapshot
+        was made for, into the buffer."""
+        for layer,arrDblW,arrDblW0 in zip(net.listLayer, self.listArrDblW,
+                                          self.listArrDblW0):
+            if isinstance(layer, MatrixLayer):
+                if isinstance(layer.arrDblW, array.array):
+                    arrDblW[:] = layer.arrDblW
+                    arrDblW0[:] = layer.arrDblW0
+                else:
+                    arrDblW[:] = array.array('d', layer.arrDblW)
+                    arrDblW0[:] = array.array('d', layer.arrDblW0)
+                continue
+            cInputs = layer.cInputs
+            for pcpt in layer.listPcpt:
+                ixRow = pcpt.ix*cInputs
+                arrDblW[ixRow:ixRow + cInputs] = pcpt.listDblW
+                arrDblW0[pcpt.ix] = pcpt.dblW0
+    def restore(self, net):
+        """Overwrite the weights of net with the weights in the buffer."""
+        for layer,arrDblW,arrDblW0 in zip(net.listLayer, self.listArrDblW,
+                                          self.listArrDblW0):
+            if isinstance(layer, MatrixLayer):
+                layer.arrDblW[:] = arrDblW
+                layer.arrDblW0[:] = arrDblW0
+                continue
+            cInputs = layer.cInputs
+            for pcpt in layer.listPcpt:
+                ixRow = pcpt.ix*cInputs
+                pcpt.listDblW[:] = arrDblW[ixRow:ixRow + cInputs]
+                pcpt.dblW0 = arrDblW0[pcpt.ix]
+
+def matrix_feed_forward_layer(layer, listDblInput, backend=None):
+    """Whole-layer version of feed_forward_layer for a MatrixLayer.
+
+    >>> layer = MatrixLayer(2, array.array('d', [-1.0, 2.0, -2.0, 4.0]),
+    ...                     array.array('d', [0.0, 0.0]))
+    >>> matrix_feed_forward_layer(layer, [0.5, 0.25])
+    [0.5, 0.5]"""
+    cInputs = layer.cInputs
+    if len(listDblInput) != cInputs:
+        raise ValueError("Incompatible lengths")
+    arrDblW = layer.arrDblW
+    mul = operator.mul
+    listDblSum = []
+    for ix,dblW0 in enumerate(layer.arrDblW0):
+        ixRow = ix*cInputs
+        dblSum = sum(map(mul, arrDblW[ixRow:ixRow + cInputs], listDblInput))
+        listDblSum.append(dblSum + dblW0)
+    return (backend or DEFAULT_SIGMOID).vector(listDblSum)
+
+def matrix_build_layer_inputs_and_outputs(net, listDblInput):
+    """Whole-layer version of build_layer_inputs_and_outputs for a
+    MatrixNet."""
+    listListDblInput = []
+    listListDblOutput = []
+    backend = net_sigmoid(net)
+    for layer in net.listLayer:
+        listListDblInput.append(listDblInput)
+        listDblInput = matrix_feed_forward_layer(layer, listDblInput, backend)
+        listListDblOutput.append(listDblInput)
+    return (listListDblInput, listListDblOutput)
+
+def matrix_layer_deltas(listDblActivation, listDblError):
+    """Whole-layer version of layer_deltas.
+
+    >>> matrix_layer_deltas([0.5, 0.25], [0.125, 0.0625])
+    [0.03125, 0.01171875]"""
+    return [dblError*dblActivation*(1 - dblActivation)
+            for dblActivation,dblError in zip(listDblActivation,
+                                              listDblError)]
+
+def matrix_hidden_layer_error(layer, listDblDownstreamDelta, layerDownstream):
+    """Whole-layer version of hidden_layer_error for MatrixLayers. The
+    error of unit j is the dot product of the downstream deltas with
+    column j of the downstream weight matrix.
+
+    >>> layer = MatrixLayer(0, array.array('d'), array.array('d', [0.0, 0.0]))
+    >>> layerDownstream = MatrixLayer(2, array.array('d', [0.75, 0.25]),
+    ...                               array.array('d', [0.0]))
+    >>> matrix_hidden_layer_error(layer, [2.0], layerDownstream)
+    [1.5, 0.5]"""
+    cColumns = layerDownstream.cInputs
+    arrDblW = layerDownstream.arrDblW
+    mul = operator.mul
+    return [sum(map(mul, listDblDownstreamDelta, arrDblW[ix::cColumns]))
+            for ix in xrange(layer.layer_output_size())]
+
+def matrix_update_layer(layer, listDblInputs, listDblDelta, dblLearningRate):
+    """Whole-layer version of update_layer for a MatrixLayer. Each row of
+    the weight matrix is rewritten in place in a single slice assignment.
+
+    >>> layer = MatrixLayer(2, array.array('d', [1.0, -1.0, -1.0, 1.0]),
+    ...                     array.array('d', [0.0, 0.0]))
+    >>> matrix_update_layer(layer, [0.5,-0.5], [2.0,2.0], 0.5)
+    >>> print layer.to_layer().listPcpt
+    [Perceptron([1.5, -1.5], 1.0, 0), Perceptron([-0.5, 0.5], 1.0, 1)]"""
+    cInputs = layer.cInputs
+    arrDblW = layer.arrDblW
+    arrDblW0 = layer.arrDblW0
+    listDblScaled = [dblLearningRate*dblInput for dblInput in listDblInputs]
+    for ix,dblDelta in enumerate(listDblDelta):
+        ixRow = ix*cInputs
+        ixEnd = ixRow + cInputs
+        arrDblW[ixRow:ixEnd] = array.array('d', [
+            dblW + dblScaled*dblDelta for dblW,dblScaled
+            in zip(arrDblW[ixRow:ixEnd], listDblScaled)])
+        arrDblW0[ix] += dblDelta*dblLearningRate
+
+def matrix_update_net(net, inst, dblLearningRate, listTargetOutputs):
+    """Whole-layer version of update_net for a MatrixNet. Given the same
+    weights, it makes exactly the same updates as update_net.
+
+    Activations, deltas and scaled inputs are written into the network's
+    NetScratch buffers and the weights are updated in place, all by index
+    rather than through slices, so the only object built per instance is
+    the returned copy of the outputs."""
+    listDblFeatures = inst.listDblFeatures
+    if len(listDblFeatures) != net.cInputs:
+        raise ValueError("Incompatible lengths")
+    scratch = net.get_scratch()
+    listLayer = net.listLayer
+    listArrDblOutput = scratch.listArrDblOutput
+    listArrDblDelta = scratch.listArrDblDelta
+    listArrDblScaled = scratch.listArrDblScaled
+    cLayer = len(listLayer)
+    backend = net_sigmoid(net)
+
+    # feed forward, one row of the weight matrix per unit, summed in the
+    # same order as update_net so the results agree bit for bit
+    listDblInput = listDblFeatures
+    for ixLayer in xrange(cLayer):
+        layer = listLayer[ixLayer]
+        arrDblW = layer.arrDblW
+        arrDblW0 = layer.arrDblW0
+        arrDblOutput = listArrDblOutput[ixLayer]
+        ixW = 0
+        for ix in xrange(len(arrDblOutput)):
+            dblSum = 0.0
+            for dblInput in listDblInput:
+                dblSum += arrDblW[ixW]*dblInput
+                ixW += 1
+            arrDblOutput[ix] = dblSum + arrDblW0[ix]
+        backend.apply(arrDblOutput)
+        listDblInput = arrDblOutput
+
+    # output deltas, from output_error and compute_delta
+    arrDblOutput = listArrDblOutput[-1]
+    arrDblDelta = listArrDblDelta[-1]
+    for ix in xrange(len(arrDblOutput)):
+        dblActivation = arrDblOutput[ix]
+        dblError = listTargetOutputs[ix] - dblActivation
+        arrDblDelta[ix] = dblError*dblActivation*(1 - dblActivation)
+
+    # hidden deltas, one column of the downstream weight matrix per unit
+    for ixLayer in xrange(cLayer - 2, -1, -1):
+        layerDownstream = listLayer[ixLayer+1]
+        cColumns = layerDownstream.cInputs
+        arrDblWDownstream = layerDownstream.arrDblW
+        arrDblDeltaDownstream = listArrDblDelta[ixLayer+1]
+        arrDblOutput = listArrDblOutput[ixLayer]
+        arrDblDelta = listArrDblDelta[ixLayer]
+        for ix in xrange(cColumns):
+            dblError = 0.0
+            ixW = ix
+            for dblDeltaDownstream in arrDblDeltaDownstream:
+                dblError += dblDeltaDownstream*arrDblWDownstream[ixW]
+                ixW += cColumns
+            dblActivation = arrDblOutput[ix]
+            arrDblDelta[ix] = dblError*dblActivation*(1 - dblActivation)
+
+    # update the weights in place, walking each matrix in storage order
+    listDblInput = listDblFeatures
+    for ixLayer in xrange(cLayer):
+        layer = listLayer[ixLayer]
+        arrDblW = layer.arrDblW
+        arrDblW0 = layer.arrDblW0
+        arrDblDelta = listArrDblDelta[ixLayer]
+        arrDblScaled = listArrDblScaled[ixLayer]
+        for ix in xrange(len(arrDblScaled)):
+            arrDblScaled[ix] = dblLearningRate*listDblInput[ix]
+        ixW = 0
+        for ix in xrange(len(arrDblDelta)):
+            dblDelta = arrDblDelta[ix]
+            for dblScaled in arrDblScaled:
+                arrDblW[ixW] += dblScaled*dblDelta
+                ixW += 1
+            arrDblW0[ix] += dblDelta*dblLearningRate
+        listDblInput = listArrDblOutput[ixLayer]
+    return listArrDblOutput[-1].tolist()
+
+def matrix_feed_forward_block(layer, listListDblInput, backend=None):
+    """Feed a block of inputs through a MatrixLayer at once, returning one
+    list of activations per input. Each row of the weight matrix is read
+    once for the whole block, and every activation is computed exactly as
+    matrix_feed_forward_layer would compute it."""
+    cInputs = layer.cInputs
+    for listDblInput in listListDblInput:
+        if len(listDblInput) != cInputs:
+            raise ValueError("Incompatible lengths")
+    arrDblW = layer.arrDblW
+    mul = operator.mul
+    listListDblSum = [[] for _ in listListDblInput]
+    for ix,dblW0 in enumerate(layer.arrDblW0):
+        ixRow = ix*cInputs
+        arrDblRow = arrDblW[ixRow:ixRow + cInputs]
+        for listDblSum,listDblInput in zip(listListDblSum, listListDblInput):
+            dblSum = sum(map(mul, arrDblRow, listDblInput))
+            listDblSum.append(dblSum + dblW0)
+    fxnVector = (backend or DEFAULT_SIGMOID).vector
+    return [fxnVector(listDblSum) for listDblSum in listListDblSum]
+
+def matrix_hidden_layer_error_block(layer, listListDblDownstreamDelta,
+                                    layerDownstream):
+    """Block version of matrix_hidden_layer_error: one list of hidden
+    errors per instance, reading each column of the downstream weight
+    matrix once for the whole block."""
+    cColumns = layerDownstream.cInputs
+    arrDblW = layerDownstream.arrDblW
+    mul = operator.mul
+    listListDblError = [[] for _ in listListDblDownstreamDelta]
+    for ix in xrange(layer.layer_output_size()):
+        arrDblColumn = arrDblW[ix::cColumns]
+        for listDblError,listDblDelta in zip(listListDblError,
+                                             listListDblDownstreamDelta):
+            listDblError.append(sum(map(mul, listDblDelta, arrDblColumn)))
+    return listListDblError
+
+def matrix_layer_step_block(layer, listListDblInputs, listListDblDelta,
+                            dblLearningRate):
+    """Sum the updates update_layer would make to a MatrixLayer for each
+    instance of a block. Returns the summed updates to the weights, as a
+    flat row-major array shaped like layer.arrDblW, and the summed updates
+    to the constant-input weights."""
+    cInputs = layer.cInputs
+    listListDblScaled = [[dblLearningRate*dblInput for dblInput in listDblIn]
+                         for listDblIn in listListDblInputs]
+    arrDblStep = array.array('d')
+    arrDblStep0 = array.array('d')
+    for ix in xrange(layer.layer_output_size()):
+        listDblStep = [0.0]*cInputs
+        dblStep0 = 0.0
+        for listDblScaled,listDblDelta in zip(listListDblScaled,
+                                              listListDblDelta):
+            dblDelta = listDblDelta[ix]
+            listDblStep = [dblStep + dblScaled*dblDelta for dblStep,dblScaled
+                           in zip(listDblStep, listDblScaled)]
+            dblStep0 += dblDelta*dblLearningRate
+        arrDblStep.extend(listDblStep)
+        arrDblStep0.append(dblStep0)
+    return arrDblStep,arrDblStep0
+
+def matrix_apply_layer_step(layer, arrDblStep, arrDblStep0):
+    """Add updates shaped as matrix_layer_step_block returns them to the
+    weights of a MatrixLayer."""
+    cInputs = layer.cInputs
+    arrDblW = layer.arrDblW
+    arrDblW0 = layer.arrDblW0
+    for ix in xrange(layer.layer_output_size()):
+        ixRow = ix*cInputs
+        ixEnd = ixRow + cInputs
+        arrDblW[ixRow:ixEnd] = array.array('d', [
+            dblW + dblStep for dblW,dblStep
+            in zip(arrDblW[ixRow:ixEnd], arrDblStep[ixRow:ixEnd])])
+        arrDblW0[ix] += arrDblStep0[ix]
+
+def matrix_update_layer_block(layer, listListDblInputs, listListDblDelta,
+                              dblLearningRate):
+    """Block version of matrix_update_layer. The updates update_layer would
+    make for each instance are summed, and the sum is added to the weights
+    once. For a block of one instance this is exactly matrix_update_layer.
+    """
+    arrDblStep,arrDblStep0 = matrix_layer_step_block(
+        layer, listListDblInputs, listListDblDelta, dblLearningRate)
+    matrix_apply_layer_step(layer, arrDblStep, arrDblStep0)
+
+def matrix_net_step_block(net, listInst, dblLearningRate, listListDblTarget):
+    """Run the forward and backward passes of matrix_update_net_block over
+    a block, without changing the network. Returns the summed updates to
+    each layer, as (arrDblStep, arrDblStep0) pairs from
+    matrix_layer_step_block, and the list of network outputs, one per
+    instance."""
+    listLayer = net.listLayer
+    listListListDblIn = []
+    listListListDblOut = []
+    listListDblInput = [inst.listDblFeatures for inst in listInst]
+    backend = net_sigmoid(net)
+    for layer in listLayer:
+        listListListDblIn.append(listListDblInput)
+        listListDblInput = matrix_feed_forward_block(layer, listListDblInput,
+                                                     backend)
+        listListListDblOut.append(listListDblInput)
+    listListListDblDelta = [None]*len(listLayer)
+    listListDblDelta = []
+    for listDblOut,listDblTarget in zip(listListListDblOut[-1],
+                                        listListDblTarget):
+        listDblError = [output_error(dblOut, dblTarget) for dblOut,dblTarget
+                        in zip(listDblOut, listDblTarget)]
+        listListDblDelta.append(matrix_layer_deltas(listDblOut, listDblError))
+    listListListDblDelta[-1] = listListDblDelta
+    for ix in xrange(len(listLayer) - 2, -1, -1):
+        listListDblError = matrix_hidden_layer_error_block(
+            listLayer[ix], listListListDblDelta[ix+1], listLayer[ix+1])
+        listListListDblDelta[ix] = [
+            matrix_layer_deltas(listDblOut, listDblError)
+            for listDblOut,listDblError in zip(listListListDblOut[ix],
+                                               listListDblError)]
+    listTplStep = [matrix_layer_step_block(layer, listListListDblIn[ix],
+                                           listListListDblDelta[ix],
+                                           dblLearningRate)
+                   for ix,layer in enumerate(listLayer)]
+    return listTplStep,listListListDblOut[-1]
+
+def matrix_update_net_block(net, listInst, dblLearningRate,
+                            listListDblTarget):
+    """Block version of matrix_update_net: the forward and backward passes
+    run over the whole block one layer at a time, and each layer receives
+    one accumulated update. Returns the list of network outputs, one per
+    instance."""
+    listTplStep,listListDblOut = matrix_net_step_block(
+        net, listInst, dblLearningRate, listListDblTarget)
+    for layer,(arrDblStep,arrDblStep0) in zip(net.listLayer, listTplStep):
+        matrix_apply_layer_step(layer, arrDblStep, arrDblStep0)
+    return listListDblOut
+
+def init_matrix_net(listCLayerSize, dblScale=0.01):
+    """Build a MatrixNet exactly as init_net would build a NeuralNet. Both
+    draw the same random weights, so with the same random seed they start
+    out as the same network."""
+    return MatrixNet.from_net(init_net(listCLayerSize, dblScale))
+
+def update_net_batch(net, listInst, dblLearningRate, listListDblTarget):
+    """Update the weights of a neural network once for a whole block of
+    instances, listListDblTarget holding the target outputs for each.
+
+    The updates update_net would compute for each instance, all taken
+    against the weights from before the block, are summed and applied
+    together. A block of one instance gives exactly the same result as
+    update_net. Returns the list of network outputs, one per instance.
+
+    A block of one goes to update_net, which trains a MatrixNet through
+    its preallocated NetScratch buffers."""
+    if len(listInst) == 1:
+        return [update_net(net, listInst[0], dblLearningRate,
+                           listListDblTarget[0])]
+    if isinstance(net, MatrixNet):
+        return matrix_update_net_block(net, listInst, dblLearningRate,
+                                       listListDblTarget)
+    mnet = MatrixNet.from_net(net)
+    listListDblOut = matrix_update_net_block(mnet, listInst, dblLearningRate,
+                                             listListDblTarget)
+    mnet.copy_to(net)
+    return listListDblOut
+
+def split_batches(listInst, cBatchSize):
+    """Yield consecutive blocks of at most cBatchSize instances.
+
+    >>> list(split_batches(range(5), 2))
+    [[0, 1], [2, 3], [4]]"""
+    if cBatchSize < 1:
+        raise ValueError("Batch size must be at least 1.")
+    for ixStart in xrange(0, len(listInst), cBatchSize):
+        yield listInst[ixStart:ixStart + cBatchSize]
+
+# The number of instances predict_batch feeds through the network together.
+PREDICT_CHUNK_SIZE = 512
+
+def predict_batch(net, listListDblFeatures,
+                  fxnDecode=distributed_decode_net_output,
+                  cChunkSize=PREDICT_CHUNK_SIZE):
+    """Feed every row of listListDblFeatures through net, cChunkSize rows
+    at a time, or all at once if cChunkSize is None. Each weight row is
+    read once per chunk rather than once per instance.
+
+    Returns the list of network outputs, exactly as feed_forward would
+    compute them, and the list of labels fxnDecode decodes from them.
+
+    >>> net = init_net([2,2,3])
+    >>> listListDblOut,listILabel = predict_batch(net, [[0.0,1.0],[1.0,0.0]])
+    >>> listListDblOut == [feed_forward(net, [0.0,1.0]),
+    ...                    feed_forward(net, [1.0,0.0])]
+    True
+    >>> listILabel == [distributed_decode_net_output(listDblOut)
+    ...                for listDblOut in listListDblOut]
+    True"""
+    if not isinstance(net, MatrixNet):
+        net = MatrixNet.from_net(net)
+    listListDblOutput = []
+    cChunkSize = cChunkSize or max(len(listListDblFeatures), 1)
+    backend = net_sigmoid(net)
+    for listListDblBlock in split_batches(listListDblFeatures, cChunkSize):
+        for layer in net.listLayer:
+            listListDblBlock = matrix_feed_forward_block(layer,
+                                                         listListDblBlock,
+                                                         backend)
+        listListDblOutput.extend(listListDblBlock)
+    return listListDblOutput,decode_block(fxnDecode, listListDblOutput)
+
+def parse_instances(sFilename):
+    """Parse the text file sFilename one instance at a time, yielding each
+    one as an ImageInstance. The file is only read as far as the instances
+    taken from the generator."""
+    infile = open(sFilename)
     try:
-        infile = open(sFilename)
         listInputs = []
         iLabel = None
         for sLine in infile:
             if sLine.startswith('#'):
                 if iLabel is not None:
-                    listInst.append(ImageInstance(iLabel, listInputs))
-                    if (cMaxInstances is not None and
-                        len(listInst) >= cMaxInstances):
-                        break
+                    yield ImageInstance(iLabel, listInputs)
                     listInputs = []
                 iLabel = int(sLine.split('#')[-1])
             else:
                 listInputs.append([float(s)/255.0 for s in sLine.split()])
         if iLabel is not None:
-            listInst.append(ImageInstance(iLabel, listInputs))
+            yield ImageInstance(iLabel, listInputs)
+    finally:
+        infile.close()
+
+def parse_data(sFilename, cMaxInstances=None):
+    """Parse at most cMaxInstances instances from the text file sFilename,
+    or all instance if cMaxInstances is None."""
+    return list(itertools.islice(parse_instances(sFilename), cMaxInstances))
+
+CACHE_SUFFIX = ".nncache"
+CACHE_MAGIC = "NNCACHE1"
+# magic, byte order, source size, source mtime, instances, features, rows,
+# columns
+CACHE_HEADER = struct.Struct("=8scQdIIII")
+CACHE_LABEL_SIZE = array.array('i').itemsize
+CACHE_FEATURE_SIZE = array.array('d').itemsize
+
+def cache_filename(sFilename):
+    """Returns the path of the binary sidecar cache for sFilename."""
+    return sFilename + CACHE_SUFFIX
+
+def replace_file(sFilename, fxnWrite):
+    """Call fxnWrite with a binary file object open on a temporary file
+    next to sFilename, then rename the temporary file to sFilename. Readers
+    see either the old file or the complete new one, never a partial
+    file. The temporary file is removed if anything fails."""
+    fd,sTmpFilename = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(sFilename)))
+    try:
+        outfile = os.fdopen(fd, 'wb')
+        try:
+            fxnWrite(outfile)
+        finally:
+            outfile.close()
+        os.chmod(sTmpFilename, 0644)
+        os.rename(sTmpFilename, sFilename)
+    except:
+        if os.path.exists(sTmpFilename):
+            os.remove(sTmpFilename)
+        raise
+
+def write_data_cache(sFilename, listInst):
+    """Save listInst, parsed from sFilename, to the binary sidecar cache of
+    sFilename.
+
+    The sidecar holds a header recording the size and modification time
+    of sFilename, followed by an int array of labels and a row-major double
+    array of features, one row per instance. It is written to a temporary
+    file and renamed into place, so concurrent loaders never see a
+    partial cache. Returns False without writing anything if the instances
+    are not all images of the same shape or the cache cannot be written."""
+    if not listInst:
+        return False
+    instFirst = listInst[0]
+    tplShape = (len(instFirst.listDblFeatures), instFirst.cRow,
+                instFirst.cCol)
+    arrILabel = array.array('i')
+    arrDblFeatures = array.array('d')
+    for inst in listInst:
+        if (len(inst.listDblFeatures),inst.cRow,inst.cCol) != tplShape:
+            return False
+        arrILabel.append(inst.iLabel)
+        arrDblFeatures.extend(inst.listDblFeatures)
+    st = os.stat(sFilename)
+    sHeader = CACHE_HEADER.pack(CACHE_MAGIC, sys.byteorder[0], st.st_size,
+                                st.st_mtime, len(listInst), *tplShape)
+    def write(outfile):
+        outfile.write(sHeader)
+        arrILabel.tofile(outfile)
+        arrDblFeatures.tofile(outfile)
+    try:
+        replace_file(cache_filename(sFilename), write)
+    except (IOError, OSError):
+        return False
+    return True
+
+def map_data_cache(sFilename):
+    """Memory-map the binary sidecar cache of sFilename. Returns None if
+    there is no cache, or if it does not match the current size and
+    modification time of sFilename. Otherwise returns the open cache file,
+    the map, and the number of instances, features, rows and columns it
+    holds; the caller must close the map and the file."""
+    sCacheFilename = cache_filename(sFilename)
+    try:
+        st = os.stat(sFilename)
+        infile = open(sCacheFilename, 'rb')
+    except (IOError, OSError):
+        return None
+    try:
+        mm = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+        infile.close()
+        return None
+    fValid = False
+    try:
+        if len(mm) < CACHE_HEADER.size:
+            return None
+        (sMagic, sByteOrder, cSize, dblMtime, cInst,
+         cFeatures, cRow, cCol) = CACHE_HEADER.unpack_from(mm)
+        if (sMagic != CACHE_MAGIC or sByteOrder != sys.byteorder[0]
+            or cSize != st.st_size or dblMtime != st.st_mtime):
+            return None
+        if (len(mm) != CACHE_HEADER.size + cInst*CACHE_LABEL_SIZE
+            + cInst*cFeatures*CACHE_FEATURE_SIZE):
+            return None
+        fValid = True
+    finally:
+        if not fValid:
+            mm.close()
+            infile.close()
+    return infile,mm,cInst,cFeatures,cRow,cCol
+
+def read_cache_block(mm, cInst, cFeatures, ixStart, ixEnd):
+    """Read the labels and features of instances ixStart to ixEnd from a
+    cache of cInst instances mapped by map_data_cache. Returns an int array
+    of labels and a row-major double array of features."""
+    arrILabel = array.array('i')
+    arrDblFeatures = array.array('d')
+    arrILabel.fromstring(buffer(mm, CACHE_HEADER.size
+                                + ixStart*CACHE_LABEL_SIZE,
+                                (ixEnd - ixStart)*CACHE_LABEL_SIZE))
+    cBytesRow = cFeatures*CACHE_FEATURE_SIZE
+    arrDblFeatures.fromstring(buffer(mm, CACHE_HEADER.size
+                                     + cInst*CACHE_LABEL_SIZE
+                                     + ixStart*cBytesRow,
+                                     (ixEnd - ixStart)*cBytesRow))
+    return arrILabel,arrDblFeatures
+
+def read_data_cache(sFilename, cMaxInstances=None):
+    """Load at most cMaxInstances instances from the binary sidecar cache
+    of sFilename by memory-mapping it. Returns None if there is no cache,
+    or if it does not match the current size and modification time of
+    sFilename."""
+    tplCache = map_data_cache(sFilename)
+    if tplCache is None:
+        return None
+    infile,mm,cInst,cFeatures,cRow,cCol = tplCache
+    try:
+        cRead = cInst
+        if cMaxInstances is not None:
+            cRead = min(cInst, cMaxInstances)
+        arrILabel,arrDblFeatures = read_cache_block(mm, cInst, cFeatures, 0,
+                                                    cRead)
     finally:
+        mm.close()
         infile.close()
+    listInst = []
+    for ix,iLabel in enumerate(arrILabel):
+        ixRow = ix*cFeatures
+        listDblFeatures = arrDblFeatures[ixRow:ixRow + cFeatures].tolist()
+        listInst.append(ImageInstance.from_features(iLabel, listDblFeatures,
+                                                    cRow, cCol))
     return listInst
 
+def load_data(sFilename, cMaxInstances=None, fUseCache=True):
+    """Load at most cMaxInstances instances from sFilename, or all instance
+    if cMaxInstances is None.
+
+    Unless fUseCache is False, the first load parses all of sFilename and
+    saves it to a binary sidecar cache (see write_data_cache). Later loads
+    memory-map the sidecar instead of parsing the text again, as long as
+    sFilename has not changed since."""
+    if not fUseCache:
+        return parse_data(sFilename, cMaxInstances)
+    listInst = read_data_cache(sFilename, cMaxInstances)
+    if listInst is None:
+        listInst = parse_data(sFilename)
+        write_data_cache(sFilename, listInst)
+        if cMaxInstances is not None:
+            listInst = listInst[:cMaxInstances]
+    return listInst
+
+CHECKPOINT_MAGIC = "NNCKPT01"
+# magic, byte order, rounds completed, learning rate, layers, random state
+# version, random state words, whether there is a saved gaussian, gaussian
+CHECKPOINT_HEADER = struct.Struct("=8scIdIIIId")
+
+class Checkpoint(object):
+    """A network together with the state needed to resume training it: the
+    number of rounds it has been trained for, the learning rate, and the
+    state of the random module (random.getstate()), or None."""
+    def __init__(self, net, cRound=0, dblLearningRate=0.0,
+                 tplRandomState=None):
+        self.net = net
+        self.cRound = cRound
+        self.dblLearningRate = dblLearningRate
+        self.tplRandomState = tplRandomState
+
+def save_checkpoint(sFilename, net, cRound=0, dblLearningRate=0.0,
+                    tplRandomState=None):
+    """Save a NeuralNet or MatrixNet, and the training state described in
+    Checkpoint, to the binary checkpoint file sFilename.
+
+    The file holds a header, the layer sizes as an unsigned int array, the
+    words of the random state, and then the weight matrix and bias vector
+    of each layer as double arrays, in the layout MatrixLayer uses. Like
+    the data cache, it is replaced atomically."""
+    if not isinstance(net, MatrixNet):
+        net = MatrixNet.from_net(net)
+    arrCLayerSize = array.array('I', [net.cInputs])
+    arrCLayerSize.extend(layer.layer_output_size() for layer in net.listLayer)
+    iRandomVersion = 0
+    arrIRandomState = array.array('I')
+    dblGauss = None
+    if tplRandomState is not None:
+        iRandomVersion,tplIState,dblGauss = tplRandomState
+        arrIRandomState.extend(tplIState)
+    sHeader = CHECKPOINT_HEADER.pack(
+        CHECKPOINT_MAGIC, sys.byteorder[0], cRound, dblLearningRate,
+        len(net.listLayer), iRandomVersion, len(arrIRandomState),
+        dblGauss is not None, dblGauss or 0.0)
+    def write(outfile):
+        outfile.write(sHeader)
+        arrCLayerSize.tofile(outfile)
+        arrIRandomState.tofile(outfile)
+        for layer in net.listLayer:
+            array.array('d', layer.arrDblW).tofile(outfile)
+            array.array('d', layer.arrDblW0).tofile(outfile)
+    replace_file(sFilename, write)
+
+def load_checkpoint(sFilename):
+    """Load a Checkpoint saved by save_checkpoint by memory-mapping
+    sFilename. The network is loaded as a MatrixNet; raises ValueError if
+    sFilename is not a checkpoint written on a machine of the same byte
+    order.
+
+    The weights are copied out of the map into arrays of their own, since
+    training updates them in place and the map is read-only, so loading
+    reads the whole file. The map only saves reading it into a string
+    first."""
+    infile = open(sFilename, 'rb')
+    try:
+        mm = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(mm) < CHECKPOINT_HEADER.size:
+                raise ValueError("Not a checkpoint: %s" % sFilename)
+            (sMagic, sByteOrder, cRound, dblLearningRate, cLayers,
+             iRandomVersion, cRandomState, fGauss,
+             dblGauss) = CHECKPOINT_HEADER.unpack_from(mm)
+            if sMagic != CHECKPOINT_MAGIC or sByteOrder != sys.byteorder[0]:
+                raise ValueError("Not a checkpoint: %s" % sFilename)
+            ixOffset = CHECKPOINT_HEADER.size
+            def read(sTypecode, cItems):
+                arr = array.array(sTypecode)
+                cBytes = cItems*arr.itemsize
+                if ixOffset + cBytes > len(mm):
+                    raise ValueError("Truncated checkpoint: %s" % sFilename)
+                arr.fromstring(buffer(mm, ixOffset, cBytes))
+                return arr,ixOffset + cBytes
+            arrCLayerSize,ixOffset = read('I', cLayers + 1)
+            arrIRandomState,ixOffset = read('I', cRandomState)
+            listLayer = []
+            for cInputs,cOutputs in zip(arrCLayerSize[:-1],
+                                        arrCLayerSize[1:]):
+                arrDblW,ixOffset = read('d', cInputs*cOutputs)
+                arrDblW0,ixOffset = read('d', cOutputs)
+                listLayer.append(MatrixLayer(cInputs, arrDblW, arrDblW0))
+            if ixOffset != len(mm):
+                raise ValueError("Trailing data in checkpoint: %s"
+                                 % sFilename)
+        finally:
+            mm.close()
+    finally:
+        infile.close()
+    tplRandomState = None
+    if iRandomVersion:
+        tplRandomState = (iRandomVersion,
+                          tuple(int(i) for i in arrIRandomState),
+                          dblGauss if fGauss else None)
+    return Checkpoint(MatrixNet(arrCLayerSize[0], listLayer), cRound,
+                      dblLearningRate, tplRandomState)
+
+# The number of instances stream_data reads at a time.
+STREAM_CHUNK_SIZE = 1024
+
+def stream_data(sFilename, cChunkSize=STREAM_CHUNK_SIZE, cMaxInstances=None):
+    """Read at most cMaxInstances instances from sFilename, or all of them
+    if cMaxInstances is None, cChunkSize instances at a time, without ever
+    holding more than one chunk in memory.
+
+    Yields one (arrILabel, arrDblFeatures) pair per chunk: an int array of
+    labels and a row-major double array holding one row of features per
+    label. Chunks are read from the binary sidecar cache if it is up to
+    date, and parsed from the text otherwise. Either way, the file is
+    only read as far as the last instance taken."""
+    if cChunkSize < 1:
+        raise ValueError("Chunk size must be at least 1.")
+    tplCache = map_data_cache(sFilename)
+    if tplCache is not None:
+        infile,mm,cInst,cFeatures,_,_ = tplCache
+        try:
+            cRead = cInst
+            if cMaxInstances is not None:
+                cRead = min(cInst, cMaxInstances)
+            for ixStart in xrange(0, cRead, cChunkSize):
+                yield read_cache_block(mm, cInst, cFeatures, ixStart,
+                                       min(ixStart + cChunkSize, cRead))
+        finally:
+            mm.close()
+            infile.close()
+        return
+    iterInst = itertools.islice(parse_instances(sFilename), cMaxInstances)
+    while True:
+        arrILabel = array.array('i')
+        arrDblFeatures = array.array('d')
+        for inst in itertools.islice(iterInst, cChunkSize):
+            arrILabel.append(inst.iLabel)
+            arrDblFeatures.extend(inst.listDblFeatures)
+        if not arrILabel:
+            return
+        yield arrILabel,arrDblFeatures
+
+def chunk_instances(arrILabel, arrDblFeatures):
+    """Build the list of Instances held by a chunk from stream_data."""
+    if not arrILabel:
+        return []
+    cFeatures = len(arrDblFeatures)//len(arrILabel)
+    return [Instance(iLabel,
+                     arrDblFeatures[ix*cFeatures:(ix + 1)*cFeatures].tolist())
+            for ix,iLabel in enumerate(arrILabel)]
+
+class DataStream(object):
+    """A dataset streamed from a file each time it is iterated over, as
+    lists of at most cChunkSize Instances, rather than loaded into memory.
+    train_round and num_correct accept a DataStream wherever they accept
+    a list of instances."""
+    def __init__(self, sFilename, cChunkSize=STREAM_CHUNK_SIZE,
+                 cMaxInstances=None):
+        self.sFilename = sFilename
+        self.cChunkSize = cChunkSize
+        self.cMaxInstances = cMaxInstances
+        self.cInstances = None
+    def __iter__(self):
+        for arrILabel,arrDblFeatures in stream_data(
+            self.sFilename, self.cChunkSize, self.cMaxInstances):
+            yield chunk_instances(arrILabel, arrDblFeatures)
+    def __len__(self):
+        """Returns the number of instances in the stream, counting them
+        with one pass over the file the first time it is called."""
+        if self.cInstances is None:
+            self.cInstances = sum(len(arrILabel) for arrILabel,_ in
+                                  stream_data(self.sFilename, self.cChunkSize,
+                                              self.cMaxInstances))
+        return self.cInstances
+
+def instance_chunks(data):
+    """Returns the instances of data, a list of instances or a DataStream,
+    as an iterable of lists of instances."""
+    if isinstance(data, DataStream):
+        return data
+    return [data]
+
+def prefetch(iterable, cPrefetch):
+    """Iterate over iterable on a background thread, which keeps up to
+    cPrefetch items ready ahead of the caller. Exceptions raised by
+    iterable are raised again in the caller. If the caller stops early,
+    the thread stops within a fraction of a second."""
+    queue = Queue.Queue(cPrefetch)
+    evtStop = threading.Event()
+    def put(tplItem):
+        while not evtStop.is_set():
+            try:
+                queue.put(tplItem, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+    def produce():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+            put((False, None))
+        except BaseException:
+            put((False, sys.exc_info()))
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            fItem,item = queue.get()
+            if not fItem:
+                if item is not None:
+                    raise item[0], item[1], item[2]
+                return
+            yield item
+    finally:
+        evtStop.set()
+        thread.join()
+
+class BatchPipeline(object):
+    """The stage between a dataset and update_net_batch. Iterating over a
+    BatchPipeline makes one pass over data, a list of instances or a
+    DataStream, yielding (listInst, listListDblTarget) batches of
+    cBatchSize instances with their targets already encoded by fxnEncode.
+
+    With cShuffleBuffer above 1, instances go through a shuffle buffer of
+    that many instances: each instance read replaces a randomly chosen
+    one in the buffer, which is passed on. A buffer at least as large as
+    the dataset shuffles it completely. Each pass draws its own seed from
+    rnd, the random module by default, so passes are reproducible under
+    random.seed. Without a shuffle buffer, instances keep their order and
+    no random numbers are drawn.
+
+    With cPrefetch above 0, batches are read, shuffled and encoded on a
+    background thread, up to cPrefetch batches ahead of training.
+
+    Targets are gathered from the LabelEncoding of fxnEncode, so the
+    batches share the rows of its table, which must not be modified."""
+    def __init__(self, data, cBatchSize=1, cShuffleBuffer=0,
+                 fxnEncode=distributed_encode_label, cPrefetch=0, rnd=None):
+        if cBatchSize < 1:
+            raise ValueError("Batch size must be at least 1.")
+        self.data = data
+        self.cBatchSize = cBatchSize
+        self.cShuffleBuffer = cShuffleBuffer
+        self.encoding = label_encoding(fxnEncode)
+        self.cPrefetch = cPrefetch
+        self.rnd = rnd
+    def __len__(self):
+        return len(self.data)
+    def __iter__(self):
+        rndPass = None
+        if self.cShuffleBuffer > 1:
+            rndPass = random.Random((self.rnd or random).getrandbits(32))
+        iterBatch = self.batches(rndPass)
+        if self.cPrefetch > 0:
+            return prefetch(iterBatch, self.cPrefetch)
+        return iterBatch
+    def instances(self, rnd):
+        """Yield the instances of one pass, through the shuffle buffer if
+        rnd is not None."""
+        listInstBuffer = []
+        for listInstChunk in instance_chunks(self.data):
+            if rnd is None:
+                for inst in listInstChunk:
+                    yield inst
+                continue
+            for inst in listInstChunk:
+                if len(listInstBuffer) < self.cShuffleBuffer:
+                    listInstBuffer.append(inst)
+                    continue
+                ix = rnd.randrange(len(listInstBuffer))
+                yield listInstBuffer[ix]
+                listInstBuffer[ix] = inst
+        if listInstBuffer:
+            rnd.shuffle(listInstBuffer)
+            for inst in listInstBuffer:
+                yield inst
+    def batches(self, rnd):
+        fxnEncodeRows = self.encoding.encode_rows
+        listInstBlock = []
+        for inst in self.instances(rnd):
+            listInstBlock.append(inst)
+            if len(listInstBlock) == self.cBatchSize:
+                yield listInstBlock,fxnEncodeRows([inst.iLabel for inst
+                                                   in listInstBlock])
+                listInstBlock = []
+        if listInstBlock:
+            yield listInstBlock,fxnEncodeRows([inst.iLabel for inst
+                                               in listInstBlock])
+
 def print_net(net):
     """Convenience routine for printing a network to standard out."""
+    if isinstance(net, MatrixNet):
+        net = net.to_net()
     for layer in net.listLayer:
         print ""
         for pcpt in layer.listPcpt:
@@ -550,14 +1746,272 @@ def learn_xor():
 
 def num_correct(net, listInst):
   cCorrect = 0
-  for inst in listInst:
-    listDblOut = feed_forward(net,inst.listDblFeatures)
-    iGuess = distributed_decode_net_output(listDblOut)
-    #if opts.fShowGuesses:
-    #print inst.iLabel, iGuess
-    cCorrect += int(inst.iLabel == iGuess)
+  for listInstChunk in instance_chunks(listInst):
+    _,listIGuess = predict_batch(net, [inst.listDblFeatures
+                                       for inst in listInstChunk])
+    for inst,iGuess in itertools.izip(listInstChunk, listIGuess):
+      #if opts.fShowGuesses:
+      #print inst.iLabel, iGuess
+      cCorrect += int(inst.iLabel == iGuess)
   return cCorrect
 
+def sample_instances(listInst, cSample, rnd=random):
+    """Draw a uniform sample of cSample instances from listInst, a list of
+    instances or a DataStream, in one pass. Returns the sample and the
+    number of instances seen; if there were no more than cSample, the
+    sample holds all of them."""
+    listInstSample = []
+    cSeen = 0
+    for listInstChunk in instance_chunks(listInst):
+        for inst in listInstChunk:
+            if cSeen < cSample:
+                listInstSample.append(inst)
+            else:
+                ix = rnd.randint(0, cSeen)
+                if ix < cSample:
+                    listInstSample[ix] = inst
+            cSeen += 1
+    return listInstSample,cSeen
+
+class EarlyStopping(object):
+    """Decides when to stop training from the validation accuracy.
+
+    Every cEvery rounds, check scores the network. An accuracy more than
+    dblMinDelta above the best so far is an improvement, one exactly equal
+    to the best changes nothing, and any other counts against the
+    patience; training stops once more than cPatience checks have counted
+    against it since the last improvement. With the defaults this is the
+    original stopping rule: stop as soon as the accuracy falls. With
+    fRestoreBest, the weights of the best round are kept in a
+    WeightSnapshot, and restore puts them back.
+
+    With cSubset above 0, checks first score a fixed random sample of
+    cSubset validation instances, and score the whole validation set only
+    when the sample shows no improvement, that is when training seems to
+    have reached a plateau. Only scores on the whole set count towards
+    the best accuracy and the patience."""
+    def __init__(self, listInstVal, cPatience=0, dblMinDelta=0.0,
+                 fRestoreBest=False, cSubset=0, cEvery=1, rnd=None):
+        if cEvery < 1:
+            raise ValueError("Validation interval must be at least 1.")
+        self.listInstVal = listInstVal
+        self.cPatience = cPatience
+        self.dblMinDelta = dblMinDelta
+        self.fRestoreBest = fRestoreBest
+        self.cEvery = cEvery
+        self.listInstSubset = None
+        if cSubset > 0:
+            rndSample = random.Random((rnd or random).getrandbits(32))
+            listInstSubset,cSeen = sample_instances(listInstVal, cSubset,
+                                                    rndSample)
+            if cSeen > cSubset:
+                self.listInstSubset = listInstSubset
+        self.dblBest = -1.0
+        self.dblBestSubset = -1.0
+        self.cRoundBest = None
+        self.cBad = 0
+        self.fStop = False
+        self.snapshot = None
+    def check(self, net, cRound):
+        """Validate net after round cRound, if a check is due. Returns None
+        if not, and otherwise the accuracy measured and whether it was
+        measured on the whole validation set."""
+        if cRound % self.cEvery:
+            return None
+        if self.listInstSubset is not None:
+            dblSubset = (num_correct(net, self.listInstSubset)*1.0
+                         / len(self.listInstSubset))
+            if dblSubset > self.dblBestSubset + self.dblMinDelta:
+                self.dblBestSubset = dblSubset
+                return dblSubset,False
+        dblAccuracy = (num_correct(net, self.listInstVal)*1.0
+                       / len(self.listInstVal))
+        self.record(net, cRound, dblAccuracy)
+        return dblAccuracy,True
+    def record(self, net, cRound, dblAccuracy):
+        """Record dblAccuracy, the accuracy of net on the whole validation
+        set after round cRound."""
+        if dblAccuracy > self.dblBest + self.dblMinDelta:
+            self.dblBest = dblAccuracy
+            self.cRoundBest = cRound
+            self.cBad = 0
+            if self.fRestoreBest:
+                if self.snapshot is None:
+                    self.snapshot = WeightSnapshot(net)
+                else:
+                    self.snapshot.save(net)
+        elif dblAccuracy != self.dblBest:
+            self.cBad += 1
+            if self.cBad > self.cPatience:
+                self.fStop = True
+    def restore(self, net):
+        """Put the weights of the best round back into net, if they were
+        kept. Returns whether they were."""
+        if self.snapshot is None:
+            return False
+        self.snapshot.restore(net)
+        return True
+
+def layer_sizes(cInputs, cHiddenUnits):
+    """Returns the layer sizes experiment() trains: cInputs inputs, a
+    hidden layer of cHiddenUnits units unless cHiddenUnits is None or 0,
+    and one output per label."""
+    listCLayerSize = [cInputs]
+    if cHiddenUnits:
+        listCLayerSize.append(cHiddenUnits)
+    listCLayerSize.append(LABEL_COUNT)
+    return listCLayerSize
+
+def train_round(net, listInstTrain, dblLearningRate, cBatchSize=1):
+    """Train net for one round over listInstTrain, cBatchSize instances
+    per weight update. listInstTrain is a list of instances, a DataStream,
+    or a BatchPipeline, which brings its own batch size. Returns the
+    number of training instances the network misclassified as it was
+    being trained on them."""
+    pipeline = listInstTrain
+    if not isinstance(pipeline, BatchPipeline):
+        pipeline = BatchPipeline(listInstTrain, cBatchSize)
+    cErrors = 0
+    for listInstBlock,listListDblTarget in pipeline:
+        listListDblOut = update_net_batch(net, listInstBlock, dblLearningRate,
+                                          listListDblTarget)
+        listIGuess = decode_block(distributed_decode_net_output,
+                                  listListDblOut)
+        for inst,iGuess in zip(listInstBlock, listIGuess):
+            #print inst.iLabel, iGuess
+            if iGuess != inst.iLabel:
+                cErrors += 1
+    return cErrors
+
+PARALLEL_MODES = ("sync", "async")
+
+# The smallest batch size --parallel-mode sync accepts. Every sync step is
+# a round trip to the pool that pickles each worker's updates, about a
+# millisecond, so with smaller batches the workers spend more time
+# talking than training.
+PARALLEL_SYNC_MIN_BATCH = 32
+
+# The state of the running parallel training: the network, whose weights
+# live in shared memory, under "net" and the training instances under
+# "train". Worker processes receive both from the parent when they fork.
+PARALLEL_STATE = {}
+
+def share_matrix_net(net):
+    """Copy the weights of a NeuralNet or MatrixNet into a new MatrixNet
+    whose weight arrays are in shared memory, so that processes forked
+    after it is built all read and update the same weights."""
+    if not isinstance(net, MatrixNet):
+        net = MatrixNet.from_net(net)
+    netShared = MatrixNet(net.cInputs, [
+        MatrixLayer(layer.cInputs,
+                    multiprocessing.RawArray('d', layer.arrDblW),
+                    multiprocessing.RawArray('d', layer.arrDblW0))
+        for layer in net.listLayer])
+    netShared.sigmoid = net.sigmoid
+    return netShared
+
+def unshare_matrix_net(net):
+    """Copy the weights of a shared MatrixNet back into ordinary arrays."""
+    netUnshared = MatrixNet(net.cInputs, [
+        MatrixLayer(layer.cInputs, array.array('d', layer.arrDblW),
+                    array.array('d', layer.arrDblW0))
+        for layer in net.listLayer])
+    netUnshared.sigmoid = net.sigmoid
+    return netUnshared
+
+def init_parallel_worker(net, listInstTrain):
+    PARALLEL_STATE["net"] = net
+    PARALLEL_STATE["train"] = listInstTrain
+
+def parallel_step(tplTask):
+    """Compute the summed updates of one worker's shard of a synchronous
+    step, against the shared weights, without applying them. tplTask
+    holds the start and end of the shard and the learning rate. Returns
+    the updates and the number of instances in the shard the network
+    misclassified."""
+    ixStart,ixEnd,dblLearningRate = tplTask
+    listInst = PARALLEL_STATE["train"][ixStart:ixEnd]
+    listListDblTarget = label_encoding(distributed_encode_label).encode_rows(
+        [inst.iLabel for inst in listInst])
+    listTplStep,listListDblOut = matrix_net_step_block(
+        PARALLEL_STATE["net"], listInst, dblLearningRate, listListDblTarget)
+    cErrors = 0
+    for inst,iGuess in zip(listInst,
+                           decode_block(distributed_decode_net_output,
+                                        listListDblOut)):
+        cErrors += int(iGuess != inst.iLabel)
+    return listTplStep,cErrors
+
+def parallel_shard(tplTask):
+    """Train the shared network on one worker's shard of a round, updating
+    the shared weights in place without any locking. tplTask holds the
+    start and end of the shard, the learning rate and the batch size.
+    Returns the number of errors, as train_round does."""
+    ixStart,ixEnd,dblLearningRate,cBatchSize = tplTask
+    return train_round(PARALLEL_STATE["net"],
+                       PARALLEL_STATE["train"][ixStart:ixEnd],
+                       dblLearningRate, cBatchSize)
+
+def average_steps(listListTplStep):
+    """Average the per-layer updates of several workers, adding them in
+    the order given so the result does not depend on timing."""
+    dblWorkers = float(len(listListTplStep))
+    listTplAverage = []
+    for listTplLayer in zip(*listListTplStep):
+        arrDblStep = array.array('d', listTplLayer[0][0])
+        arrDblStep0 = array.array('d', listTplLayer[0][1])
+        for arrDblOther,arrDblOther0 in listTplLayer[1:]:
+            arrDblStep = array.array('d', map(operator.add, arrDblStep,
+                                              arrDblOther))
+            arrDblStep0 = array.array('d', map(operator.add, arrDblStep0,
+                                               arrDblOther0))
+        if dblWorkers > 1:
+            arrDblStep = array.array('d', [dbl/dblWorkers
+                                           for dbl in arrDblStep])
+            arrDblStep0 = array.array('d', [dbl/dblWorkers
+                                            for dbl in arrDblStep0])
+        listTplAverage.append((arrDblStep, arrDblStep0))
+    return listTplAverage
+
+def parallel_train_round(pool, net, cInstances, cWorkers, dblLearningRate,
+                         cBatchSize=1, sMode="sync"):
+    """Train a shared network (from share_matrix_net) for one round over
+    the first cInstances instances of PARALLEL_STATE["train"], on a pool
+    of cWorkers processes started with init_parallel_worker.
+
+    In "sync" mode each step gives each worker the next cBatchSize
+    instances. The workers compute their updates against the same
+    weights, and the average of their updates is applied before the next
+    step, so the result depends only on the random seed. With one worker
+    this is exactly train_round. In "async" mode the round is split into
+    one contiguous shard per worker, and the workers train on their
+    shards at the same time, updating the shared weights as they go
+    (Hogwild!). The result then depends on how the processes are
+    scheduled. Returns the number of training errors in the round."""
+    if sMode not in PARALLEL_MODES:
+        raise ValueError("Unknown parallel mode: %s" % sMode)
+    if sMode == "async":
+        listTplTask = [(cInstances*ix // cWorkers,
+                        cInstances*(ix + 1) // cWorkers,
+                        dblLearningRate, cBatchSize)
+                       for ix in xrange(cWorkers)]
+        return sum(pool.map(parallel_shard, listTplTask))
+    cErrors = 0
+    cStep = cWorkers*cBatchSize
+    for ixStep in xrange(0, cInstances, cStep):
+        listTplTask = [(ixStart, min(ixStart + cBatchSize, cInstances),
+                        dblLearningRate)
+                       for ixStart in xrange(ixStep,
+                                             min(ixStep + cStep, cInstances),
+                                             cBatchSize)]
+        listTplResult = pool.map(parallel_step, listTplTask)
+        listTplStep = average_steps([listTplStep for listTplStep,_
+                                     in listTplResult])
+        for layer,(arrDblStep,arrDblStep0) in zip(net.listLayer, listTplStep):
+            matrix_apply_layer_step(layer, arrDblStep, arrDblStep0)
+        cErrors += sum(cStepErrors for _,cStepErrors in listTplResult)
+    return cErrors
+
 def experiment(opts):
     """Conduct a neural net performance experiment.
 
@@ -569,10 +2023,16 @@ def experiment(opts):
 
     You may want to play with this function in order to run experiments
     of interest to you."""
+    if opts.seed is not None:
+        random.seed(opts.seed)
     dictSeen = {}
     def load(sFilename):
         if sFilename in dictSeen:
             return dictSeen[sFilename]
+        if opts.stream:
+            listInst = DataStream(sFilename, opts.chunk_size, opts.max_inst)
+            dictSeen[sFilename] = listInst
+            return listInst
         sys.stderr.write("Loading %s..." % sFilename)
         listInst = load_data(sFilename,opts.max_inst)
         sys.stderr.write("done.\n")
@@ -581,33 +2041,68 @@ def experiment(opts):
     listInstTrain = load(opts.train)
     listInstVal = load(opts.validation)
     listInstTest = load(opts.test)
-    config = [opts.num_inputs]
     if opts.hidden_units:
       print 'Adding a hidden layer with %d units' % opts.hidden_units
-      config.append(opts.hidden_units)
-    config.append(10)
-    net = init_net(config)
+    config = layer_sizes(opts.num_inputs, opts.hidden_units)
+    cRoundStart = 0
     dblAlpha = opts.learning_rate
+    if opts.resume:
+        checkpoint = load_checkpoint(opts.resume)
+        print 'Resuming from %s after round %d' % (opts.resume,
+                                                   checkpoint.cRound)
+        net = checkpoint.net
+        if opts.engine != "matrix":
+            net = net.to_net()
+        cRoundStart = checkpoint.cRound
+        dblAlpha = checkpoint.dblLearningRate
+        if checkpoint.tplRandomState is not None:
+            random.setstate(checkpoint.tplRandomState)
+    elif opts.engine == "matrix":
+        net = init_matrix_net(config)
+    else:
+        net = init_net(config)
     print 'Learning rate: %f' % dblAlpha
-    last_validation_error = -1
-    for ixRound in xrange(opts.rounds):
+    pool = None
+    if opts.workers > 1:
+        print 'Training on %d workers (%s)' % (opts.workers,
+                                              opts.parallel_mode)
+        net = share_matrix_net(net)
+        pool = multiprocessing.Pool(opts.workers, init_parallel_worker,
+                                    (net, listInstTrain))
+    pipeline = BatchPipeline(listInstTrain, opts.batch_size,
+                             opts.shuffle_buffer, cPrefetch=opts.prefetch)
+    stopping = None
+    if opts.stopping_condition:
+        stopping = EarlyStopping(listInstVal, opts.patience, opts.min_delta,
+                                 opts.restore_best, opts.validation_subset,
+                                 opts.validate_every)
+    for ixRound in xrange(cRoundStart, opts.rounds):
         # Compute the error
-        errors = 0
-        for inst in listInstTrain:
-            listDblOut = update_net(net,inst,dblAlpha,distributed_encode_label(inst.iLabel))
-            iGuess = distributed_decode_net_output(listDblOut)
-            #print inst.iLabel, iGuess
-            if iGuess != inst.iLabel:
-              errors += 1
-        # Get validation error
-        validation_correct = num_correct(net, listInstVal)
-        # CHANGED: sys.stderr.write(
+        if pool is None:
+            errors = train_round(net, pipeline, dblAlpha)
+        else:
+            errors = parallel_train_round(pool, net, len(listInstTrain),
+                                          opts.workers, dblAlpha,
+                                          opts.batch_size, opts.parallel_mode)
+        # Get validation accuracy
         round = ixRound + 1
+        if stopping is None:
+            val_acc = num_correct(net, listInstVal) * 1.0 / len(listInstVal)
+        else:
+            val_acc = "-"
+            tplCheck = stopping.check(net, round)
+            if tplCheck is not None:
+                val_acc,fFull = tplCheck
+                if not fFull:
+                    val_acc = "%s (subset)" % val_acc
+        # CHANGED: sys.stderr.write(
         train_acc = 1 - errors * 1.0 / len(listInstTrain)
-        val_acc = validation_correct * 1.0 / len(listInstVal)
         print \
           "Round %d complete. Training Accuracy: %.5s, Validation Accuracy: %s" \
           % (round, train_acc, val_acc)
+        if opts.save:
+            save_checkpoint(opts.save, net, round, dblAlpha,
+                            random.getstate())
 
         """
         sys.stderr.write(
@@ -616,28 +2111,216 @@ def experiment(opts):
           1 - errors * 1.0 / len(listInstTrain),
           validation_correct * 1.0 / len(listInstVal)))
         """
-        if opts.stopping_condition:
-            # TODO(CS181 Student): implement your stopping condition
-            # as described in part 3.4 of the homework instructions.
-            # Don't forget to use --enable-stopping on the command
-            # line to activate the functionality you implement here.
-            if (validation_correct * 1.0 / len(listInstVal) < last_validation_error):
-                break;
-            else:
-                last_validation_error = validation_correct * 1.0 / len(listInstVal)
-    cCorrect = 0
-    for inst in listInstTest:
-        listDblOut = feed_forward(net,inst.listDblFeatures)
-        iGuess = distributed_decode_net_output(listDblOut)
-        #if opts.fShowGuesses:
-        #print inst.iLabel, iGuess
-        cCorrect += int(inst.iLabel == iGuess)
+        if stopping is not None and stopping.fStop:
+            print 'Stopping early: best validation accuracy %s after round %d' \
+                % (stopping.dblBest, stopping.cRoundBest)
+            if stopping.restore(net):
+                print 'Restored the weights from round %d' % stopping.cRoundBest
+            break
+    else:
+        if stopping is not None and stopping.restore(net):
+            print 'Restored the weights from round %d' % stopping.cRoundBest
+    if pool is not None:
+        pool.close()
+        pool.join()
+        net = unshare_matrix_net(net)
+    cCorrect = num_correct(net, listInstTest)
     print "correct:",cCorrect, "out of", len(listInstTest),
     print "(%.1f%%)" % (100.0*float(cCorrect)/float(len(listInstTest)))
 
+SWEEP_SEARCHES = ("grid", "random", "halving")
+
+# The datasets of the running sweep, keyed by "train", "validation" and
+# "test". The parent process loads them before starting its worker pool,
+# so forked workers share its copy read-only instead of loading their own.
+SWEEP_DATA = {}
+
+def parse_sweep_values(sValues, fxnType):
+    """Parse a comma-separated list of sweep values of type fxnType. Integer
+    values may also be given as inclusive ranges.
+
+    >>> parse_sweep_values("1-3,5", int)
+    [1, 2, 3, 5]
+    >>> parse_sweep_values("0.5,1.0", float)
+    [0.5, 1.0]"""
+    listValue = []
+    for sValue in sValues.split(','):
+        sValue = sValue.strip()
+        if fxnType is int and '-' in sValue.lstrip('-'):
+            sLo,sHi = sValue.split('-', 1)
+            listValue.extend(xrange(int(sLo), int(sHi) + 1))
+        else:
+            listValue.append(fxnType(sValue))
+    if not listValue:
+        raise ValueError("Empty sweep values: %r" % sValues)
+    return listValue
+
+def sweep_trials(listDblLearningRate, listCHiddenUnits, listCRounds,
+                 sSearch="grid", cTrials=None, rnd=random):
+    """Build the list of trials for a sweep. Each trial is a dict with
+    keys "trial", "learning_rate", "hidden_units" and "rounds".
+
+    A grid search tries every combination of the given values, a random
+    search tries cTrials distinct combinations drawn with rnd, and
+    successive halving starts from every combination of learning rate and
+    hidden units, each with the largest number of rounds as its budget."""
+    if sSearch not in SWEEP_SEARCHES:
+        raise ValueError("Unknown search: %s" % sSearch)
+    if min(listCRounds) < 1:
+        raise ValueError("Every trial needs at least one round.")
+    if sSearch == "halving":
+        listCRounds = [max(listCRounds)]
+    listTpl = list(itertools.product(listDblLearningRate, listCHiddenUnits,
+                                     listCRounds))
+    if sSearch == "random":
+        if cTrials is None:
+            raise ValueError("A random search needs a number of trials.")
+        listTpl = rnd.sample(listTpl, min(cTrials, len(listTpl)))
+    return [{"trial": ix, "learning_rate": dblLearningRate,
+             "hidden_units": cHiddenUnits, "rounds": cRounds}
+            for ix,(dblLearningRate,cHiddenUnits,cRounds)
+            in enumerate(listTpl)]
+
+def init_sweep_worker(dictFilename, cMaxInstances):
+    """Load the sweep datasets into SWEEP_DATA, unless this process already
+    has them."""
+    if SWEEP_DATA:
+        return
+    for sKey,sFilename in dictFilename.iteritems():
+        SWEEP_DATA[sKey] = load_data(sFilename, cMaxInstances)
+
+def run_sweep_trial(tplTrial):
+    """Train one sweep trial on SWEEP_DATA. tplTrial holds the trial dict
+    and the network to continue training, or None to start a new network
+    from the trial's seed. The trial is trained until it has completed
+    dictTrial["rounds"] rounds.
+
+    Returns the trial, its network and a list with one result dict per
+    round trained; the last result also holds the test accuracy."""
+    dictTrial,net = tplTrial
+    if net is None:
+        random.seed(dictTrial["seed"])
+        net = init_matrix_net(layer_sizes(dictTrial["num_inputs"],
+                                          dictTrial["hidden_units"]))
+        dictTrial["rounds_done"] = 0
+    listInstTrain = SWEEP_DATA["train"]
+    listInstVal = SWEEP_DATA["validation"]
+    listDictResult = []
+    for ixRound in xrange(dictTrial["rounds_done"], dictTrial["rounds"]):
+        cErrors = train_round(net, listInstTrain, dictTrial["learning_rate"],
+                              dictTrial["batch_size"])
+        listDictResult.append({
+            "trial": dictTrial["trial"],
+            "learning_rate": dictTrial["learning_rate"],
+            "hidden_units": dictTrial["hidden_units"],
+            "round": ixRound + 1,
+            "train_accuracy": 1 - cErrors*1.0/len(listInstTrain),
+            "validation_accuracy": (num_correct(net, listInstVal)*1.0
+                                    / len(listInstVal))})
+    dictTrial["rounds_done"] = dictTrial["rounds"]
+    if listDictResult:
+        listInstTest = SWEEP_DATA["test"]
+        listDictResult[-1]["test_accuracy"] = (num_correct(net, listInstTest)
+                                               * 1.0/len(listInstTest))
+    return dictTrial,net,listDictResult
+
+def halving_first_rung(cTrials, cMaxRounds, cFactor):
+    """Returns the number of rounds every trial gets in the first rung of
+    successive halving, so that the rungs end at cMaxRounds rounds about
+    when one trial is left.
+
+    >>> halving_first_rung(270, 10, 3)
+    1
+    >>> halving_first_rung(9, 27, 3)
+    3"""
+    cRounds = cMaxRounds
+    cRemaining = cTrials
+    while cRounds > 1 and cRemaining >= cFactor:
+        cRounds = max(1, cRounds // cFactor)
+        cRemaining //= cFactor
+    return cRounds
+
+def sweep(opts):
+    """Run a hyperparameter sweep over learning rate, hidden units and
+    rounds, training the trials in parallel across a pool of opts.processes
+    worker processes (one per core by default).
+
+    Every round of every trial is written to opts.sweep_output as one line
+    of JSON, in the order the trials finish, and the best trial by final
+    validation accuracy is printed at the end."""
+    listDblLearningRate = parse_sweep_values(opts.sweep_learning_rates, float)
+    listCHiddenUnits = parse_sweep_values(opts.sweep_hidden, int)
+    listCRounds = parse_sweep_values(opts.sweep_rounds or str(opts.rounds),
+                                     int)
+    iSeed = opts.seed or 0
+    listDictTrial = sweep_trials(listDblLearningRate, listCHiddenUnits,
+                                 listCRounds, opts.search, opts.trials,
+                                 random.Random(iSeed))
+    for dictTrial in listDictTrial:
+        dictTrial.update({"seed": iSeed + dictTrial["trial"],
+                          "num_inputs": opts.num_inputs,
+                          "batch_size": opts.batch_size})
+    dictFilename = {"train": opts.train, "validation": opts.validation,
+                    "test": opts.test}
+    sys.stderr.write("Loading data...")
+    init_sweep_worker(dictFilename, opts.max_inst)
+    sys.stderr.write("done.\n")
+    cProcesses = opts.processes or multiprocessing.cpu_count()
+    print "Running %d trials on %d processes" % (len(listDictTrial),
+                                                  cProcesses)
+    pool = None
+    fxnMap = itertools.imap
+    if cProcesses > 1:
+        pool = multiprocessing.Pool(cProcesses, init_sweep_worker,
+                                    (dictFilename, opts.max_inst))
+        fxnMap = pool.imap_unordered
+    listTplFinal = []
+    outfile = open(opts.sweep_output, "w")
+    try:
+        listTplTrial = [(dictTrial, None) for dictTrial in listDictTrial]
+        cMaxRounds = max(dictTrial["rounds"] for dictTrial in listDictTrial)
+        cRungRounds = cMaxRounds
+        if opts.search == "halving":
+            cRungRounds = halving_first_rung(len(listTplTrial), cMaxRounds,
+                                             opts.halving_factor)
+        while listTplTrial:
+            if opts.search == "halving":
+                for dictTrial,_ in listTplTrial:
+                    dictTrial["rounds"] = cRungRounds
+            listTplFinal = []
+            for dictTrial,net,listDictResult in fxnMap(run_sweep_trial,
+                                                       listTplTrial):
+                for dictResult in listDictResult:
+                    outfile.write(json.dumps(dictResult, sort_keys=True))
+                    outfile.write("\n")
+                outfile.flush()
+                listTplFinal.append((dictTrial, net, listDictResult[-1]))
+            if (opts.search != "halving" or cRungRounds >= cMaxRounds
+                or len(listTplFinal) == 1):
+                break
+            listTplFinal.sort(key=lambda tpl: (-tpl[2]["validation_accuracy"],
+                                               tpl[0]["trial"]))
+            cKeep = max(1, len(listTplFinal) // opts.halving_factor)
+            listTplTrial = [(dictTrial, net) for dictTrial,net,_
+                            in listTplFinal[:cKeep]]
+            cRungRounds = min(cMaxRounds, cRungRounds*opts.halving_factor)
+    finally:
+        outfile.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+    dictTrial,_,dictBest = max(listTplFinal, key=lambda tpl: (
+        tpl[2]["validation_accuracy"], -tpl[0]["trial"]))
+    print ("Best trial: learning rate %f, %s hidden units, %d rounds. "
+           "Validation Accuracy: %s, Test Accuracy: %s"
+           % (dictTrial["learning_rate"], dictTrial["hidden_units"],
+              dictBest["round"], dictBest["validation_accuracy"],
+              dictBest["test_accuracy"]))
+    return listTplFinal
+
 def main(argv):
     import optparse
-    parser = optparse.OptionParser()
+    parser = optparse.OptionParser(usage="%prog [options] [sweep]")
     parser.add_option("-d", "--doc-test", action="store_true", dest="doctest",
                       help="run doctests in nn.py")
     parser.add_option("-x", "--learn-xor", action="store_true", dest="xor",
@@ -668,10 +2351,126 @@ def main(argv):
                       dest="num_inputs",
                       default=(10*12), type=int,
                       help="number of hidden units to use.")
+    parser.add_option("-b", "--batch-size", action="store", dest="batch_size",
+                      default=1, type=int,
+                      help="number of instances per weight update")
+    parser.add_option("--engine", action="store", dest="engine",
+                      default="matrix", type="choice",
+                      choices=["list", "matrix"],
+                      help="network representation to train: a list of "
+                      "perceptrons or one weight matrix per layer; both "
+                      "give the same weights, and matrix trains faster "
+                      "(default: %default)")
+    parser.add_option("-w", "--workers", action="store", dest="workers",
+                      default=1, type=int,
+                      help="number of processes to train on in parallel")
+    parser.add_option("--parallel-mode", action="store",
+                      dest="parallel_mode", default="sync", type="choice",
+                      choices=PARALLEL_MODES,
+                      help="how parallel workers combine their updates: "
+                      "sync averages them every step (needs --batch-size "
+                      "of at least %d), async lets every worker update "
+                      "shared weights as it goes" % PARALLEL_SYNC_MIN_BATCH)
+    parser.add_option("--stream", action="store_true", dest="stream",
+                      default=False,
+                      help="read the data from disk in chunks every round "
+                      "instead of loading it into memory")
+    parser.add_option("--chunk-size", action="store", dest="chunk_size",
+                      default=STREAM_CHUNK_SIZE, type=int,
+                      help="instances to read at a time with --stream")
+    parser.add_option("--shuffle-buffer", action="store",
+                      dest="shuffle_buffer", default=0, type=int,
+                      help="shuffle the training instances every round "
+                      "through a buffer of this many instances")
+    parser.add_option("--prefetch", action="store", dest="prefetch",
+                      default=0, type=int,
+                      help="batches to read and encode ahead of training "
+                      "on a background thread")
+    parser.add_option("--save", action="store", dest="save", default=None,
+                      help="checkpoint file to save the network and training "
+                      "state to after every round")
+    parser.add_option("--resume", action="store", dest="resume",
+                      default=None,
+                      help="checkpoint file to resume training from; "
+                      "--rounds counts the rounds it was already trained for")
+    parser.add_option("--sigmoid", action="store", dest="sigmoid",
+                      default="exact", type="choice",
+                      choices=SIGMOID_BACKENDS,
+                      help="how to compute the sigmoid: exactly, exactly "
+                      "with inputs clamped so math.exp cannot overflow, or "
+                      "interpolated from a lookup table (slower than exact)")
+    parser.add_option("--sigmoid-error", action="store",
+                      dest="sigmoid_error", default=SIGMOID_TABLE_ERROR,
+                      type=float,
+                      help="largest error of the lookup table sigmoid")
     parser.add_option("--enable-stopping", action="store_true",
                       dest="stopping_condition", default=False,
-                      help="detect when to stop training early (TODO)")
+                      help="stop training once the validation accuracy "
+                      "stops improving")
+    parser.add_option("--patience", action="store", dest="patience",
+                      default=0, type=int,
+                      help="stopping: validation checks without improvement "
+                      "to allow before stopping")
+    parser.add_option("--min-delta", action="store", dest="min_delta",
+                      default=0.0, type=float,
+                      help="stopping: smallest rise in validation accuracy "
+                      "that counts as an improvement")
+    parser.add_option("--restore-best", action="store_true",
+                      dest="restore_best", default=False,
+                      help="stopping: keep the weights of the best round "
+                      "and restore them when training ends")
+    parser.add_option("--validation-subset", action="store",
+                      dest="validation_subset", default=0, type=int,
+                      help="stopping: score a random sample of this many "
+                      "validation instances, and the whole validation set "
+                      "only when the sample stops improving")
+    parser.add_option("--validate-every", action="store",
+                      dest="validate_every", default=1, type=int,
+                      help="stopping: rounds between validation checks")
+    parser.add_option("--seed", action="store", dest="seed", default=None,
+                      type=int, help="seed for the random number generator")
+    parser.add_option("--sweep-learning-rates", action="store",
+                      dest="sweep_learning_rates",
+                      default="0.1,0.2,0.3,0.4,0.5,0.6,0.7,0.8,0.9",
+                      help="sweep: comma-separated learning rates to try")
+    parser.add_option("--sweep-hidden", action="store", dest="sweep_hidden",
+                      default="1-30",
+                      help="sweep: hidden layer sizes to try, as a "
+                      "comma-separated list of sizes and ranges (e.g. 1-30)")
+    parser.add_option("--sweep-rounds", action="store", dest="sweep_rounds",
+                      default=None,
+                      help="sweep: comma-separated numbers of rounds to try "
+                      "(default: --rounds)")
+    parser.add_option("--search", action="store", dest="search",
+                      default="grid", type="choice",
+                      choices=list(SWEEP_SEARCHES),
+                      help="sweep: grid, random or (successive) halving")
+    parser.add_option("--trials", action="store", dest="trials",
+                      default=20, type=int,
+                      help="sweep: number of trials for a random search")
+    parser.add_option("--halving-factor", action="store",
+                      dest="halving_factor", default=3, type=int,
+                      help="sweep: fraction of trials kept (1/n) and growth "
+                      "of the round budget (n) at each halving rung")
+    parser.add_option("--processes", action="store", dest="processes",
+                      default=None, type=int,
+                      help="sweep: number of worker processes (default: one "
+                      "per core)")
+    parser.add_option("--sweep-output", action="store", dest="sweep_output",
+                      default="sweep.jsonl",
+                      help="sweep: file receiving one JSON result per trial "
+                      "and round")
     opts,args = parser.parse_args(argv)
+    set_default_sigmoid(make_sigmoid(opts.sigmoid, opts.sigmoid_error))
+    if opts.stream and opts.workers > 1:
+        parser.error("--stream cannot be combined with --workers")
+    if opts.shuffle_buffer > 1 and opts.workers > 1:
+        parser.error("--shuffle-buffer cannot be combined with --workers")
+    if (opts.workers > 1 and opts.parallel_mode == "sync"
+        and opts.batch_size < PARALLEL_SYNC_MIN_BATCH):
+        parser.error("--parallel-mode sync needs a --batch-size of at "
+                     "least %d; use --parallel-mode async for smaller "
+                     "batches" % PARALLEL_SYNC_MIN_BATCH)
     if opts.doctest:
         import doctest
         doctest.testmod()
@@ -679,6 +2478,9 @@ def main(argv):
     if opts.xor:
         learn_xor()
         return 0
+    if args[1:2] == ["sweep"]:
+        sweep(opts)
+        return 0
     experiment(opts)
     return 0
 
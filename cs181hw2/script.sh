@@ -1,17 +1,12 @@
 #!/usr/bin/env bash
 #NUMBER recognition automated testing
 
-#for rate in {1..9}; do
-#  for hidden in {1..30}; do 
-#    python nn.py --rounds=10 --learning_rate=1.$rate --hidden=$hidden >> numout.txt
-#    echo -e "\n \n" >> numout.txt
-#  done
-#done  
+#python nn.py sweep --rounds=10 \
+#    --sweep-learning-rates=1.1,1.2,1.3,1.4,1.5,1.6,1.7,1.8,1.9 \
+#    --sweep-hidden=1-30 --sweep-output=numout.jsonl
 
 #exit 0
 
-for hidden in {1..30}; do
-    python nn.py --rounds=10 --learning_rate=1 --hidden=$hidden >> numout2.txt
-    echo -e "\n \n" >> numout2.txt
-done
+python nn.py sweep --rounds=10 --sweep-learning-rates=1 --sweep-hidden=1-30 \
+    --sweep-output=numout2.jsonl
 
@@ -12,6 +12,8 @@ ls -1 | grep -v "^tfutils$" |\
         grep -v "^.*\\.csv$" |\
         grep -v "^.*\\.dat$" |\
         grep -v "^.*\\.pyc$" |\
+        grep -v "^.*\\.nncache$" |\
+        grep -v "^.*\\.nnckpt$" |\
         grep -v "^.*\\k\\.txt$" |\
         grep -v "^.*~" | xargs -n 1 -IHERE cp -r HERE $SUBMIT_DIR
 
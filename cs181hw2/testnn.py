@@ -4,9 +4,15 @@
 testnn.py -- unit tests for artificial neural nets implemented in nn.py
 """
 
+import array
 import functools
 import math
+import multiprocessing
+import os
+import pickle
 import random
+import shutil
+import tempfile
 import unittest
 
 import nn
@@ -140,6 +146,76 @@ class MathTest(unittest.TestCase):
         self.scales_linearly(dblLR*dblDelta,dblW,listFloats,test_ix(2))
         self.scales_linearly(dblLR*dblIn, dblW, listFloats,test_ix(3))
 
+class SigmoidBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.listDblX = [ix/100.0 - 40.0 for ix in xrange(8001)]
+
+    def tearDown(self):
+        nn.set_default_sigmoid("exact")
+
+    def test_exact(self):
+        backend = nn.make_sigmoid("exact")
+        listDblExpected = map(nn.sigmoid, self.listDblX)
+        self.assertEqual(listDblExpected, map(backend, self.listDblX))
+        self.assertEqual(listDblExpected, backend.vector(self.listDblX))
+
+    def test_clamped(self):
+        backend = nn.make_sigmoid("clamped")
+        self.assertEqual(map(nn.sigmoid, self.listDblX),
+                         backend.vector(self.listDblX))
+        self.assertRaises(OverflowError, nn.sigmoid, -100000.0)
+        self.assertEqual([backend(-nn.SIGMOID_CLAMP)]*2,
+                         backend.vector([-100000.0, -1e300]))
+
+    def test_table(self):
+        for dblMaxError in (1e-2, 1e-4, 1e-6):
+            backend = nn.make_sigmoid("table", dblMaxError)
+            listDblY = backend.vector(self.listDblX + [-100000.0])
+            self.assertEqual(listDblY, map(backend, self.listDblX
+                                           + [-100000.0]))
+            for dblX,dblY in zip(self.listDblX, listDblY):
+                self.assertTrue(abs(dblY - nn.sigmoid(dblX)) <= dblMaxError)
+        self.assertRaises(ValueError, nn.make_sigmoid, "table", 0.0)
+        self.assertRaises(ValueError, nn.make_sigmoid, "cubic")
+
+    def test_apply(self):
+        listDblX = self.listDblX + [-100000.0]
+        for sName in ("clamped", "table"):
+            backend = nn.make_sigmoid(sName)
+            arrDblX = array.array('d', listDblX)
+            self.assertEqual(None, backend.apply(arrDblX))
+            self.assertEqual(backend.vector(listDblX), arrDblX.tolist())
+        arrDblX = array.array('d', self.listDblX)
+        nn.make_sigmoid("exact").apply(arrDblX)
+        self.assertEqual(map(nn.sigmoid, self.listDblX), arrDblX.tolist())
+
+    def test_per_network(self):
+        net = build_net([3,4,5])
+        listDblInput = randlist(-1.0, 1.0, 3)
+        listDblExact = nn.feed_forward(net, listDblInput)
+        net.sigmoid = nn.make_sigmoid("table", 1e-2)
+        listDblTable = nn.feed_forward(net, listDblInput)
+        self.assertNotEqual(listDblExact, listDblTable)
+        mnet = nn.MatrixNet.from_net(net)
+        self.assertEqual(listDblTable, nn.feed_forward(mnet, listDblInput))
+        self.assertEqual([listDblTable],
+                         nn.predict_batch(net, [listDblInput])[0])
+        inst = nn.Instance(0, listDblInput)
+        listDblTarget = randlist(0.0, 1.0, 5)
+        self.assertEqual(nn.update_net(net, inst, 0.5, listDblTarget),
+                         nn.update_net(mnet, inst, 0.5, listDblTarget))
+        self.assertEqual(nn.MatrixNet.from_net(net).listLayer[0].arrDblW,
+                         mnet.listLayer[0].arrDblW)
+
+    def test_default(self):
+        net = build_net([3,4,5])
+        listDblInput = randlist(-1.0, 1.0, 3)
+        listDblExact = nn.feed_forward(net, listDblInput)
+        nn.set_default_sigmoid("table")
+        self.assertNotEqual(listDblExact, nn.feed_forward(net, listDblInput))
+        net.sigmoid = nn.make_sigmoid("exact")
+        self.assertEqual(listDblExact, nn.feed_forward(net, listDblInput))
+
 class PerceptronTest(unittest.TestCase):
     REPEAT = 100
 
@@ -176,6 +252,18 @@ class PerceptronTest(unittest.TestCase):
         dblResult = nn.pcpt_activation(pcpt, listDblInput)
         self.assertAlmostEqual(dblExpected, logit(dblResult) - dblW0)
 
+    def test_compact_perceptron(self):
+        pcpt = nn.Perceptron([1, 2.5], 3, 4)
+        self.assertFalse(hasattr(pcpt, "__dict__"))
+        self.assertEqual("Perceptron([1.0, 2.5], 3.0, 4)", repr(pcpt))
+        listDblW = pcpt.listDblW
+        nn.update_pcpt(pcpt, [1.0, -1.0], 0.5, 2.0)
+        self.assertTrue(listDblW is pcpt.listDblW)
+        self.assertEqual("Perceptron([2.0, 1.5], 4.0, 4)", repr(pcpt))
+        for iProtocol in xrange(pickle.HIGHEST_PROTOCOL + 1):
+            pcptCopy = pickle.loads(pickle.dumps(pcpt, iProtocol))
+            self.assertEqual(repr(pcpt), repr(pcptCopy))
+
 class NeuralNetTest(unittest.TestCase):
     REPEAT = 100
     
@@ -346,6 +434,493 @@ class NeuralNetTest(unittest.TestCase):
                                get_weight(0, 1, 1))
         self.assertAlmostEqual(delta_hidden2, get_weight(0, 0, -1))
 
+class MatrixNetTest(unittest.TestCase):
+    REPEAT = 100
+
+    def assert_same_weights(self, net, mnet):
+        self.assertEqual(len(net.listLayer), len(mnet.listLayer))
+        for layer,mlayer in zip(net.listLayer, mnet.listLayer):
+            self.assertEqual(layer.layer_input_size(),
+                             mlayer.layer_input_size())
+            self.assertEqual(layer.layer_output_size(),
+                             mlayer.layer_output_size())
+            for pcpt in layer.listPcpt:
+                self.assertEqual(list(pcpt.listDblW),
+                                 list(mlayer.row(pcpt.ix)))
+                self.assertEqual(pcpt.dblW0, mlayer.arrDblW0[pcpt.ix])
+
+    def random_net(self):
+        cLayer = random.randint(2,4)
+        return build_net([random.randint(1,6) for _ in xrange(cLayer)])
+
+    @repeated
+    def test_round_trip(self):
+        net = self.random_net()
+        mnet = nn.MatrixNet.from_net(net)
+        self.assert_same_weights(net, mnet)
+        self.assert_same_weights(mnet.to_net(), mnet)
+
+    @repeated
+    def test_feed_forward(self):
+        net = self.random_net()
+        mnet = nn.MatrixNet.from_net(net)
+        listDblInput = randlist(-1.0,1.0,net.cInputs)
+        self.assertEqual(nn.build_layer_inputs_and_outputs(net, listDblInput),
+                         nn.build_layer_inputs_and_outputs(mnet, listDblInput))
+
+    @repeated
+    def test_update_net(self):
+        net = self.random_net()
+        mnet = nn.MatrixNet.from_net(net)
+        cOutputs = net.output_layer().layer_output_size()
+        for _ in xrange(3):
+            inst = nn.Instance(0, randlist(-1.0,1.0,net.cInputs))
+            listDblTarget = randlist(0.0,1.0,cOutputs)
+            dblLearningRate = random.random()
+            listDblOut = nn.update_net(net, inst, dblLearningRate,
+                                       listDblTarget)
+            listDblMatrixOut = nn.update_net(mnet, inst, dblLearningRate,
+                                             listDblTarget)
+            self.assertEqual(listDblOut, listDblMatrixOut)
+        self.assert_same_weights(net, mnet)
+
+    def test_init_matrix_net(self):
+        random.seed(181)
+        net = nn.init_net([3, 2, 1])
+        random.seed(181)
+        mnet = nn.init_matrix_net([3, 2, 1])
+        self.assertTrue(isinstance(mnet, nn.MatrixNet))
+        self.assert_same_weights(net, mnet)
+
+class BatchTest(unittest.TestCase):
+    REPEAT = 50
+
+    def random_block(self, net, cInst):
+        cOutputs = net.output_layer().layer_output_size()
+        listInst = [nn.Instance(0, randlist(-1.0,1.0,net.cInputs))
+                    for _ in xrange(cInst)]
+        listListDblTarget = [randlist(0.0,1.0,cOutputs)
+                             for _ in xrange(cInst)]
+        return listInst,listListDblTarget
+
+    @repeated
+    def test_batch_of_one(self):
+        net = build_net([random.randint(1,6) for _ in xrange(3)])
+        mnet = nn.MatrixNet.from_net(net)
+        listInst,listListDblTarget = self.random_block(net, 1)
+        dblLearningRate = random.random()
+        listDblOut = nn.update_net(net, listInst[0], dblLearningRate,
+                                   listListDblTarget[0])
+        listListDblOut = nn.update_net_batch(mnet, listInst, dblLearningRate,
+                                             listListDblTarget)
+        self.assertEqual([listDblOut], listListDblOut)
+        self.assertEqual(nn.MatrixNet.from_net(net).listLayer[0].arrDblW,
+                         mnet.listLayer[0].arrDblW)
+        self.assertEqual(nn.MatrixNet.from_net(net).listLayer[1].arrDblW0,
+                         mnet.listLayer[1].arrDblW0)
+
+    @repeated
+    def test_accumulated_update(self):
+        listCLayer = [random.randint(1,6) for _ in xrange(3)]
+        net = build_net(listCLayer)
+        listInst,listListDblTarget = self.random_block(net, 5)
+        dblLearningRate = random.random()
+        listArrDblExpected = [array.array('d', layer.arrDblW) for layer
+                              in nn.MatrixNet.from_net(net).listLayer]
+        for inst,listDblTarget in zip(listInst, listListDblTarget):
+            mnetSingle = nn.MatrixNet.from_net(net)
+            nn.update_net(mnetSingle, inst, dblLearningRate, listDblTarget)
+            listZip = zip(listArrDblExpected, mnetSingle.listLayer,
+                          net.listLayer)
+            for arrDblExpected,layerSingle,layer in listZip:
+                arrDblOrig = nn.MatrixLayer.from_layer(layer).arrDblW
+                for ix,(dblNew,dblOrig) in enumerate(
+                        zip(layerSingle.arrDblW, arrDblOrig)):
+                    arrDblExpected[ix] += dblNew - dblOrig
+        nn.update_net_batch(net, listInst, dblLearningRate, listListDblTarget)
+        listZip = zip(listArrDblExpected, nn.MatrixNet.from_net(net).listLayer)
+        for arrDblExpected,layer in listZip:
+            for dblExpected,dblW in zip(arrDblExpected, layer.arrDblW):
+                self.assertAlmostEqual(dblExpected, dblW)
+
+    def test_split_batches(self):
+        self.assertEqual([[0,1,2],[3,4,5],[6]],
+                         list(nn.split_batches(range(7), 3)))
+        self.assertRaises(ValueError, list, nn.split_batches(range(7), 0))
+
+class PredictBatchTest(unittest.TestCase):
+    REPEAT = 20
+
+    @repeated
+    def test_predict_batch(self):
+        net = build_net([random.randint(1,6) for _ in xrange(3)])
+        listListDblFeatures = [randlist(-1.0,1.0,net.cInputs)
+                               for _ in xrange(random.randint(0,9))]
+        listListDblExpected = [nn.feed_forward(net, listDblFeatures)
+                               for listDblFeatures in listListDblFeatures]
+        listIExpected = [nn.distributed_decode_net_output(listDblOut)
+                         for listDblOut in listListDblExpected]
+        for net in (net, nn.MatrixNet.from_net(net)):
+            for cChunkSize in (None, 1, 4):
+                listListDblOut,listILabel = nn.predict_batch(
+                    net, listListDblFeatures, cChunkSize=cChunkSize)
+                self.assertEqual(listListDblExpected, listListDblOut)
+                self.assertEqual(listIExpected, listILabel)
+
+    def test_num_correct(self):
+        net = build_net([3,4,5])
+        listInst = [nn.Instance(random.randint(0,4), randlist(-1.0,1.0,3))
+                    for _ in xrange(20)]
+        cExpected = sum(int(inst.iLabel == nn.distributed_decode_net_output(
+                    nn.feed_forward(net, inst.listDblFeatures)))
+                        for inst in listInst)
+        self.assertEqual(cExpected, nn.num_correct(net, listInst))
+
+class ParallelTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(181)
+        self.listInst = [nn.Instance(random.randint(0,4), randlist(0.0,1.0,3))
+                         for _ in xrange(23)]
+
+    def train_parallel(self, net, cWorkers, cBatchSize, sMode):
+        netShared = nn.share_matrix_net(net)
+        pool = multiprocessing.Pool(cWorkers, nn.init_parallel_worker,
+                                    (netShared, self.listInst))
+        try:
+            cErrors = nn.parallel_train_round(pool, netShared,
+                                              len(self.listInst), cWorkers,
+                                              0.5, cBatchSize, sMode)
+        finally:
+            pool.close()
+            pool.join()
+        return cErrors,nn.unshare_matrix_net(netShared)
+
+    def assert_same_weights(self, netA, netB):
+        for layerA,layerB in zip(netA.listLayer, netB.listLayer):
+            self.assertEqual(layerA.arrDblW, layerB.arrDblW)
+            self.assertEqual(layerA.arrDblW0, layerB.arrDblW0)
+
+    def test_one_worker(self):
+        net = nn.MatrixNet.from_net(build_net([3,4,5]))
+        cErrors,netParallel = self.train_parallel(net, 1, 4, "sync")
+        self.assertEqual(nn.train_round(net, self.listInst, 0.5, 4), cErrors)
+        self.assert_same_weights(net, netParallel)
+
+    def test_sync_is_deterministic(self):
+        net = build_net([3,4,5])
+        cErrorsA,netA = self.train_parallel(net, 3, 2, "sync")
+        cErrorsB,netB = self.train_parallel(net, 3, 2, "sync")
+        self.assertEqual(cErrorsA, cErrorsB)
+        self.assert_same_weights(netA, netB)
+
+    def test_async(self):
+        net = nn.MatrixNet.from_net(build_net([3,4,5]))
+        cErrors,netParallel = self.train_parallel(net, 2, 1, "async")
+        self.assertTrue(0 <= cErrors <= len(self.listInst))
+        self.assertNotEqual(net.listLayer[0].arrDblW,
+                            netParallel.listLayer[0].arrDblW)
+
+    def test_average_steps(self):
+        listTplA = [(array.array('d', [1.0, 2.0]), array.array('d', [3.0]))]
+        listTplB = [(array.array('d', [3.0, 4.0]), array.array('d', [5.0]))]
+        self.assertEqual(listTplA, nn.average_steps([listTplA]))
+        self.assertEqual([(array.array('d', [2.0, 3.0]),
+                           array.array('d', [4.0]))],
+                         nn.average_steps([listTplA, listTplB]))
+
+class PipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.listInst = [nn.Instance(ix % 10, [float(ix)]) for ix in xrange(25)]
+
+    def flatten(self, pipeline):
+        listInst = []
+        for listInstBlock,listListDblTarget in pipeline:
+            self.assertEqual([tuple(nn.distributed_encode_label(inst.iLabel))
+                              for inst in listInstBlock], listListDblTarget)
+            listInst.extend(listInstBlock)
+        return listInst
+
+    def test_in_order(self):
+        pipeline = nn.BatchPipeline(self.listInst, 4)
+        self.assertEqual(list(nn.split_batches(self.listInst, 4)),
+                         [listInstBlock for listInstBlock,_ in pipeline])
+        self.assertEqual(self.listInst, self.flatten(pipeline))
+        self.assertRaises(ValueError, nn.BatchPipeline, self.listInst, 0)
+
+    def test_shuffle(self):
+        for cShuffleBuffer in (2, 8, 100):
+            random.seed(3)
+            pipeline = nn.BatchPipeline(self.listInst, 3, cShuffleBuffer)
+            listInstFirst = self.flatten(pipeline)
+            listInstSecond = self.flatten(pipeline)
+            self.assertEqual(sorted(self.listInst), sorted(listInstFirst))
+            self.assertNotEqual(self.listInst, listInstFirst)
+            self.assertNotEqual(listInstFirst, listInstSecond)
+            random.seed(3)
+            self.assertEqual(listInstFirst, self.flatten(pipeline))
+
+    def test_prefetch(self):
+        rnd = random.Random(5)
+        listInstExpected = self.flatten(
+            nn.BatchPipeline(self.listInst, 2, 10, rnd=rnd))
+        rnd.seed(5)
+        self.assertEqual(listInstExpected, self.flatten(
+                nn.BatchPipeline(self.listInst, 2, 10, cPrefetch=3, rnd=rnd)))
+
+    def test_prefetch_early_stop(self):
+        iterItem = nn.prefetch(iter(xrange(1000)), 2)
+        self.assertEqual([0, 1, 2], [iterItem.next() for _ in xrange(3)])
+        iterItem.close()
+
+    def test_prefetch_error(self):
+        def fail():
+            yield 1
+            raise KeyError("fail")
+        self.assertRaises(KeyError, list, nn.prefetch(fail(), 1))
+
+class LoadDataTest(unittest.TestCase):
+    DATA = "#1\n 0 255\n 51 0\n#7\n 1 2\n 3 4\n#0\n 5 6\n 7 8\n"
+
+    def setUp(self):
+        self.sDir = tempfile.mkdtemp()
+        self.sFilename = os.path.join(self.sDir, "data.txt")
+        self.write(self.DATA)
+
+    def tearDown(self):
+        shutil.rmtree(self.sDir)
+
+    def write(self, sData):
+        outfile = open(self.sFilename, "w")
+        try:
+            outfile.write(sData)
+        finally:
+            outfile.close()
+
+    def assert_same_instances(self, listInstExpected, listInst):
+        self.assertEqual(len(listInstExpected), len(listInst))
+        for instExpected,inst in zip(listInstExpected, listInst):
+            self.assertEqual(instExpected.iLabel, inst.iLabel)
+            self.assertEqual(instExpected.listDblFeatures,
+                             inst.listDblFeatures)
+            self.assertEqual(instExpected.cRow, inst.cRow)
+            self.assertEqual(instExpected.cCol, inst.cCol)
+
+    def test_cache_round_trip(self):
+        listInst = nn.load_data(self.sFilename)
+        self.assertTrue(os.path.exists(nn.cache_filename(self.sFilename)))
+        self.assert_same_instances(nn.parse_data(self.sFilename), listInst)
+        self.assert_same_instances(listInst,
+                                   nn.read_data_cache(self.sFilename))
+        self.assert_same_instances(listInst[:2],
+                                   nn.load_data(self.sFilename, 2))
+
+    def test_stale_cache(self):
+        nn.load_data(self.sFilename)
+        self.write(self.DATA + self.DATA)
+        self.assertEqual(None, nn.read_data_cache(self.sFilename))
+        listInst = nn.load_data(self.sFilename)
+        self.assertEqual(6, len(listInst))
+        self.assert_same_instances(nn.parse_data(self.sFilename), listInst)
+
+    def test_without_cache(self):
+        listInst = nn.load_data(self.sFilename, 2, fUseCache=False)
+        self.assertEqual(2, len(listInst))
+        self.assertFalse(os.path.exists(nn.cache_filename(self.sFilename)))
+
+    def assert_stream(self, listInstExpected, cChunkSize, cMaxInstances=None):
+        listInst = []
+        for arrILabel,arrDblFeatures in nn.stream_data(
+            self.sFilename, cChunkSize, cMaxInstances):
+            self.assertTrue(1 <= len(arrILabel) <= cChunkSize)
+            listInst.extend(nn.chunk_instances(arrILabel, arrDblFeatures))
+        self.assertEqual([inst.iLabel for inst in listInstExpected],
+                         [inst.iLabel for inst in listInst])
+        self.assertEqual([inst.listDblFeatures for inst in listInstExpected],
+                         [inst.listDblFeatures for inst in listInst])
+
+    def test_stream_data(self):
+        listInst = nn.parse_data(self.sFilename)
+        for fCache in (False, True):
+            if fCache:
+                nn.load_data(self.sFilename)
+            for cChunkSize in (1, 2, 5):
+                self.assert_stream(listInst, cChunkSize)
+                self.assert_stream(listInst[:2], cChunkSize, 2)
+        self.assertRaises(ValueError, list, nn.stream_data(self.sFilename, 0))
+
+    def test_data_stream(self):
+        listInst = nn.parse_data(self.sFilename)
+        stream = nn.DataStream(self.sFilename, 2)
+        self.assertEqual(len(listInst), len(stream))
+        self.assertEqual(2, len(nn.DataStream(self.sFilename, 2, 2)))
+        cInputs = len(listInst[0].listDblFeatures)
+        net = nn.init_matrix_net(nn.layer_sizes(cInputs, 3))
+        netStream = nn.init_matrix_net(nn.layer_sizes(cInputs, 3))
+        netStream.listLayer = [nn.MatrixLayer(layer.cInputs,
+                                              array.array('d', layer.arrDblW),
+                                              array.array('d', layer.arrDblW0))
+                               for layer in net.listLayer]
+        self.assertEqual(nn.train_round(net, listInst, 0.5),
+                         nn.train_round(netStream, stream, 0.5))
+        self.assertEqual(net.listLayer[0].arrDblW,
+                         netStream.listLayer[0].arrDblW)
+        self.assertEqual(nn.num_correct(net, listInst),
+                         nn.num_correct(netStream, stream))
+
+class EarlyStoppingTest(unittest.TestCase):
+    def assert_same_weights(self, netA, netB):
+        if not isinstance(netB, nn.MatrixNet):
+            netB = nn.MatrixNet.from_net(netB)
+        for layerA,layerB in zip(netA.listLayer, netB.listLayer):
+            self.assertEqual(layerA.arrDblW, layerB.arrDblW)
+            self.assertEqual(layerA.arrDblW0, layerB.arrDblW0)
+
+    def test_snapshot(self):
+        for net in (build_net([3,4,2]), nn.init_matrix_net([3,4,2])):
+            netSaved = net
+            if isinstance(net, nn.MatrixNet):
+                netSaved = net.to_net()
+            netSaved = nn.MatrixNet.from_net(netSaved)
+            snapshot = nn.WeightSnapshot(net)
+            nn.update_net(net, nn.Instance(0, randlist(0.0, 1.0, 3)), 0.5,
+                          [0.95, 0.05])
+            nn.update_net(net, nn.Instance(0, randlist(0.0, 1.0, 3)), 0.5,
+                          [0.05, 0.95])
+            snapshot.restore(net)
+            self.assert_same_weights(netSaved, net)
+
+    def test_patience(self):
+        stopping = nn.EarlyStopping([], cPatience=1, dblMinDelta=0.01)
+        for cRound,dblAccuracy in enumerate([0.5, 0.6, 0.605, 0.65, 0.64]):
+            stopping.record(None, cRound + 1, dblAccuracy)
+            self.assertFalse(stopping.fStop)
+        stopping.record(None, 6, 0.655)
+        self.assertTrue(stopping.fStop)
+        self.assertEqual(0.65, stopping.dblBest)
+        self.assertEqual(4, stopping.cRoundBest)
+        self.assertFalse(stopping.restore(None))
+
+    def test_stops_only_on_a_fall(self):
+        stopping = nn.EarlyStopping([])
+        for cRound,dblAccuracy in enumerate([0.5, 0.5, 0.6, 0.6]):
+            stopping.record(None, cRound + 1, dblAccuracy)
+            self.assertFalse(stopping.fStop)
+        stopping.record(None, 5, 0.59)
+        self.assertTrue(stopping.fStop)
+        self.assertEqual(3, stopping.cRoundBest)
+
+    def test_restore_best(self):
+        net = nn.init_matrix_net([3,2])
+        netSaved = nn.MatrixNet.from_net(net.to_net())
+        stopping = nn.EarlyStopping([], fRestoreBest=True)
+        stopping.record(net, 1, 0.5)
+        nn.update_net(net, nn.Instance(0, randlist(0.0, 1.0, 3)), 0.5,
+                      [0.95, 0.05])
+        stopping.record(net, 2, 0.4)
+        self.assertTrue(stopping.fStop)
+        self.assertTrue(stopping.restore(net))
+        self.assert_same_weights(netSaved, net)
+
+    def test_subset(self):
+        listInst = [nn.Instance(ix % 2, randlist(0.0, 1.0, 3))
+                    for ix in xrange(50)]
+        stopping = nn.EarlyStopping(listInst, cSubset=10, cEvery=2)
+        self.assertEqual(10, len(stopping.listInstSubset))
+        for inst in stopping.listInstSubset:
+            self.assertTrue(inst in listInst)
+        net = nn.init_matrix_net(nn.layer_sizes(3, 0))
+        self.assertEqual(None, stopping.check(net, 1))
+        dblSubset,fFull = stopping.check(net, 2)
+        self.assertFalse(fFull)
+        dblAccuracy,fFull = stopping.check(net, 4)
+        self.assertTrue(fFull)
+        self.assertEqual(nn.num_correct(net, listInst)*1.0/len(listInst),
+                         dblAccuracy)
+        self.assertEqual(None,
+                         nn.EarlyStopping(listInst, cSubset=50).listInstSubset)
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.sDir = tempfile.mkdtemp()
+        self.sFilename = os.path.join(self.sDir, "net.nnckpt")
+
+    def tearDown(self):
+        shutil.rmtree(self.sDir)
+
+    def test_round_trip(self):
+        net = build_net([3,4,2])
+        random.gauss(0.0, 1.0)
+        tplRandomState = random.getstate()
+        nn.save_checkpoint(self.sFilename, net, 7, 0.25, tplRandomState)
+        checkpoint = nn.load_checkpoint(self.sFilename)
+        self.assertEqual(7, checkpoint.cRound)
+        self.assertEqual(0.25, checkpoint.dblLearningRate)
+        self.assertEqual(tplRandomState, checkpoint.tplRandomState)
+        self.assertEqual(3, checkpoint.net.cInputs)
+        mnet = nn.MatrixNet.from_net(net)
+        for layer,layerLoaded in zip(mnet.listLayer, checkpoint.net.listLayer):
+            self.assertEqual(layer.cInputs, layerLoaded.cInputs)
+            self.assertEqual(layer.arrDblW, layerLoaded.arrDblW)
+            self.assertEqual(layer.arrDblW0, layerLoaded.arrDblW0)
+
+    def test_without_random_state(self):
+        nn.save_checkpoint(self.sFilename, nn.init_matrix_net([2,1]))
+        checkpoint = nn.load_checkpoint(self.sFilename)
+        self.assertEqual(0, checkpoint.cRound)
+        self.assertEqual(None, checkpoint.tplRandomState)
+
+    def test_bad_checkpoint(self):
+        nn.save_checkpoint(self.sFilename, build_net([3,4,2]))
+        infile = open(self.sFilename, "rb")
+        try:
+            sData = infile.read()
+        finally:
+            infile.close()
+        for sBad in ("NOTACKPT" + sData[8:], sData[:-8], sData + "\0"):
+            outfile = open(self.sFilename, "wb")
+            try:
+                outfile.write(sBad)
+            finally:
+                outfile.close()
+            self.assertRaises(ValueError, nn.load_checkpoint, self.sFilename)
+
+class SweepTest(unittest.TestCase):
+    def test_parse_sweep_values(self):
+        self.assertEqual([1,2,3,7], nn.parse_sweep_values("1-3, 7", int))
+        self.assertEqual([0.1,1.5], nn.parse_sweep_values(".1,1.5", float))
+        self.assertRaises(ValueError, nn.parse_sweep_values, "a", int)
+
+    def test_grid_trials(self):
+        listDictTrial = nn.sweep_trials([0.1,0.2,0.3], [5,10], [4,8])
+        self.assertEqual(12, len(listDictTrial))
+        self.assertEqual(range(12), [d["trial"] for d in listDictTrial])
+        setTpl = set((d["learning_rate"],d["hidden_units"],d["rounds"])
+                     for d in listDictTrial)
+        self.assertEqual(12, len(setTpl))
+
+    def test_random_trials(self):
+        listDictTrial = nn.sweep_trials([0.1,0.2,0.3], range(1,31), [10],
+                                        "random", 20, random.Random(0))
+        self.assertEqual(20, len(listDictTrial))
+        setTpl = set((d["learning_rate"],d["hidden_units"])
+                     for d in listDictTrial)
+        self.assertEqual(20, len(setTpl))
+        self.assertEqual(listDictTrial,
+                         nn.sweep_trials([0.1,0.2,0.3], range(1,31), [10],
+                                         "random", 20, random.Random(0)))
+
+    def test_halving_trials(self):
+        listDictTrial = nn.sweep_trials([0.1,0.2], [5,10], [4,8], "halving")
+        self.assertEqual(4, len(listDictTrial))
+        self.assertEqual([8]*4, [d["rounds"] for d in listDictTrial])
+        self.assertEqual(1, nn.halving_first_rung(270, 10, 3))
+        self.assertEqual(10, nn.halving_first_rung(2, 10, 3))
+
+    def test_trials_need_rounds(self):
+        self.assertRaises(ValueError, nn.sweep_trials, [0.1], [5], [0, 4])
+        self.assertRaises(ValueError, nn.sweep_trials, [0.1], [5], [0],
+                          "halving")
+
 class EncodingTest(unittest.TestCase):
     REPEAT = 1000
     
@@ -390,6 +965,49 @@ class EncodingTest(unittest.TestCase):
                 listDblEncoding[ix] = 1.0 - (random.random()*0.5)
         iResult = nn.binary_decode_net_output(listDblEncoding)
         self.assertEqual(iLabel,iResult)
+
+    def test_label_encoding(self):
+        for fxnEncode in (nn.distributed_encode_label, nn.binary_encode_label):
+            encoding = nn.label_encoding(fxnEncode)
+            self.assertTrue(encoding is nn.label_encoding(fxnEncode))
+            self.assertTrue(encoding is nn.label_encoding(encoding))
+            listILabel = [random.randint(0, nn.LABEL_COUNT - 1)
+                          for _ in xrange(50)]
+            listTplTarget = encoding.encode_rows(listILabel)
+            self.assertEqual([tuple(fxnEncode(iLabel))
+                              for iLabel in listILabel], listTplTarget)
+            self.assertEqual(encoding.cOutputs * len(listILabel),
+                             len(encoding.encode_block(listILabel)))
+            self.assertEqual([dbl for tpl in listTplTarget for dbl in tpl],
+                             list(encoding.encode_block(listILabel)))
+
+    @repeated
+    def test_decode_block(self):
+        cBits = nn.label_encoding(nn.binary_encode_label).cOutputs
+        for fxnDecode,cOutputs in ((nn.distributed_decode_net_output,
+                                    nn.LABEL_COUNT),
+                                   (nn.binary_decode_net_output, cBits)):
+            listListDblOutput = [randlist(0.0, 1.0, cOutputs)
+                                 for _ in xrange(5)]
+            listIExpected = [fxnDecode(list(listDblOutput))
+                             for listDblOutput in listListDblOutput]
+            listListDblCopy = [list(listDblOutput)
+                               for listDblOutput in listListDblOutput]
+            self.assertEqual(listIExpected,
+                             nn.decode_block(fxnDecode, listListDblOutput))
+            self.assertEqual(listListDblCopy, listListDblOutput)
+
+    def test_decode_block_calls_decoder(self):
+        listListDblOutput = [randlist(0.0, 1.0, 4) for _ in xrange(3)]
+        listListDblSeen = []
+        def decode(listDblOutput):
+            listListDblSeen.append(list(listDblOutput))
+            return 7
+        self.assertEqual([7]*3, nn.decode_block(decode, listListDblOutput))
+        self.assertEqual(listListDblOutput, listListDblSeen)
+        _,listILabel = nn.predict_batch(build_net([4,3,2]),
+                                        listListDblOutput, decode)
+        self.assertEqual([7]*3, listILabel)
                 
 if __name__ == "__main__":
     unittest.main()
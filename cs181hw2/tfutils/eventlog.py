@@ -5,11 +5,21 @@ eventlog.py -- create records of actions including file modification,
 unit test success/failure, and running of tasks.
 """
 
+import atexit
 import datetime
+try:
+    import json
+except ImportError:
+    import simplejson as json
+import optparse
 import os
 from os import path
+import Queue
 import sqlite3
+import sys
+import threading
 import time
+import traceback
 
 import loadconfig
 
@@ -32,10 +42,52 @@ CREATE TABLE task_invocation (
   task_id INTEGER NOT NULL,
   success INTEGER NOT NULL,
   traceback TEXT)"""),
+("test_invocation_name_time", """
+CREATE INDEX test_invocation_name_time
+  ON test_invocation (test_name, timestamp)"""),
+("task_invocation_name_time", """
+CREATE INDEX task_invocation_name_time
+  ON task_invocation (task_name, timestamp)"""),
+("test_invocation_success_time", """
+CREATE INDEX test_invocation_success_time
+  ON test_invocation (success, timestamp)"""),
+("task_invocation_success_time", """
+CREATE INDEX task_invocation_success_time
+  ON task_invocation (success, timestamp)"""),
+("test_summary", """
+CREATE TABLE test_summary (
+  test_name TEXT NOT NULL,
+  day NUMERIC NOT NULL,
+  runs INTEGER NOT NULL,
+  successes INTEGER NOT NULL,
+  PRIMARY KEY (test_name, day))"""),
+("task_summary", """
+CREATE TABLE task_summary (
+  task_name TEXT NOT NULL,
+  day NUMERIC NOT NULL,
+  runs INTEGER NOT NULL,
+  successes INTEGER NOT NULL,
+  PRIMARY KEY (task_name, day))"""),
+("test_result_cache", """
+CREATE TABLE test_result_cache (
+  test_name TEXT PRIMARY KEY,
+  fingerprint TEXT NOT NULL,
+  timestamp NUMERIC NOT NULL,
+  results TEXT NOT NULL)"""),
 )
 
+# the kinds of invocation recorded, and the name field of each
+INVOCATION_KINDS = ("test", "task")
+
+SECONDS_PER_DAY = 24*60*60
+
 CONFIG_DIR = loadconfig.get_config_dir()
 
+# the writer thread commits once this many invocations are waiting, or
+# once the oldest has waited this many seconds
+WRITE_BATCH_SIZE = 64
+WRITE_INTERVAL = 0.5
+
 def get_time_now():
     return time.mktime(datetime.datetime.now().timetuple())
     
@@ -62,7 +114,9 @@ def init():
     finally:
         conn.close()       
 
-def add_invocation(conn, sTableName, sNameField, dictProperties):
+def build_invocation(sTableName, sNameField, dictProperties):
+    """Returns the SQL statement and the values that record an invocation
+    in sTableName, timestamped now."""
     listRequiredFields = ["success"] + [sTmpl % sNameField
                                         for sTmpl in "%s_name", "%s_id"]
     for sField in listRequiredFields:
@@ -83,22 +137,153 @@ def add_invocation(conn, sTableName, sNameField, dictProperties):
     sSql = sFmtTmpl % {"sTableName": sTableName,
                        "sNameField": sNameField,
                        "sFieldNames": ", ".join(listFieldNames)}
+    return sSql,listFieldValues
+
+def add_invocation(conn, sTableName, sNameField, dictProperties):
+    sSql,listFieldValues = build_invocation(sTableName, sNameField,
+                                            dictProperties)
     c = conn.cursor()
     c.execute(sSql, listFieldValues)
 
-def add_test_invocation(dictProperties):
+class EventWriter(object):
+    """Records invocations on a background thread, so that callers never
+    wait for the disk. The thread keeps one connection open, in WAL mode,
+    and commits the invocations queued by add in batches: once
+    cBatchSize are waiting, or once the oldest has waited dblInterval
+    seconds.
+
+    Errors never stop the thread. If the database cannot be opened, the
+    batch is dropped with a message on stderr, and the next batch tries
+    again."""
+    def __init__(self, sFilename=None, cBatchSize=WRITE_BATCH_SIZE,
+                 dblInterval=WRITE_INTERVAL):
+        if sFilename is None:
+            sFilename = path.join(CONFIG_DIR, FILENAME)
+        self.sFilename = sFilename
+        self.cBatchSize = cBatchSize
+        self.dblInterval = dblInterval
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self.write_loop)
+        self.thread.daemon = True
+        self.thread.start()
+    def add(self, sTableName, sNameField, dictProperties):
+        """Queue an invocation to be recorded in sTableName. Its timestamp
+        is the time of the call, not of the write."""
+        self.write(*build_invocation(sTableName, sNameField, dictProperties))
+    def write(self, sSql, listArgs):
+        """Queue a statement to be executed in the next batch."""
+        self.queue.put((sSql, listArgs))
+    def flush(self):
+        """Wait until every invocation queued so far has been committed,
+        or dropped because it could not be. Returns at once if the writer
+        thread is not running."""
+        if not self.thread.isAlive():
+            return
+        evtFlushed = threading.Event()
+        self.queue.put(evtFlushed)
+        while not evtFlushed.wait(self.dblInterval):
+            if not self.thread.isAlive():
+                return
+    def close(self):
+        """Commit the queued invocations and stop the writer thread."""
+        if self.thread.isAlive():
+            self.queue.put(None)
+            self.thread.join()
+    def next_batch(self):
+        """Returns the queued items to write in the next transaction,
+        waiting for the first one."""
+        listItem = [self.queue.get()]
+        dblDeadline = time.time() + self.dblInterval
+        while (len(listItem) < self.cBatchSize
+               and isinstance(listItem[-1], tuple)):
+            dblWait = dblDeadline - time.time()
+            if dblWait <= 0:
+                break
+            try:
+                listItem.append(self.queue.get(timeout=dblWait))
+            except Queue.Empty:
+                break
+        return listItem
+    def connect(self):
+        """Returns a connection to the database, set up for writing."""
+        conn = sqlite3.connect(self.sFilename, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            build_db(SCHEMA_TEMPLATE, conn)
+        except:
+            conn.close()
+            raise
+        return conn
+    def write_loop(self):
+        conn = None
+        fRunning = True
+        while fRunning:
+            listItem = self.next_batch()
+            listTplInvocation = [item for item in listItem
+                                 if isinstance(item, tuple)]
+            try:
+                if listTplInvocation:
+                    if conn is None:
+                        conn = self.connect()
+                    self.write_batch(conn, listTplInvocation)
+            except Exception:
+                sys.stderr.write("eventlog: could not record %d invocations "
+                                 "in %s\n%s"
+                                 % (len(listTplInvocation), self.sFilename,
+                                    traceback.format_exc()))
+            for item in listItem:
+                if item is None:
+                    fRunning = False
+                elif not isinstance(item, tuple):
+                    item.set()
+        if conn is not None:
+            conn.close()
+    def write_batch(self, conn, listTplInvocation):
+        try:
+            conn.execute("BEGIN")
+            for sSql,listFieldValues in listTplInvocation:
+                conn.execute(sSql, listFieldValues)
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            sys.stderr.write("eventlog: could not record %d invocations\n%s"
+                             % (len(listTplInvocation),
+                                traceback.format_exc()))
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+
+_WRITER_LOCK = threading.Lock()
+_WRITER = []
+
+def get_writer():
+    """Returns the EventWriter all invocations go through, starting it on
+    first use. It is flushed and closed when the interpreter exits."""
+    _WRITER_LOCK.acquire()
     try:
-        conn = open_conn()
-        add_invocation(conn, "test_invocation", "test", dictProperties)
+        if not _WRITER:
+            _WRITER.append(EventWriter())
+            atexit.register(_WRITER[0].close)
+        return _WRITER[0]
     finally:
-        conn.close()
+        _WRITER_LOCK.release()
 
-def add_task_invocation(dictProperties):
+def flush():
+    """Wait until every invocation recorded so far is in the database."""
+    _WRITER_LOCK.acquire()
     try:
-        conn = open_conn()
-        add_invocation(conn, "task_invocation", "task", dictProperties)
+        listWriter = list(_WRITER)
     finally:
-        conn.close()
+        _WRITER_LOCK.release()
+    for writer in listWriter:
+        writer.flush()
+
+def add_test_invocation(dictProperties):
+    get_writer().add("test_invocation", "test", dictProperties)
+
+def add_task_invocation(dictProperties):
+    get_writer().add("task_invocation", "task", dictProperties)
 
 def test_success(sTestName, ixTestId):
     dictProperties = {"success": True, "traceback": None,
@@ -120,6 +305,130 @@ def task_failure(sTaskName, ixTaskId, sTraceback):
                       "task_name": sTaskName, "task_id": int(ixTaskId)}
     return add_task_invocation(dictProperties)
 
+def store_test_result(sTestName, sFingerprint, dictResults):
+    """Cache dictResults, the result of a test, under its fingerprint."""
+    get_writer().write("""INSERT OR REPLACE INTO test_result_cache
+    (test_name, fingerprint, timestamp, results) VALUES (?,?,?,?)""",
+                       [sTestName, sFingerprint, get_time_now(),
+                        json.dumps(dictResults)])
+
+def cached_test_results(dictFingerprint):
+    """Returns the cached results of the tests in dictFingerprint, which
+    maps test names to their fingerprints, as a dictionary from test
+    name to result. Tests whose fingerprint changed are left out."""
+    if not dictFingerprint:
+        return {}
+    flush()
+    conn = open_conn()
+    try:
+        build_db(SCHEMA_TEMPLATE, conn)
+        listSName = list(dictFingerprint)
+        c = conn.execute("""SELECT test_name, fingerprint, results
+        FROM test_result_cache WHERE test_name IN (%s)"""
+                         % ",".join("?"*len(listSName)), listSName)
+        return dict((sName, json.loads(sResults))
+                    for sName,sFingerprint,sResults in c
+                    if dictFingerprint[sName] == sFingerprint)
+    finally:
+        conn.close()
+
+def invocation_table(sKind):
+    """Returns the invocation table, summary table and name field of the
+    invocations of kind sKind, "test" or "task"."""
+    if sKind not in INVOCATION_KINDS:
+        raise ValueError("Unknown kind of invocation: %s" % sKind)
+    return "%s_invocation" % sKind,"%s_summary" % sKind,"%s_name" % sKind
+
+def latest_results(conn, sKind="test"):
+    """Returns the latest invocation of each test or task, as a dictionary
+    from its name to a (timestamp, success, traceback) tuple."""
+    sTable,_,sNameField = invocation_table(sKind)
+    sSql = """SELECT %(sNameField)s, timestamp, success, traceback
+    FROM %(sTable)s WHERE id IN (
+      SELECT (SELECT id FROM %(sTable)s AS inv
+              WHERE inv.%(sNameField)s = names.%(sNameField)s
+              ORDER BY timestamp DESC, id DESC LIMIT 1)
+      FROM (SELECT DISTINCT %(sNameField)s FROM %(sTable)s) AS names)"""
+    c = conn.execute(sSql % {"sTable": sTable, "sNameField": sNameField})
+    return dict((sName, (dblTime, bool(iSuccess), sTb))
+                for sName,dblTime,iSuccess,sTb in c)
+
+def pass_rates(conn, sKind="test", dblSince=0, dblUntil=None):
+    """Returns the pass rate of each test or task over the invocations
+    from dblSince up to, but not including, dblUntil (now by default), as
+    a dictionary from its name to a (runs, successes, rate) tuple. Days
+    compacted into the summary table count if they start in the window."""
+    sTable,sSummary,sNameField = invocation_table(sKind)
+    if dblUntil is None:
+        dblUntil = get_time_now() + 1
+    dictCounts = {}
+    for sSql in ("""SELECT %(sNameField)s, COUNT(*), SUM(success)
+                 FROM %(sTable)s WHERE timestamp >= ? AND timestamp < ?
+                 GROUP BY %(sNameField)s""",
+                 """SELECT %(sNameField)s, SUM(runs), SUM(successes)
+                 FROM %(sSummary)s WHERE day >= ? AND day < ?
+                 GROUP BY %(sNameField)s"""):
+        c = conn.execute(sSql % {"sTable": sTable, "sSummary": sSummary,
+                                 "sNameField": sNameField},
+                         (dblSince, dblUntil))
+        for sName,cRuns,cSuccesses in c:
+            cRunsOld,cSuccessesOld = dictCounts.get(sName, (0, 0))
+            dictCounts[sName] = (cRunsOld + cRuns,
+                                 cSuccessesOld + cSuccesses)
+    return dict((sName, (cRuns, cSuccesses, float(cSuccesses)/cRuns))
+                for sName,(cRuns,cSuccesses) in dictCounts.iteritems())
+
+def failures_since(conn, sKind="test", dblSince=0, sName=None):
+    """Returns the failed invocations of tests or tasks since dblSince,
+    oldest first, as (timestamp, name, traceback) tuples. With sName,
+    only the failures of that test or task."""
+    sTable,_,sNameField = invocation_table(sKind)
+    sSql = ("SELECT timestamp, %s, traceback FROM %s"
+            " WHERE success = 0 AND timestamp >= ?" % (sNameField, sTable))
+    listArgs = [dblSince]
+    if sName is not None:
+        sSql += " AND %s = ?" % sNameField
+        listArgs.append(sName)
+    sSql += " ORDER BY timestamp, id"
+    return conn.execute(sSql, listArgs).fetchall()
+
+def compact(conn, dblBefore, fVacuum=True):
+    """Roll the invocations older than dblBefore up into the summary
+    tables, as runs and successes per name and day, and delete them. The
+    latest invocation of each test and task is always kept, traceback
+    and all. Then vacuum the database, unless fVacuum is False. Returns
+    the number of invocations rolled up."""
+    cRolled = 0
+    conn.execute("BEGIN")
+    try:
+        for sKind in INVOCATION_KINDS:
+            sTable,sSummary,sNameField = invocation_table(sKind)
+            dictSql = {"sTable": sTable, "sSummary": sSummary,
+                       "sNameField": sNameField, "cDay": SECONDS_PER_DAY}
+            sOld = """FROM %(sTable)s WHERE timestamp < ? AND id NOT IN (
+              SELECT MAX(id) FROM %(sTable)s GROUP BY %(sNameField)s)"""
+            c = conn.execute(("""SELECT %(sNameField)s,
+              CAST(timestamp/%(cDay)d AS INTEGER)*%(cDay)d AS day,
+              COUNT(*), SUM(success) """ + sOld
+              + " GROUP BY %(sNameField)s, day") % dictSql, (dblBefore,))
+            for sName,dblDay,cRuns,cSuccesses in c.fetchall():
+                conn.execute("""INSERT OR IGNORE INTO %(sSummary)s
+                  (%(sNameField)s, day, runs, successes)
+                  VALUES (?, ?, 0, 0)""" % dictSql, (sName, dblDay))
+                conn.execute("""UPDATE %(sSummary)s
+                  SET runs = runs + ?, successes = successes + ?
+                  WHERE %(sNameField)s = ? AND day = ?""" % dictSql,
+                             (cRuns, cSuccesses, sName, dblDay))
+                cRolled += cRuns
+            conn.execute(("DELETE " + sOld) % dictSql, (dblBefore,))
+        conn.execute("COMMIT")
+    except:
+        conn.execute("ROLLBACK")
+        raise
+    if fVacuum:
+        conn.execute("VACUUM")
+    return cRolled
+
 def list_tests(conn):
     c = conn.execute("SELECT * FROM test_invocation")
     return [r for r in c]
@@ -135,8 +444,55 @@ def fmt_invocation(tplInv):
       if sName is not None:
           print "%s\t%s" % (sName, sValue)
           
+def fmt_time(dblTime):
+    return datetime.datetime.fromtimestamp(dblTime).strftime(
+        "%Y-%m-%d %H:%M:%S")
+
 def main(argv):
+    parser = optparse.OptionParser()
+    parser.add_option("-k", "--kind", action="store", dest="kind",
+                      default="test", type="choice",
+                      choices=INVOCATION_KINDS,
+                      help="report on test or task invocations")
+    parser.add_option("--latest", action="store_true", dest="latest",
+                      default=False,
+                      help="print the latest result of each test or task")
+    parser.add_option("--pass-rate", action="store", dest="pass_rate",
+                      type=float, default=None, metavar="DAYS",
+                      help="print the pass rate of each test or task over "
+                      "the last DAYS days")
+    parser.add_option("--failures", action="store", dest="failures",
+                      type=float, default=None, metavar="DAYS",
+                      help="print the failures of the last DAYS days")
+    parser.add_option("--compact", action="store", dest="compact",
+                      type=float, default=None, metavar="DAYS",
+                      help="roll invocations older than DAYS days up into "
+                      "daily summaries, then vacuum the database")
+    opts,args = parser.parse_args(argv)
     conn = open_conn()
+    build_db(SCHEMA_TEMPLATE, conn)
+    dblNow = get_time_now()
+    if opts.compact is not None:
+        cRolled = compact(conn, dblNow - opts.compact*SECONDS_PER_DAY)
+        print "Compacted %d invocations." % cRolled
+    if opts.latest:
+        for sName,(dblTime,fSuccess,_) in sorted(
+                latest_results(conn, opts.kind).iteritems()):
+            print "%s\t%s\t%s" % (fmt_time(dblTime),
+                                  "pass" if fSuccess else "FAIL", sName)
+    if opts.pass_rate is not None:
+        dictRate = pass_rates(conn, opts.kind,
+                              dblNow - opts.pass_rate*SECONDS_PER_DAY)
+        for sName,(cRuns,cSuccesses,dblRate) in sorted(dictRate.iteritems()):
+            print "%5.1f%%\t%d/%d\t%s" % (100.0*dblRate, cSuccesses, cRuns,
+                                         sName)
+    if opts.failures is not None:
+        for dblTime,sName,_ in failures_since(
+                conn, opts.kind, dblNow - opts.failures*SECONDS_PER_DAY):
+            print "%s\t%s" % (fmt_time(dblTime), sName)
+    if (opts.compact is not None or opts.latest
+        or opts.pass_rate is not None or opts.failures is not None):
+        return 0
     #build_db(SCHEMA_TEMPLATE, conn)
     #test_success("passing_test", 1)
     #test_failure("failing_test", 2, "tb")
@@ -6,6 +6,7 @@ modules.py -- list the modules exported by tfutils
 
 TFUTILS_FILES = ("serveui.py", "tftask.py", "monitortests.py", "loadconfig.py",
                  "eventlog.py", "updatemanager.py", "modules.py",
+                 "resultcache.py", "jsonbackend.py", "setup_speedups.py",
                  "__init__.py", "static", "simplejson", "versions/origin.js")
 
 if __name__ == "__main__":
@@ -6,27 +6,37 @@ in order to provide UI functionality for problem set tasks.
 """
 
 import BaseHTTPServer
-try:
-    import json
-except ImportError:
-    import simplejson as json
+import itertools
 import optparse
 import os
 from os import path
+import Queue
 import re
 import signal
+import SocketServer
 import sys
 import threading
+import time
+import traceback
 import urllib
 import webbrowser
 
 import eventlog
+import jsonbackend
 import loadconfig
 import monitortests
+import resultcache
 import tftask
 import updatemanager
 
+json = jsonbackend.get_json()
+
 DEFAULT_PORT = 14512
+DEFAULT_TASK_WORKERS = 2
+# seconds a finished job is kept for the browser to fetch its result
+DEFAULT_JOB_TTL = 600.0
+# progress reports kept per job; older ones are dropped
+MAX_JOB_PROGRESS = 1000
 STATIC_CONTENT_PREFIX = "static"
 
 STATIC_RE = re.compile(r'^[/]' + STATIC_CONTENT_PREFIX
@@ -34,10 +44,62 @@ STATIC_RE = re.compile(r'^[/]' + STATIC_CONTENT_PREFIX
 TEST_RE = re.compile(r'^[/]test/(?P<sCommand>[^/]*)[/]$')
 METADATA_RE = re.compile(r'^[/]metadata[/]$')
 TASK_RE = re.compile(r'^[/]task/(?P<sTask>[^/]*)[/]$')
+JOB_RE = re.compile(r'^[/]job/(?P<sJob>[^/]*)[/]$')
+JOB_EVENTS_RE = re.compile(r'^[/]job/(?P<sJob>[^/]*)/events[/]$')
 UPDATES_RE = re.compile(r'^[/]updates/(?P<sUpdateTask>[^/]*)[/]$')
 
 GLOBAL_STATE = {}
 
+class ModuleLock(object):
+    """Guards the work and test modules. Any number of threads may use
+    them at once, holding the lock shared, but reloading them takes it
+    exclusively: the reload waits for every user to finish, and threads
+    that want to use the modules wait for the reload, so nothing runs
+    against half-reloaded code."""
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.cShared = 0
+        self.fExclusive = False
+        self.cWaiting = 0
+    def acquire_shared(self):
+        self.condition.acquire()
+        try:
+            while self.fExclusive or self.cWaiting:
+                self.condition.wait()
+            self.cShared += 1
+        finally:
+            self.condition.release()
+    def release_shared(self):
+        self.condition.acquire()
+        try:
+            self.cShared -= 1
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+    def acquire_exclusive(self):
+        self.condition.acquire()
+        try:
+            self.cWaiting += 1
+            try:
+                while self.fExclusive or self.cShared:
+                    self.condition.wait()
+            finally:
+                self.cWaiting -= 1
+            self.fExclusive = True
+        finally:
+            self.condition.release()
+    def release_exclusive(self):
+        self.condition.acquire()
+        try:
+            self.fExclusive = False
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+MODULE_LOCK = ModuleLock()
+# hash of the source each module was last loaded from, by module name
+SOURCE_HASH = {}
+
 CONFIG_DIR = loadconfig.get_config_dir()
 
 def _static(*args):
@@ -57,8 +119,28 @@ def load_module(sPath):
         sys.path.append(path.dirname(sAbsPath))
     return __import__(path.basename(sPref))
 
+def module_changed(mod):
+    return resultcache.module_hash(mod) != SOURCE_HASH.get(mod.__name__)
+
+def reload_modules(*args):
+    """Reload those of the modules in args whose source has changed since
+    they were last loaded, holding MODULE_LOCK exclusively. If none has
+    changed, the lock is not taken at all, so there is no need to wait
+    for running tasks and tests."""
+    if not filter(module_changed, args):
+        return
+    MODULE_LOCK.acquire_exclusive()
+    try:
+        for mod in filter(module_changed, args):
+            SOURCE_HASH[mod.__name__] = resultcache.module_hash(mod)
+            reload(mod)
+    finally:
+        MODULE_LOCK.release_exclusive()
+
 def get_post_data(req):
-    s = req.rfile.read(int(req.headers["content-length"]))
+    s = req.rfile.read(int(req.headers.get("content-length", 0)))
+    if not s:
+        return {}
     listKv = s.split('&')
     listPairs = [sKv.split('=') for sKv in listKv]
     dictData = {}
@@ -99,42 +181,288 @@ def serve_static(req, sStaticPath):
         infile.close()
     return sContents
 
+def send_json(req, o):
+    """Send o to the browser as JSON, writing it to the socket a chunk at a
+    time as jsonbackend.iterencode encodes it, so that neither the whole
+    string nor the time to encode it stands between the request and the
+    first bytes. HTTP/1.1 clients get the chunks with chunked transfer
+    encoding; others get them up to the end of the connection.
+
+    The first chunk is encoded before the status line is sent, so an
+    object that cannot be encoded at all gets do_safe_request's error
+    response rather than a broken 200. If encoding fails after that, the
+    error is printed and the body is ended where it stopped, which the
+    browser then fails to parse."""
+    iterChunks = jsonbackend.iterencode(o, json)
+    listSFirst = list(itertools.islice(iterChunks, 1))
+    fChunked = (req.request_version == "HTTP/1.1")
+    if fChunked:
+        req.protocol_version = "HTTP/1.1"
+    req.send_response(200)
+    req.send_header("Content-Type", "application/json")
+    req.send_header("Cache-Control", "no-cache")
+    req.send_header("Connection", "close")
+    if fChunked:
+        req.send_header("Transfer-Encoding", "chunked")
+    req.end_headers()
+    iterChunks = itertools.chain(listSFirst, iterChunks)
+    while True:
+        try:
+            sChunk = iterChunks.next()
+        except StopIteration:
+            break
+        except Exception:
+            print traceback.format_exc()
+            break
+        if fChunked:
+            req.wfile.write("%x\r\n%s\r\n" % (len(sChunk), sChunk))
+        else:
+            req.wfile.write(sChunk)
+    if fChunked:
+        req.wfile.write("0\r\n\r\n")
+    return ""
+
 def serve_metadata(req):
     dictConfig = GLOBAL_STATE["dictConfig"]
-    return json.dumps({"sTaskTitle":dictConfig["title"],
-                       "sTaskSubtitle":dictConfig["subtitle"],
-                       "listTask": get_task_metadata()})
+    return send_json(req, {"sTaskTitle":dictConfig["title"],
+                           "sTaskSubtitle":dictConfig["subtitle"],
+                           "listTask": get_task_metadata()})
+
+def load_fixture():
+    """Builds the fixture of the test module and keeps it, with the hash of
+    the source it was built from. The caller holds MODULE_LOCK shared."""
+    modTest = GLOBAL_STATE["modTest"]
+    fxt = monitortests.load_tests(modTest, GLOBAL_STATE["modWork"])
+    GLOBAL_STATE["fxt"] = fxt
+    GLOBAL_STATE["sFixtureHash"] = SOURCE_HASH.get(modTest.__name__)
+    return fxt
 
 def serve_test(req, sCommand):
+    modTest = GLOBAL_STATE["modTest"]
+    modWork = GLOBAL_STATE["modWork"]
     if sCommand == "load":
-        modTest = GLOBAL_STATE["modTest"]
-        modWork = GLOBAL_STATE["modWork"]
-        reload(modTest)
-        reload(modWork)
-        fxt = monitortests.load_tests(modTest,modWork)
-        GLOBAL_STATE["fxt"] = fxt
-        return json.dumps(fxt.serialize())
+        reload_modules(modTest, modWork)
+        MODULE_LOCK.acquire_shared()
+        try:
+            fxt = load_fixture()
+        finally:
+            MODULE_LOCK.release_shared()
+        return send_json(req, fxt.serialize())
     if sCommand == "run" and req.command.lower() == "post":
         if "fxt" not in GLOBAL_STATE:
             raise ValueError("No fixture loaded.")
-        fxt = GLOBAL_STATE["fxt"]
-        listToRun = get_post_data(req)['tests'].split(',')
-        return json.dumps(fxt.run_multiple(listToRun))
+        dictPost = get_post_data(req)
+        listToRun = dictPost['tests'].split(',')
+        fIncremental = dictPost.get("refresh") != "1"
+        # the tests are fingerprinted from the source on disk, so they
+        # must run from that source too
+        reload_modules(modTest, modWork)
+        MODULE_LOCK.acquire_shared()
+        try:
+            fxt = GLOBAL_STATE["fxt"]
+            if GLOBAL_STATE["sFixtureHash"] != SOURCE_HASH.get(
+                    modTest.__name__):
+                fxt = load_fixture()
+            dictResult = fxt.run_multiple(listToRun,
+                                          fIncremental=fIncremental)
+        finally:
+            MODULE_LOCK.release_shared()
+        return send_json(req, dictResult)
     return None
 
+class TaskPool(object):
+    """Runs tasks on a fixed number of worker threads, so that long tasks
+    neither hold an HTTP connection open nor block other requests.
+
+    submit queues a task and returns the id of its job. poll returns the
+    state of a job: its id, the id of its task, its status ("queued",
+    "running" or "done"), the list of the last MAX_JOB_PROGRESS progress
+    reports the task has made (see BaseTask.report_progress), the number
+    of earlier ones dropped and, once done, the dictionary BaseTask.run
+    returned and the time it finished. Polling a job does not remove it,
+    so it can be polled or streamed any number of times; it is forgotten
+    dblTtl seconds after it finished.
+
+    A task is anything with a run method like BaseTask.run; serve_task
+    submits a QueuedTask."""
+    def __init__(self, cWorkers, dblTtl=DEFAULT_JOB_TTL):
+        self.dblTtl = dblTtl
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        # notified whenever a job makes progress or finishes
+        self.condition = threading.Condition(self.lock)
+        self.dictJob = {}
+        self.iterJobId = itertools.count(1)
+        self.listThread = []
+        for _ in xrange(cWorkers):
+            tr = threading.Thread(target=self.work)
+            tr.daemon = True
+            tr.start()
+            self.listThread.append(tr)
+    def expire(self):
+        """Forget the jobs that finished more than dblTtl seconds ago.
+        The caller holds self.lock."""
+        dblExpired = time.time() - self.dblTtl
+        for sJob,dictJob in self.dictJob.items():
+            if dictJob.get("finished", dblExpired) < dblExpired:
+                del self.dictJob[sJob]
+    def submit(self, sTask, task):
+        self.lock.acquire()
+        try:
+            self.expire()
+            sJob = str(self.iterJobId.next())
+            self.dictJob[sJob] = {"id": sJob, "task": sTask,
+                                  "status": "queued", "progress": [],
+                                  "dropped": 0, "result": None}
+        finally:
+            self.lock.release()
+        self.queue.put((sJob, task))
+        return sJob
+    def update(self, sJob, **kwargs):
+        self.lock.acquire()
+        try:
+            self.dictJob[sJob].update(kwargs)
+            self.condition.notifyAll()
+        finally:
+            self.lock.release()
+    def add_progress(self, sJob, dictProgress):
+        self.lock.acquire()
+        try:
+            dictJob = self.dictJob[sJob]
+            dictJob["progress"].append(dictProgress)
+            if len(dictJob["progress"]) > MAX_JOB_PROGRESS:
+                del dictJob["progress"][0]
+                dictJob["dropped"] += 1
+            self.condition.notifyAll()
+        finally:
+            self.lock.release()
+    def work(self):
+        while True:
+            sJob,task = self.queue.get()
+            self.update(sJob, status="running")
+            def report(dictProgress, sJob=sJob):
+                self.add_progress(sJob, dictProgress)
+            try:
+                dictResult = task.run(report)
+            except Exception:
+                dictResult = {"console": None, "result": None,
+                              "valid": False, "tb": traceback.format_exc()}
+            self.update(sJob, status="done", result=dictResult,
+                        finished=time.time())
+    def poll(self, sJob):
+        self.lock.acquire()
+        try:
+            self.expire()
+            if sJob not in self.dictJob:
+                raise ValueError("No such job: %s" % sJob)
+            return copy_job(self.dictJob[sJob])
+        finally:
+            self.lock.release()
+    def events(self, sJob):
+        """Returns an iterator over the events of a job as they happen:
+        a ("progress", dictProgress) pair for each progress report, then
+        ("done", dictJob) with the job as poll returns it once done. The
+        iterator simply ends if the job expires before it is done."""
+        self.lock.acquire()
+        try:
+            if sJob not in self.dictJob:
+                raise ValueError("No such job: %s" % sJob)
+        finally:
+            self.lock.release()
+        def iter_events():
+            # the number of reports sent so far, counting dropped ones
+            cSent = 0
+            while True:
+                self.condition.acquire()
+                try:
+                    while True:
+                        dictJob = self.dictJob.get(sJob)
+                        if dictJob is None:
+                            return
+                        cDropped = dictJob["dropped"]
+                        listProgress = dictJob["progress"][
+                            max(cSent - cDropped, 0):]
+                        if listProgress or dictJob["status"] == "done":
+                            break
+                        self.condition.wait()
+                    cSent = cDropped + len(dictJob["progress"])
+                    dictDone = None
+                    if not listProgress:
+                        dictDone = copy_job(dictJob)
+                finally:
+                    self.condition.release()
+                for dictProgress in listProgress:
+                    yield "progress",dictProgress
+                if dictDone is not None:
+                    yield "done",dictDone
+                    return
+        return iter_events()
+
+def copy_job(dictJob):
+    """Returns a copy of a TaskPool job that later progress reports do not
+    change."""
+    dictCopy = dict(dictJob)
+    dictCopy["progress"] = list(dictJob["progress"])
+    return dictCopy
+
+class QueuedTask(object):
+    """Stands in for the task with id sTask until a TaskPool worker picks
+    it up. run then reloads the work and task modules if they have
+    changed, looks the task up and runs it through the result cache,
+    holding MODULE_LOCK shared, so neither is reloaded under it. The cache
+    key is taken from the hashes of the loaded sources, so a result is
+    never stored under the key of code that did not produce it."""
+    def __init__(self, sTask, fRefresh=False):
+        self.sTask = sTask
+        self.fRefresh = fRefresh
+    def run(self, fxnProgress=None):
+        listMod = [GLOBAL_STATE["modWork"], GLOBAL_STATE["modTask"]]
+        reload_modules(*listMod)
+        MODULE_LOCK.acquire_shared()
+        try:
+            dictTask = get_task_dict()
+            if self.sTask not in dictTask:
+                raise ValueError("No such task: %s" % self.sTask)
+            task = dictTask[self.sTask]
+            sKey = resultcache.task_key(
+                self.sTask, task, [SOURCE_HASH[mod.__name__]
+                                   for mod in listMod])
+            cachedTask = resultcache.CachedTask(GLOBAL_STATE["resultCache"],
+                                                sKey, task, self.fRefresh)
+            return cachedTask.run(fxnProgress)
+        finally:
+            MODULE_LOCK.release_shared()
+
 def serve_task(req, sTask):
-    reload(GLOBAL_STATE["modWork"])
-    dictTask = get_task_dict()
-    if sTask not in dictTask:
-        raise ValueError("No such task: %s" % sTask)
-    return json.dumps(dictTask[sTask].run())
+    fRefresh = get_post_data(req).get("refresh") == "1"
+    sJob = GLOBAL_STATE["taskPool"].submit(sTask, QueuedTask(sTask, fRefresh))
+    return send_json(req, {"job": sJob})
+
+def serve_job(req, sJob):
+    return send_json(req, GLOBAL_STATE["taskPool"].poll(sJob))
+
+def serve_job_events(req, sJob):
+    """Stream the progress of a job to the browser as server-sent events,
+    ending with a "done" event holding what serve_job would return."""
+    iterEvents = GLOBAL_STATE["taskPool"].events(sJob)
+    req.send_response(200)
+    req.send_header("Content-Type", "text/event-stream")
+    req.send_header("Cache-Control", "no-cache")
+    req.end_headers()
+    for sEvent,dictData in iterEvents:
+        req.wfile.write("event: %s\ndata: " % sEvent)
+        for sChunk in jsonbackend.iterencode(dictData, json):
+            req.wfile.write(sChunk)
+        req.wfile.write("\n\n")
+        req.wfile.flush()
+    return ""
 
 def serve_updates(req, sUpdateTask):
     if sUpdateTask == "check":
         cmt = updatemanager.check_for_updates()
-        return json.dumps(cmt and cmt.to_json())
+        return send_json(req, cmt and cmt.to_json())
     elif sUpdateTask == "install":
-        return json.dumps({"success": updatemanager.deploy_updates()})
+        return send_json(req, {"success": updatemanager.deploy_updates()})
     return None
 
 class TaskRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
@@ -150,7 +478,6 @@ class TaskRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                         self.wfile.write(sOut)
                         return
             except Exception:
-                import traceback
                 self.send_error(500)
                 sTb = traceback.format_exc()
                 print sTb
@@ -162,7 +489,9 @@ class TaskRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         self.do_safe_request([
             (serve_static,STATIC_RE),
             (serve_test,TEST_RE),
-            (serve_metadata,METADATA_RE)])
+            (serve_metadata,METADATA_RE),
+            (serve_job,JOB_RE),
+            (serve_job_events,JOB_EVENTS_RE)])
     def do_POST(self):
         self.do_safe_request([(serve_test,TEST_RE), (serve_task,TASK_RE),
                               (serve_updates, UPDATES_RE)])
@@ -170,6 +499,11 @@ class TaskRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         if self.path in dictAlias:
             self.path = dictAlias[self.path]
 
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+    """An HTTPServer handling each request on its own thread."""
+    daemon_threads = True
+
 def fork_httpd(httpd):
     tr = threading.Thread(target=httpd.serve_forever)
     tr.setDaemon(True)
@@ -177,17 +511,29 @@ def fork_httpd(httpd):
     tr.start()
     return tr
 
-def spawn(sDir, iPort, sStaticDirPath, sSelector, dblDelayMs=500):
+def spawn(sDir, iPort, sStaticDirPath, sSelector, dblDelayMs=500,
+          cTaskWorkers=DEFAULT_TASK_WORKERS,
+          cCacheBytes=resultcache.DEFAULT_MAX_BYTES):
     eventlog.init()
     dictConfig = loadconfig.load_config_file(sDir)
     GLOBAL_STATE["modTask"] = load_module(dictConfig["taskmodule"])
     GLOBAL_STATE["modTest"] = load_module(dictConfig["testmodule"])
     GLOBAL_STATE["modWork"] = load_module(dictConfig["workmodule"])
+    for sMod in ("modTask", "modTest", "modWork"):
+        mod = GLOBAL_STATE[sMod]
+        SOURCE_HASH[mod.__name__] = resultcache.module_hash(mod)
     GLOBAL_STATE["sStatic"] = sStaticDirPath
     GLOBAL_STATE["dictConfig"] = dictConfig
-    httpd = BaseHTTPServer.HTTPServer(("localhost",iPort),TaskRequestHandler)
+    GLOBAL_STATE["taskPool"] = TaskPool(cTaskWorkers)
+    GLOBAL_STATE["resultCache"] = resultcache.ResultCache(
+        path.join(sDir, resultcache.CACHE_DIRNAME), cCacheBytes)
+    httpd = ThreadingHTTPServer(("localhost",iPort),TaskRequestHandler)
     tr = fork_httpd(httpd)
     sUrl = ("http://localhost:%d/" % iPort) + sSelector.lstrip("/")
+    print "JSON backend:", jsonbackend.describe()
+    sWarning = jsonbackend.speedups_warning()
+    if sWarning is not None:
+        print >>sys.stderr, "Warning:", sWarning
     print sUrl
     webbrowser.open(sUrl)
     try:
@@ -210,8 +556,19 @@ def main(argv):
     parser.add_option("-l", "--selector", action="store", dest="selector",
                       type=str, help="HTTP URL selector for browser window",
                       default="")
+    parser.add_option("-w", "--task-workers", action="store",
+                      dest="task_workers", type=int,
+                      help="number of tasks to run at once",
+                      default=DEFAULT_TASK_WORKERS)
+    parser.add_option("-c", "--cache-mb", action="store", dest="cache_mb",
+                      type=float, help="size of the task result cache in MB",
+                      default=resultcache.DEFAULT_MAX_BYTES/(1024.0*1024.0))
     opts,args = parser.parse_args(argv)
-    spawn(opts.dir, opts.port, opts.staticdir, opts.selector)
+    if opts.task_workers < 1:
+        parser.error("--task-workers must be at least 1")
+    spawn(opts.dir, opts.port, opts.staticdir, opts.selector,
+          cTaskWorkers=opts.task_workers,
+          cCacheBytes=int(opts.cache_mb*1024*1024))
     return 0
 
 if __name__ == "__main__":
@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+
+"""
+setup_speedups.py -- build the C speedups of the bundled simplejson next to
+its sources, where simplejson and jsonbackend look for them:
+
+    python setup_speedups.py build_ext --inplace
+"""
+
+from distutils.core import setup, Extension
+import os
+from os import path
+import sys
+
+def main(argv):
+    os.chdir(path.dirname(path.abspath(__file__)))
+    setup(name="simplejson_speedups",
+          ext_modules=[Extension("simplejson._speedups",
+                                 ["simplejson/_speedups.c"])],
+          script_args=argv[1:] or ["build_ext", "--inplace"])
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -42,10 +42,13 @@ typedef int Py_ssize_t;
 #define PyEncoder_Check(op) PyObject_TypeCheck(op, &PyEncoderType)
 #define PyEncoder_CheckExact(op) (Py_TYPE(op) == &PyEncoderType)
 #define Decimal_Check(op) (PyObject_TypeCheck(op, DecimalTypePtr))
+#define Array_Check(op) (PyObject_TypeCheck(op, ArrayTypePtr))
 
 static PyTypeObject PyScannerType;
 static PyTypeObject PyEncoderType;
 static PyTypeObject *DecimalTypePtr;
+static PyTypeObject *ArrayTypePtr;
+static char *DecoderModuleName;
 
 typedef struct _PyScannerObject {
     PyObject_HEAD
@@ -133,6 +136,8 @@ encoder_clear(PyObject *self);
 static int
 encoder_listencode_list(PyEncoderObject *s, PyObject *rval, PyObject *seq, Py_ssize_t indent_level);
 static int
+encoder_listencode_numbers(PyEncoderObject *s, PyObject *rval, PyObject *seq);
+static int
 encoder_listencode_obj(PyEncoderObject *s, PyObject *rval, PyObject *obj, Py_ssize_t indent_level);
 static int
 encoder_listencode_dict(PyEncoderObject *s, PyObject *rval, PyObject *dct, Py_ssize_t indent_level);
@@ -367,7 +372,7 @@ raise_errmsg(char *msg, PyObject *s, Py_ssize_t end)
     static PyObject *JSONDecodeError = NULL;
     PyObject *exc;
     if (JSONDecodeError == NULL) {
-        PyObject *decoder = PyImport_ImportModule("simplejson.decoder");
+        PyObject *decoder = PyImport_ImportModule(DecoderModuleName);
         if (decoder == NULL)
             return;
         JSONDecodeError = PyObject_GetAttrString(decoder, "JSONDecodeError");
@@ -2122,7 +2127,7 @@ encoder_listencode_obj(PyEncoderObject *s, PyObject *rval, PyObject *obj, Py_ssi
             return -1;
         return _steal_list_append(rval, encoded);
     }
-    else if (PyList_Check(obj) || PyTuple_Check(obj)) {
+    else if (PyList_Check(obj) || PyTuple_Check(obj) || Array_Check(obj)) {
         return encoder_listencode_list(s, rval, obj, indent_level);
     }
     else if (PyDict_Check(obj)) {
@@ -2375,6 +2380,115 @@ bail:
 }
 
 
+static int
+_buffer_append(PyObject **buf, Py_ssize_t *len, const char *data, Py_ssize_t size)
+{
+    /* Append size bytes of data at offset *len of the str *buf, growing it
+       as needed */
+    Py_ssize_t cap = PyString_GET_SIZE(*buf);
+    if (*len + size > cap) {
+        cap *= 2;
+        if (cap < *len + size)
+            cap = *len + size;
+        if (_PyString_Resize(buf, cap))
+            return -1;
+    }
+    memcpy(PyString_AS_STRING(*buf) + *len, data, size);
+    *len += size;
+    return 0;
+}
+
+static int
+encoder_listencode_numbers(PyEncoderObject *s, PyObject *rval, PyObject *seq)
+{
+    /* Encode seq to a single JSON array chunk if it holds only ints, longs
+       and floats, rval is a PyList. Return 1, leaving rval alone, if seq
+       holds anything else. */
+    PyObject *fast;
+    PyObject **items;
+    PyObject *buf = NULL;
+    Py_ssize_t i, n, len = 0;
+    char intbuf[32];
+
+    if (!PyString_CheckExact(s->item_separator))
+        return 1;
+    fast = PySequence_Fast(seq, "expected a sequence");
+    if (fast == NULL)
+        return -1;
+    n = PySequence_Fast_GET_SIZE(fast);
+    items = PySequence_Fast_ITEMS(fast);
+    for (i = 0; i < n; i++) {
+        PyObject *obj = items[i];
+        if (!PyFloat_CheckExact(obj) && !PyInt_CheckExact(obj) &&
+                !PyLong_CheckExact(obj)) {
+            Py_DECREF(fast);
+            return 1;
+        }
+    }
+
+    buf = PyString_FromStringAndSize(NULL, 2 + n * 8);
+    if (buf == NULL)
+        goto bail;
+    if (_buffer_append(&buf, &len, "[", 1))
+        goto bail;
+    for (i = 0; i < n; i++) {
+        PyObject *obj = items[i];
+        if (i) {
+            if (_buffer_append(&buf, &len,
+                    PyString_AS_STRING(s->item_separator),
+                    PyString_GET_SIZE(s->item_separator)))
+                goto bail;
+        }
+        if (PyInt_CheckExact(obj)) {
+            int size = PyOS_snprintf(intbuf, sizeof(intbuf), "%ld",
+                PyInt_AS_LONG(obj));
+            if (_buffer_append(&buf, &len, intbuf, size))
+                goto bail;
+        }
+#if PY_VERSION_HEX >= 0x02070000
+        else if (PyFloat_CheckExact(obj) &&
+                Py_IS_FINITE(PyFloat_AS_DOUBLE(obj))) {
+            /* Same as repr(obj), without the intermediate str */
+            int rv;
+            char *repr = PyOS_double_to_string(PyFloat_AS_DOUBLE(obj), 'r',
+                0, Py_DTSF_ADD_DOT_0, NULL);
+            if (repr == NULL)
+                goto bail;
+            rv = _buffer_append(&buf, &len, repr, strlen(repr));
+            PyMem_Free(repr);
+            if (rv)
+                goto bail;
+        }
+#endif
+        else {
+            PyObject *encoded;
+            int rv;
+            if (PyFloat_CheckExact(obj))
+                encoded = encoder_encode_float(s, obj);
+            else
+                encoded = PyObject_Str(obj);
+            if (encoded == NULL)
+                goto bail;
+            rv = _buffer_append(&buf, &len, PyString_AS_STRING(encoded),
+                PyString_GET_SIZE(encoded));
+            Py_DECREF(encoded);
+            if (rv)
+                goto bail;
+        }
+    }
+    if (_buffer_append(&buf, &len, "]", 1))
+        goto bail;
+    Py_DECREF(fast);
+    if (_PyString_Resize(&buf, len))
+        return -1;
+    return _steal_list_append(rval, buf);
+
+bail:
+    Py_XDECREF(buf);
+    Py_DECREF(fast);
+    return -1;
+}
+
 static int
 encoder_listencode_list(PyEncoderObject *s, PyObject *rval, PyObject *seq, Py_ssize_t indent_level)
 {
@@ -2402,6 +2516,10 @@ encoder_listencode_list(PyEncoderObject *s, PyObject *rval, PyObject *seq, Py_ss
     else if (is_true == 0)
         return PyList_Append(rval, empty_array);
 
+    is_true = encoder_listencode_numbers(s, rval, seq);
+    if (is_true != 1)
+        return is_true;
+
     if (s->markers != Py_None) {
         int has_key;
         ident = PyLong_FromVoidPtr(seq);
@@ -2578,7 +2696,9 @@ PyDoc_STRVAR(module_doc,
 void
 init_speedups(void)
 {
-    PyObject *m, *decimal;
+    PyObject *m, *decimal, *array;
+    const char *name, *dot;
+    Py_ssize_t prefix_len;
     PyScannerType.tp_new = PyType_GenericNew;
     if (PyType_Ready(&PyScannerType) < 0)
         return;
@@ -2594,7 +2714,32 @@ init_speedups(void)
     if (DecimalTypePtr == NULL)
         return;
 
+    array = PyImport_ImportModule("array");
+    if (array == NULL)
+        return;
+    ArrayTypePtr = (PyTypeObject*)PyObject_GetAttrString(array, "array");
+    Py_DECREF(array);
+    if (ArrayTypePtr == NULL)
+        return;
+
     m = Py_InitModule3("_speedups", speedups_methods, module_doc);
+    if (m == NULL)
+        return;
+    /* The decoder module is a sibling of this one, which is
+       simplejson._speedups or, when simplejson is bundled in another
+       package, <package>.simplejson._speedups */
+    name = PyModule_GetName(m);
+    if (name == NULL)
+        return;
+    dot = strrchr(name, '.');
+    prefix_len = dot == NULL ? 0 : dot - name + 1;
+    DecoderModuleName = PyMem_Malloc(prefix_len + sizeof("decoder"));
+    if (DecoderModuleName == NULL) {
+        PyErr_NoMemory();
+        return;
+    }
+    memcpy(DecoderModuleName, name, prefix_len);
+    strcpy(DecoderModuleName + prefix_len, "decoder");
     Py_INCREF((PyObject*)&PyScannerType);
     PyModule_AddObject(m, "make_scanner", (PyObject*)&PyScannerType);
     Py_INCREF((PyObject*)&PyEncoderType);
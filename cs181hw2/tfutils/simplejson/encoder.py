@@ -1,17 +1,18 @@
 """Implementation of JSONEncoder
 """
 import re
+from array import array as Array
 from decimal import Decimal
 
 def _import_speedups():
     try:
-        from simplejson import _speedups
+        import _speedups
         return _speedups.encode_basestring_ascii, _speedups.make_encoder
     except ImportError:
         return None, None
 c_encode_basestring_ascii, c_make_encoder = _import_speedups()
 
-from simplejson.decoder import PosInf
+from decoder import PosInf
 
 ESCAPE = re.compile(r'[\x00-\x1f\\"\b\f\n\r\t]')
 ESCAPE_ASCII = re.compile(r'([\\"]|[^\ -~])')
@@ -30,6 +31,9 @@ for i in range(0x20):
     ESCAPE_DCT.setdefault(chr(i), '\\u%04x' % (i,))
 
 FLOAT_REPR = repr
+NUMBER_TYPES = frozenset([int, long, float])
+FLOAT_TYPECODES = 'fd'
+CHAR_TYPECODES = 'cu'
 
 def encode_basestring(s):
     """Return a JSON representation of a Python string
@@ -319,6 +323,7 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr,
         True=True,
         ValueError=ValueError,
         basestring=basestring,
+        Array=Array,
         Decimal=Decimal,
         dict=dict,
         float=float,
@@ -327,14 +332,59 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr,
         isinstance=isinstance,
         list=list,
         long=long,
+        map=map,
+        set=set,
         str=str,
+        sum=sum,
         tuple=tuple,
+        type=type,
+        _number_types=NUMBER_TYPES,
+        _float_repr=FLOAT_REPR,
+        _inf=PosInf,
     ):
 
+    def _encode_numbers(seq, separator):
+        # Encode a sequence holding only ints, longs and floats in one
+        # go, letting map and join do the per-item work; return None if
+        # seq holds anything else.
+        if isinstance(seq, Array):
+            if seq.typecode in CHAR_TYPECODES:
+                return None
+            if seq.typecode not in FLOAT_TYPECODES:
+                return separator.join(map(str, seq))
+            types = (float,)
+        else:
+            types = set(map(type, seq))
+            if not types <= _number_types:
+                return None
+            if float not in types:
+                return separator.join(map(str, seq))
+        if len(types) == 1:
+            # NaN and infinities make the sum NaN or infinite, and need
+            # _floatstr; anything finite encodes as its repr.
+            total = sum(seq)
+            if total == total and total != _inf and total != -_inf:
+                return separator.join(map(_float_repr, seq))
+            return separator.join(map(_floatstr, seq))
+        return separator.join([_floatstr(value) if type(value) is float
+                               else str(value) for value in seq])
+
     def _iterencode_list(lst, _current_indent_level):
         if not lst:
             yield '[]'
             return
+        if _indent is not None:
+            newline_indent = '\n' + (_indent * (_current_indent_level + 1))
+            numbers = _encode_numbers(lst, _item_separator + newline_indent)
+            if numbers is not None:
+                yield ('[' + newline_indent + numbers + '\n' +
+                       (_indent * _current_indent_level) + ']')
+                return
+        else:
+            numbers = _encode_numbers(lst, _item_separator)
+            if numbers is not None:
+                yield '[' + numbers + ']'
+                return
         if markers is not None:
             markerid = id(lst)
             if markerid in markers:
@@ -371,7 +421,7 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr,
                 yield buf + str(value)
             else:
                 yield buf
-                if isinstance(value, (list, tuple)):
+                if isinstance(value, (list, tuple, Array)):
                     chunks = _iterencode_list(value, _current_indent_level)
                 elif isinstance(value, dict):
                     chunks = _iterencode_dict(value, _current_indent_level)
@@ -450,7 +500,7 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr,
             elif _use_decimal and isinstance(value, Decimal):
                 yield str(value)
             else:
-                if isinstance(value, (list, tuple)):
+                if isinstance(value, (list, tuple, Array)):
                     chunks = _iterencode_list(value, _current_indent_level)
                 elif isinstance(value, dict):
                     chunks = _iterencode_dict(value, _current_indent_level)
@@ -478,7 +528,7 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr,
             yield str(o)
         elif isinstance(o, float):
             yield _floatstr(o)
-        elif isinstance(o, (list, tuple)):
+        elif isinstance(o, (list, tuple, Array)):
             for chunk in _iterencode_list(o, _current_indent_level):
                 yield chunk
         elif isinstance(o, dict):
@@ -0,0 +1,58 @@
+from array import array
+from unittest import TestCase
+
+import simplejson as json
+
+
+class TestNumbers(TestCase):
+    def test_float_list(self):
+        lst = [0.1, -2.5, 1e20, 1e-300, 3.0]
+        self.assertEquals(json.dumps(lst),
+            '[' + ', '.join(map(repr, lst)) + ']')
+        self.assertEquals(json.dumps(tuple(lst), separators=(',', ':')),
+            '[' + ','.join(map(repr, lst)) + ']')
+        self.assertEquals(json.loads(json.dumps(lst)), lst)
+
+    def test_int_list(self):
+        lst = [0, -1, 1L, 1 << 32, 1 << 64, -(1 << 70)]
+        self.assertEquals(json.dumps(lst),
+            '[' + ', '.join(map(str, lst)) + ']')
+
+    def test_mixed_numbers(self):
+        self.assertEquals(json.dumps([1, 2.5, 3L, -0.0]),
+            '[1, 2.5, 3, -0.0]')
+        self.assertEquals(json.dumps([[1, 2.0], [3.5, 4]]),
+            '[[1, 2.0], [3.5, 4]]')
+
+    def test_non_numbers(self):
+        self.assertEquals(json.dumps([1, True, 2.5]), '[1, true, 2.5]')
+        self.assertEquals(json.dumps([1.5, None]), '[1.5, null]')
+        self.assertEquals(json.dumps([1, "2"]), '[1, "2"]')
+
+    def test_special_floats(self):
+        inf = float('inf')
+        self.assertEquals(json.dumps([1.5, inf, -inf]),
+            '[1.5, Infinity, -Infinity]')
+        self.assertEquals(json.dumps([inf, -inf]), '[Infinity, -Infinity]')
+        self.assertEquals(json.dumps([0.5, inf - inf]), '[0.5, NaN]')
+        self.assertEquals(json.dumps([1e308, 1e308]), '[1e+308, 1e+308]')
+        self.assertRaises(ValueError, json.dumps, [1.5, inf],
+            allow_nan=False)
+        self.assertRaises(ValueError, json.dumps, [1, inf - inf],
+            allow_nan=False)
+
+    def test_indent(self):
+        self.assertEquals(json.dumps({'a': [1.5, 2]}, indent=2),
+            '{\n  "a": [\n    1.5, \n    2\n  ]\n}')
+
+    def test_array(self):
+        self.assertEquals(json.dumps(array('d', [0.5, -1e20])),
+            '[0.5, -1e+20]')
+        self.assertEquals(json.dumps(array('f', [0.1])),
+            json.dumps([array('f', [0.1])[0]]))
+        self.assertEquals(json.dumps({'a': array('i', [1, -2])}),
+            '{"a": [1, -2]}')
+        self.assertEquals(json.dumps([array('L', [2 ** 32])]),
+            '[[4294967296]]')
+        self.assertEquals(json.dumps(array('i')), '[]')
+        self.assertEquals(json.dumps(array('c', 'ab')), '["a", "b"]')
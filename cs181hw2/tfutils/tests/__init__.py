@@ -0,0 +1,23 @@
+import unittest
+
+
+def all_tests_suite():
+    return unittest.TestLoader().loadTestsFromNames([
+        'tfutils.tests.test_eventlog',
+        'tfutils.tests.test_resultcache',
+        'tfutils.tests.test_serveui',
+    ])
+
+
+def main():
+    runner = unittest.TextTestRunner()
+    suite = all_tests_suite()
+    result = runner.run(suite)
+    return not result.wasSuccessful()
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    sys.exit(main())
@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+
+"""
+benchnn.py -- benchmarks for the hot paths in nn.py.
+
+Each benchmark calls one operation many times, in batches, and reports its
+throughput, the 50th/90th/99th percentile latency of a call and the peak
+resident memory of the process that ran it. Results can be saved as JSON
+and compared against the results of an earlier run.
+"""
+
+try:
+    import json
+except ImportError:
+    from tfutils import simplejson as json
+import multiprocessing
+import optparse
+import os
+import random
+import StringIO
+import subprocess
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from tfutils import jsonbackend
+from tfutils import simplejson
+import nn
+import tasknn
+
+SHAPES = ("16,16,26", "16,30,26", "120,30,10")
+ENGINES = ("list", "matrix")
+JSON_BACKENDS = ("speedups", "python", "stdlib")
+DATA_FILE = "lettertraining-16k.txt"
+VALIDATION_FILE = "lettervalidation-2k.txt"
+EPOCH_INSTANCES = 2000
+
+def random_instances(cInputs, cLabels, cInstances):
+    """Build cInstances instances with uniformly random features and
+    labels."""
+    return [nn.Instance(random.randint(0, cLabels - 1),
+                        [random.random() for _ in xrange(cInputs)])
+            for _ in xrange(cInstances)]
+
+def init_engine_net(listCLayerSize, sEngine):
+    if sEngine == "matrix":
+        return nn.init_matrix_net(listCLayerSize)
+    return nn.init_net(listCLayerSize)
+
+def cycle_calls(fxn, listTplArgs):
+    """Returns a function of no arguments that calls fxn on the next tuple
+    of arguments from listTplArgs each time it is called."""
+    listState = [0]
+    cArgs = len(listTplArgs)
+    def call():
+        ix = listState[0]
+        listState[0] = (ix + 1) % cArgs
+        return fxn(*listTplArgs[ix])
+    return call
+
+def sigmoid_max_error(backend):
+    """Returns the largest difference between backend and the exact sigmoid
+    over a fine grid of inputs from -40 to 40."""
+    listDblX = [ix/1000.0 - 40.0 for ix in xrange(80001)]
+    return max(abs(dblY - nn.sigmoid(dblX)) for dblX,dblY
+               in zip(listDblX, backend.vector(listDblX)))
+
+def build_sigmoid(listCLayerSize, sBackend, opts):
+    listTplArgs = [(random.uniform(-5.0, 5.0),) for _ in xrange(1000)]
+    return cycle_calls(nn.make_sigmoid(sBackend, opts.sigmoid_error),
+                       listTplArgs)
+
+def build_sigmoid_vector(listCLayerSize, sBackend, opts):
+    backend = nn.make_sigmoid(sBackend, opts.sigmoid_error)
+    listDblX = [random.uniform(-5.0, 5.0) for _ in xrange(1000)]
+    fxnRun = lambda: backend.vector(listDblX)
+    return fxnRun,lambda: {"max_error": sigmoid_max_error(backend)}
+
+def build_dot(listCLayerSize, sEngine, opts):
+    cInputs = listCLayerSize[0]
+    listTplArgs = [([random.random() for _ in xrange(cInputs)],
+                    [random.random() for _ in xrange(cInputs)])
+                   for _ in xrange(100)]
+    return cycle_calls(nn.dot, listTplArgs)
+
+def build_feed_forward_layer(listCLayerSize, sEngine, opts):
+    net = init_engine_net(listCLayerSize, sEngine)
+    fxn = nn.feed_forward_layer
+    if sEngine == "matrix":
+        fxn = nn.matrix_feed_forward_layer
+    listTplArgs = [(net.input_layer(), inst.listDblFeatures) for inst
+                   in random_instances(listCLayerSize[0], 1, 100)]
+    return cycle_calls(fxn, listTplArgs)
+
+def build_feed_forward(listCLayerSize, sEngine, opts):
+    net = init_engine_net(listCLayerSize, sEngine)
+    listTplArgs = [(net, inst.listDblFeatures) for inst
+                   in random_instances(listCLayerSize[0], 1, 100)]
+    return cycle_calls(nn.feed_forward, listTplArgs)
+
+def build_predict_batch(listCLayerSize, sEngine, opts):
+    net = init_engine_net(listCLayerSize, sEngine)
+    listListDblFeatures = [inst.listDblFeatures for inst
+                           in random_instances(listCLayerSize[0], 1,
+                                               nn.PREDICT_CHUNK_SIZE)]
+    return lambda: nn.predict_batch(net, listListDblFeatures)
+
+def build_update_net(listCLayerSize, sEngine, opts):
+    net = init_engine_net(listCLayerSize, sEngine)
+    cLabels = listCLayerSize[-1]
+    listTplArgs = []
+    for inst in random_instances(listCLayerSize[0], cLabels, 1000):
+        listDblTarget = [0.05]*cLabels
+        listDblTarget[inst.iLabel] = 0.95
+        listTplArgs.append((net, inst, 0.5, listDblTarget))
+    return cycle_calls(nn.update_net, listTplArgs)
+
+def build_load_data(listCLayerSize, sEngine, opts):
+    fUseCache = (sEngine == "cache")
+    if fUseCache:
+        nn.load_data(opts.data_file)
+    return lambda: nn.load_data(opts.data_file, fUseCache=fUseCache)
+
+def build_distributed_encode_label(listCLayerSize, sEngine, opts):
+    cLabels = nn.LABEL_COUNT
+    listTplArgs = [(random.randint(0, cLabels - 1),) for _ in xrange(1000)]
+    return cycle_calls(nn.distributed_encode_label, listTplArgs)
+
+def build_distributed_decode_net_output(listCLayerSize, sEngine, opts):
+    cLabels = nn.LABEL_COUNT
+    listTplArgs = [([random.random() for _ in xrange(cLabels)],)
+                   for _ in xrange(1000)]
+    return cycle_calls(nn.distributed_decode_net_output, listTplArgs)
+
+def json_dumps(sBackend):
+    """Returns the dumps function of the JSON backend sBackend: the bundled
+    simplejson with or without its C speedups, or the standard library's
+    json."""
+    if sBackend == "stdlib":
+        if jsonbackend.stdlib_json is None:
+            raise ValueError("the standard library has no json module")
+        return jsonbackend.stdlib_json.dumps
+    simplejson._toggle_speedups(sBackend == "speedups")
+    if sBackend == "speedups" and not jsonbackend.speedups_enabled():
+        raise ValueError("the simplejson speedups are not built")
+    return simplejson.dumps
+
+def build_json_graph(listCLayerSize, sBackend, opts):
+    """Encode the edge list a GraphTask serves for a network of shape
+    listCLayerSize."""
+    fxnDumps = json_dumps(sBackend)
+    listEdge = tasknn.serialize_net(nn.init_net(listCLayerSize))
+    return lambda: fxnDumps({"data": listEdge})
+
+def build_json_charts(listCLayerSize, sBackend, opts):
+    """Encode the charts a ChartTask serves: the sigmoid curve and the
+    accuracies of three data sets over 100 rounds."""
+    fxnDumps = json_dumps(sBackend)
+    listListDblResult = [[random.random() for _ in xrange(100)]
+                         for _ in xrange(3)]
+    listDictChart = [tasknn.SigmoidTask().task(),
+                     tasknn.performance_graph(listListDblResult, "Accuracy")]
+    return lambda: fxnDumps({"data": listDictChart})
+
+def check_data_shape(listCLayerSize, sFilename):
+    """Raise ValueError unless the instances in sFilename have one feature
+    per input of the network shape listCLayerSize."""
+    listInst = nn.load_data(sFilename, 1)
+    if len(listInst[0].listDblFeatures) != listCLayerSize[0]:
+        raise ValueError("%s has %d features, not %d."
+                         % (sFilename, len(listInst[0].listDblFeatures),
+                            listCLayerSize[0]))
+
+def build_train_sigmoid(listCLayerSize, sBackend, opts):
+    """Train a MatrixNet computing the sigmoid with sBackend for one round
+    per call on the first opts.epoch_instances instances of the data file,
+    and report its accuracy on the validation file."""
+    check_data_shape(listCLayerSize, opts.data_file)
+    check_data_shape(listCLayerSize, opts.validation_file)
+    listInstTrain = nn.load_data(opts.data_file, opts.epoch_instances)
+    listInstVal = nn.load_data(opts.validation_file)
+    net = nn.init_matrix_net(listCLayerSize)
+    net.sigmoid = nn.make_sigmoid(sBackend, opts.sigmoid_error)
+    fxnRun = lambda: nn.train_round(net, listInstTrain, 1.0)
+    def report():
+        return {"accuracy": (nn.num_correct(net, listInstVal)
+                             /float(len(listInstVal))),
+                "max_error": sigmoid_max_error(net.sigmoid)}
+    return fxnRun,report
+
+def build_experiment_epoch(listCLayerSize, sEngine, opts):
+    if len(listCLayerSize) != 3:
+        raise ValueError("An epoch benchmark needs one hidden layer.")
+    listSArgv = ["nn.py", "--train", opts.data_file,
+                 "--validation", opts.data_file, "--test", opts.data_file,
+                 "--max-instances", str(opts.epoch_instances),
+                 "--num_inputs", str(listCLayerSize[0]),
+                 "--hidden", str(listCLayerSize[1]), "--rounds", "1",
+                 "--engine", sEngine]
+    check_data_shape(listCLayerSize, opts.data_file)
+    def run_epoch():
+        fileOldStdout = sys.stdout
+        fileOldStderr = sys.stderr
+        sys.stdout = StringIO.StringIO()
+        sys.stderr = StringIO.StringIO()
+        try:
+            nn.main(listSArgv)
+        finally:
+            sys.stdout = fileOldStdout
+            sys.stderr = fileOldStderr
+    return run_epoch
+
+# name, builder, whether the benchmark depends on the network shape,
+# variants, number of calls, calls per latency sample. A builder returns
+# the function to call, or that function and one returning a dict of
+# further results to report once the calls are done.
+BENCHMARKS = (
+    ("sigmoid", build_sigmoid, False, nn.SIGMOID_BACKENDS, 200000, 1000),
+    ("sigmoid_vector", build_sigmoid_vector, False, nn.SIGMOID_BACKENDS,
+     500, 5),
+    ("dot", build_dot, True, (None,), 50000, 100),
+    ("feed_forward_layer", build_feed_forward_layer, True, ENGINES,
+     10000, 20),
+    ("feed_forward", build_feed_forward, True, ENGINES, 5000, 10),
+    ("predict_batch", build_predict_batch, True, ENGINES, 20, 1),
+    ("update_net", build_update_net, True, ENGINES, 2000, 10),
+    ("load_data", build_load_data, False, ("parse", "cache"), 3, 1),
+    ("distributed_encode_label", build_distributed_encode_label, False,
+     (None,), 200000, 1000),
+    ("distributed_decode_net_output", build_distributed_decode_net_output,
+     False, (None,), 100000, 1000),
+    ("experiment_epoch", build_experiment_epoch, True, ENGINES, 1, 1),
+    ("train_sigmoid", build_train_sigmoid, True, nn.SIGMOID_BACKENDS, 3, 1),
+    ("json_graph", build_json_graph, True, JSON_BACKENDS, 100, 5),
+    ("json_charts", build_json_charts, False, JSON_BACKENDS, 2000, 20),
+    )
+
+def percentile(listDbl, dblFraction):
+    """Returns the dblFraction quantile of listDbl, by nearest rank.
+
+    >>> percentile([4.0, 1.0, 3.0, 2.0], 0.5)
+    3.0"""
+    listDblSorted = sorted(listDbl)
+    ix = int(round(dblFraction*(len(listDblSorted) - 1)))
+    return listDblSorted[min(ix, len(listDblSorted) - 1)]
+
+def peak_memory_kb():
+    """Returns the peak resident set size of this process in kilobytes, or
+    None where the resource module is not available."""
+    if resource is None:
+        return None
+    iMaxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        iMaxRss //= 1024
+    return iMaxRss
+
+def measure(fxnRun, cCalls, cBatch):
+    """Call fxnRun cCalls times, timing each batch of cBatch calls, and
+    return the throughput and latency percentiles in a dict."""
+    cCalls = max(cCalls, cBatch)
+    listDblLatency = []
+    dblTotal = 0.0
+    for _ in xrange(cCalls // cBatch):
+        dblStart = time.time()
+        for _ in xrange(cBatch):
+            fxnRun()
+        dblElapsed = time.time() - dblStart
+        dblTotal += dblElapsed
+        listDblLatency.append(dblElapsed/cBatch)
+    return {"calls": len(listDblLatency)*cBatch,
+            "seconds": dblTotal,
+            "throughput": len(listDblLatency)*cBatch/max(dblTotal, 1e-9),
+            "latency_p50": percentile(listDblLatency, 0.5),
+            "latency_p90": percentile(listDblLatency, 0.9),
+            "latency_p99": percentile(listDblLatency, 0.99)}
+
+def run_benchmark(tplBenchmark, sShape, sVariant, opts):
+    """Run one benchmark in this process and return its result dict."""
+    sName,fxnBuild,_,_,cCalls,cBatch = tplBenchmark
+    random.seed(opts.seed)
+    listCLayerSize = [int(s) for s in (sShape or SHAPES[0]).split(',')]
+    fxnRun = fxnBuild(listCLayerSize, sVariant, opts)
+    fxnReport = None
+    if isinstance(fxnRun, tuple):
+        fxnRun,fxnReport = fxnRun
+    dictResult = measure(fxnRun, int(cCalls*opts.scale) or 1, cBatch)
+    if fxnReport is not None:
+        dictResult.update(fxnReport())
+    dictResult.update({"name": sName, "shape": sShape, "variant": sVariant,
+                       "peak_memory_kb": peak_memory_kb()})
+    return dictResult
+
+def _run_child(queue, tplBenchmark, sShape, sVariant, opts):
+    try:
+        queue.put(run_benchmark(tplBenchmark, sShape, sVariant, opts))
+    except Exception:
+        import traceback
+        queue.put({"error": traceback.format_exc()})
+
+def run_isolated(tplBenchmark, sShape, sVariant, opts):
+    """Run one benchmark in a child process, so that its peak memory is
+    not that of the benchmarks before it."""
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_run_child,
+                                   args=(queue, tplBenchmark, sShape,
+                                         sVariant, opts))
+    proc.start()
+    dictResult = queue.get()
+    proc.join()
+    if "error" in dictResult:
+        raise RuntimeError(dictResult["error"])
+    return dictResult
+
+def result_key(dictResult):
+    return (dictResult["name"], dictResult["shape"], dictResult["variant"])
+
+def format_result(dictResult, dictBaseline=None):
+    sLabel = dictResult["name"]
+    if dictResult["variant"]:
+        sLabel += "[%s]" % dictResult["variant"]
+    sLine = "%-40s %-10s %12.1f/s  p50 %9.3gs  p99 %9.3gs  %8s KB" % (
+        sLabel, dictResult["shape"] or "", dictResult["throughput"],
+        dictResult["latency_p50"], dictResult["latency_p99"],
+        dictResult["peak_memory_kb"])
+    for sKey in ("accuracy", "max_error"):
+        if sKey in dictResult:
+            sLine += "  %s %.3g" % (sKey, dictResult[sKey])
+    if dictBaseline is not None:
+        sLine += "  %5.2fx" % (dictResult["throughput"]
+                               / dictBaseline["throughput"])
+    return sLine
+
+def git_revision():
+    """Returns the git commit of the working tree, or None."""
+    try:
+        proc = subprocess.Popen(["git", "rev-parse", "HEAD"],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        sOut,_ = proc.communicate()
+    except OSError:
+        return None
+    if proc.returncode != 0:
+        return None
+    return sOut.strip()
+
+def load_baseline(sFilename):
+    infile = open(sFilename)
+    try:
+        dictRun = json.load(infile)
+    finally:
+        infile.close()
+    return dict((result_key(dictResult), dictResult)
+                for dictResult in dictRun["results"])
+
+def main(argv):
+    parser = optparse.OptionParser()
+    parser.add_option("-s", "--shape", action="append", dest="shapes",
+                      default=None,
+                      help="comma-separated layer sizes to benchmark; may be "
+                      "given more than once (default: %s)" % " ".join(SHAPES))
+    parser.add_option("-b", "--benchmark", action="append",
+                      dest="benchmarks", default=None,
+                      help="name of a benchmark to run; may be given more "
+                      "than once (default: all)")
+    parser.add_option("-f", "--data-file", action="store", dest="data_file",
+                      default=DATA_FILE,
+                      help="data file for the load_data and epoch benchmarks")
+    parser.add_option("-v", "--validation-file", action="store",
+                      dest="validation_file", default=VALIDATION_FILE,
+                      help="data file train_sigmoid measures accuracy on")
+    parser.add_option("-e", "--epoch-instances", action="store",
+                      dest="epoch_instances", default=EPOCH_INSTANCES,
+                      type=int,
+                      help="instances to train and validate on per epoch")
+    parser.add_option("--sigmoid-error", action="store",
+                      dest="sigmoid_error", default=nn.SIGMOID_TABLE_ERROR,
+                      type=float,
+                      help="largest error of the lookup table sigmoid")
+    parser.add_option("--scale", action="store", dest="scale", default=1.0,
+                      type=float, help="multiply every number of calls by this")
+    parser.add_option("--seed", action="store", dest="seed", default=0,
+                      type=int, help="seed for the random number generator")
+    parser.add_option("--no-isolate", action="store_false", dest="isolate",
+                      default=True,
+                      help="run every benchmark in this process instead of "
+                      "one child process each")
+    parser.add_option("-o", "--output", action="store", dest="output",
+                      default=None, help="file to save the results to as JSON")
+    parser.add_option("-c", "--compare", action="store", dest="compare",
+                      default=None,
+                      help="JSON results of an earlier run to compare against")
+    opts,args = parser.parse_args(argv)
+    listSShape = opts.shapes or list(SHAPES)
+    dictBaseline = {}
+    if opts.compare:
+        dictBaseline = load_baseline(opts.compare)
+    fxnRun = run_benchmark
+    if opts.isolate:
+        fxnRun = run_isolated
+    listDictResult = []
+    for tplBenchmark in BENCHMARKS:
+        sName,_,fShaped,tplVariant,_,_ = tplBenchmark
+        if opts.benchmarks and sName not in opts.benchmarks:
+            continue
+        for sShape in (listSShape if fShaped else [None]):
+            for sVariant in tplVariant:
+                try:
+                    dictResult = fxnRun(tplBenchmark, sShape, sVariant, opts)
+                except (RuntimeError, ValueError), e:
+                    sys.stderr.write("Skipping %s %s %s: %s\n"
+                                     % (sName, sShape, sVariant,
+                                        str(e).strip().split("\n")[-1]))
+                    continue
+                listDictResult.append(dictResult)
+                print format_result(dictResult,
+                                    dictBaseline.get(result_key(dictResult)))
+    if opts.output:
+        dictRun = {"timestamp": time.time(), "revision": git_revision(),
+                   "python": sys.version.split()[0], "results": listDictResult}
+        outfile = open(opts.output, "w")
+        try:
+            json.dump(dictRun, outfile, indent=2, sort_keys=True)
+        finally:
+            outfile.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
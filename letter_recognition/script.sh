@@ -1,10 +1,9 @@
 #!/usr/bin/env bash
 
-for rate in {1..9}; do
-  for hidden in {1..30}; do
-    python nn.py --rounds=10 --learning_rate=.$rate --hidden=$hidden >> letterout.txt
-    echo -e "\n \n" >> letterout.txt
-  done
-done
+# Sweep 9 learning rates x 30 hidden layer sizes in parallel, one worker
+# process per core, writing one JSON line per trial and round.
+python nn.py sweep --rounds=10 \
+    --sweep-learning-rates=.1,.2,.3,.4,.5,.6,.7,.8,.9 \
+    --sweep-hidden=1-30 --sweep-output=letterout.jsonl
 
 exit 0
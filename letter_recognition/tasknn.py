@@ -53,22 +53,39 @@ def serialize_net(net):
 
 def evaluate_net(net,listInst,fxnDecode):
     cCorrect = 0
-    for inst in listInst:
-        iResult = fxnDecode(nn.feed_forward(net,inst.listDblFeatures))
-        cCorrect += int(iResult == inst.iLabel)
-    return float(cCorrect)/float(len(listInst))
+    cInst = 0
+    for listInstChunk in nn.instance_chunks(listInst):
+        _,listIResult = nn.predict_batch(
+            net, [inst.listDblFeatures for inst in listInstChunk], fxnDecode)
+        for inst,iResult in zip(listInstChunk, listIResult):
+            cCorrect += int(iResult == inst.iLabel)
+        cInst += len(listInstChunk)
+    return float(cCorrect)/float(cInst)
 
 def build_and_measure_net(net,listInstTrain,listInstTest,
                           fxnEncode,fxnDecode,dblLearningRate,
-                          cRounds):
-	for _ in xrange(cRounds):
-		for inst in listInstTrain:
-			listDblTarget = fxnEncode(inst.iLabel)
-			nn.update_net(net, inst, dblLearningRate, listDblTarget)
+                          cRounds,cBatchSize=1):
+    pipeline = nn.BatchPipeline(listInstTrain, cBatchSize,
+                                fxnEncode=fxnEncode)
+    for _ in xrange(cRounds):
+        for listInstBlock,listListDblTarget in pipeline:
+            nn.update_net_batch(net, listInstBlock, dblLearningRate,
+                                listListDblTarget)
         dblTestError = evaluate_net(net, listInstTest, fxnDecode)
         dblTrainingError = evaluate_net(net, listInstTrain, fxnDecode)
         yield dblTestError,dblTrainingError
 
+def measure_rounds(task, iterResults, cRounds, listSName):
+    """Collect the (test, training) accuracies build_and_measure_net
+    yields, reporting each round to task as progress on the chart series
+    named in listSName."""
+    listTplResult = []
+    for tplResult in iterResults:
+        listTplResult.append(tplResult)
+        task.report_progress(len(listTplResult), cRounds,
+                             dict(zip(listSName, tplResult)))
+    return listTplResult
+
 def data_filename(sFilename):
     return path.join(path.dirname(__file__), path.basename(sFilename))
 
@@ -196,13 +213,15 @@ class DigitWarmup(tftask.ChartTask):
                 " on this task.")
 	def get_priority(self):
 		return 3
+	def get_data_files(self):
+		return [data_filename(TRAINING_16K)]
 	def task(self):
 		listInst = load_training_16k(26)
 		net = nn.init_net([16,16,26])
-		listDblResult = list(build_and_measure_net(
+		listDblResult = measure_rounds(self, build_and_measure_net(
 		    net, listInst, listInst, nn.distributed_encode_label,
 		    nn.distributed_decode_net_output, self.LEARNING_RATE,
-		    self.ROUNDS))
+		    self.ROUNDS), self.ROUNDS, ["Accuracy"])
 		return performance_graph([[a for a,_ in listDblResult]],
 		    "Digit Recognition Training Accuracy")
 
@@ -220,13 +239,16 @@ class DigitClassificationDistributed(tftask.ChartTask):
                 " data provided in this assignment.")
     def get_priority(self):
         return 4
+    def get_data_files(self):
+        return [data_filename(TRAINING_16K), data_filename(TEST_2K)]
     def measure_performance(self, fxnEncode, fxnDecode):
         listInstTraining = load_training_16k(self.TRAINING_INSTANCES)
         listInstTest = load_test_2k(self.TEST_INSTANCES)
         net = nn.init_net(self.NETWORK_CONFIGURATION)
-        listDblResult = list(build_and_measure_net(
+        listDblResult = measure_rounds(self, build_and_measure_net(
             net,listInstTraining,listInstTest, fxnEncode, fxnDecode,
-            self.LEARNING_RATE, self.ROUNDS))
+            self.LEARNING_RATE, self.ROUNDS), self.ROUNDS,
+            ["Test Accuracy", "Training Accuracy"])
         listDblTest = [a for a,_ in listDblResult]
         listDblTrain = [b for _,b in listDblResult]
         sTitle = ("Digit Recognition Test Accuracy Trained on %d Instances"
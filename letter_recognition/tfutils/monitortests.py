@@ -4,13 +4,141 @@
 monitortests.py -- keep track of passing and failing tests
 """
 
+import hashlib
 import inspect
+import linecache
+import multiprocessing
+import Queue
+import types
 import unittest
-import StringIO
 import sys
 
 import eventlog
 import loadconfig
+import tftask
+
+# The fixture of a test worker process, under "fxt". Each worker loads
+# the test and work modules once, when it starts.
+WORKER_STATE = {}
+
+def default_processes():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+def test_worker(sTestModule, sWorkModule, queueName, queueResult):
+    """Run the tests named on queueName until it yields None, putting the
+    name and SingleTest.execute() result of each on queueResult."""
+    WORKER_STATE["fxt"] = load_tests(__import__(sTestModule),
+                                     __import__(sWorkModule))
+    for sName in iter(queueName.get, None):
+        queueResult.put((sName, WORKER_STATE["fxt"].get(sName).execute()))
+
+def iter_worker_results(listProcess, queueResult, cResults):
+    """Yield cResults results from queueResult, failing if every worker
+    process has died before sending them all."""
+    for _ in xrange(cResults):
+        while True:
+            try:
+                yield queueResult.get(timeout=1.0)
+                break
+            except Queue.Empty:
+                if not any(process.is_alive() for process in listProcess):
+                    raise RuntimeError("Test worker processes exited "
+                                       "before finishing their tests.")
+
+def code_names(code):
+    """Returns the global and attribute names code and the functions
+    nested in it refer to."""
+    setSName = set(code.co_names)
+    for o in code.co_consts:
+        if isinstance(o, types.CodeType):
+            setSName |= code_names(o)
+    return setSName
+
+def source_of(o):
+    try:
+        return inspect.getsource(o)
+    except (IOError, TypeError):
+        return repr(o)
+
+# Values hashed by their repr.
+SCALAR_TYPES = (bool, int, long, float, complex, basestring, types.NoneType)
+
+def sort_key(o):
+    """Returns a key that orders the keys of a dict or the members of a set
+    the same way in every process, even when they are functions."""
+    if isinstance(o, SCALAR_TYPES):
+        return (0, repr(o))
+    return (1, getattr(o, "__module__", ""), getattr(o, "__name__", ""),
+            type(o).__name__)
+
+def dependency_fingerprint(listRoot, listMod, listNamespace=()):
+    """Returns a hash of the source of the functions in listRoot and of
+    everything defined in the modules of listMod that they use, directly
+    or through each other: functions, classes, constants, and the
+    contents of lists, tuples, sets, dicts and instances of classes in
+    listMod, so that a function reached only through a dispatch table
+    counts too.
+
+    Dependencies are found by name, so the hash is conservative: a name
+    a function uses counts if any module in listMod, or any object in
+    listNamespace (such as a test case class), defines it."""
+    linecache.checkcache()
+    listDict = [mod.__dict__ for mod in listMod]
+    hasher = hashlib.sha1()
+    setISeen = set()
+    listStack = list(reversed(listRoot))
+    def lookup(sName, dictGlobals):
+        listO = []
+        for dict_ in [dictGlobals] + listDict:
+            if sName in dict_:
+                listO.append(dict_[sName])
+        for o in listNamespace:
+            if sName in getattr(o, "__dict__", {}):
+                listO.append(o.__dict__[sName])
+        return listO
+    while listStack:
+        o = listStack.pop()
+        if isinstance(o, SCALAR_TYPES):
+            hasher.update(repr(o))
+            continue
+        if id(o) in setISeen:
+            continue
+        setISeen.add(id(o))
+        if isinstance(o, types.MethodType):
+            o = o.im_func
+        if isinstance(o, types.FunctionType):
+            if not any(o.func_globals is dict_ for dict_ in listDict):
+                continue
+            hasher.update(source_of(o))
+            for cell in o.func_closure or ():
+                listStack.append(cell.cell_contents)
+            for sName in sorted(code_names(o.func_code), reverse=True):
+                listStack.extend(lookup(sName, o.func_globals))
+        elif isinstance(o, (type, types.ClassType)):
+            if inspect.getmodule(o) not in listMod:
+                continue
+            hasher.update(source_of(o))
+            for sName in sorted(o.__dict__, reverse=True):
+                if isinstance(o.__dict__[sName], types.FunctionType):
+                    listStack.append(o.__dict__[sName])
+        elif isinstance(o, (list, tuple)):
+            hasher.update("%s %d" % (type(o).__name__, len(o)))
+            listStack.extend(reversed(o))
+        elif isinstance(o, (set, frozenset)):
+            hasher.update("%s %d" % (type(o).__name__, len(o)))
+            listStack.extend(sorted(o, key=sort_key, reverse=True))
+        elif isinstance(o, dict):
+            hasher.update("dict %d" % len(o))
+            for oKey in sorted(o, key=sort_key, reverse=True):
+                listStack.append(o[oKey])
+                listStack.append(oKey)
+        elif inspect.getmodule(type(o)) in listMod:
+            listStack.append(getattr(o, "__dict__", {}))
+            listStack.append(type(o))
+    return hasher.hexdigest()
 
 class Fixture(object):
     def __init__(self, listSt, mod, modWork):
@@ -25,12 +153,77 @@ class Fixture(object):
         listSt = self.testDict.values()
         listSt.sort(lambda a,b: a.cLine - b.cLine)
         return [st.serialize() for st in listSt]
-    def run_multiple(self, listSName):
-        reload(self.modWork)
-        listOut = []
-        for sName in listSName:
-            listOut.append({"name":sName, "results": self.get(sName).run()})
-        return listOut
+    def iter_run(self, listSName, cProcesses=None):
+        """Run the tests named in listSName, yielding {"name", "results"}
+        for each as soon as it finishes, in no particular order.
+
+        With more than one process (by default, one per core), the tests
+        are spread over a pool of worker processes, which each load the
+        test and work modules once and send their results back as the
+        tests finish. Each test's stdout is captured in the process
+        running it. Results are recorded in the event log here, so a
+        single writer records them all."""
+        if cProcesses is None:
+            cProcesses = default_processes()
+        cProcesses = min(cProcesses, len(listSName))
+        listProcess = []
+        if cProcesses <= 1:
+            iterResults = ((sName, self.get(sName).execute())
+                           for sName in listSName)
+        else:
+            # Workers are not daemonic, so tests may start processes of
+            # their own.
+            queueName = multiprocessing.Queue()
+            queueResult = multiprocessing.Queue()
+            for sName in listSName:
+                queueName.put(sName)
+            for _ in xrange(cProcesses):
+                queueName.put(None)
+                process = multiprocessing.Process(
+                    target=test_worker,
+                    args=(self.mod.__name__, self.modWork.__name__,
+                          queueName, queueResult))
+                process.start()
+                listProcess.append(process)
+            iterResults = iter_worker_results(listProcess, queueResult,
+                                              len(listSName))
+        try:
+            for sName,(dictResults,sTb) in iterResults:
+                self.get(sName).log_result(sTb)
+                yield {"name": sName, "results": dictResults}
+        finally:
+            for process in listProcess:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+    def run_multiple(self, listSName, cProcesses=None, fIncremental=True):
+        """Run the tests named in listSName, returning their results in
+        that order.
+
+        If fIncremental is set, a test whose fingerprint (see
+        SingleTest.fingerprint) matches the last time it passed is not
+        run again; its cached result is returned, with "cached" set.
+        Failing tests always run again. The caller reloads the work
+        module first if it has changed, so that the fingerprints are
+        taken from the code on disk."""
+        dictOut = {}
+        dictFingerprint = {}
+        if fIncremental:
+            for sName in listSName:
+                dictFingerprint[sName] = self.get(sName).fingerprint(
+                    self.mod, self.modWork)
+            dictCached = eventlog.cached_test_results(dictFingerprint)
+            for sName,dictResults in dictCached.iteritems():
+                dictResults["cached"] = True
+                dictOut[sName] = {"name": sName, "results": dictResults}
+        listSToRun = [sName for sName in listSName if sName not in dictOut]
+        for dictOutput in self.iter_run(listSToRun, cProcesses):
+            sName = dictOutput["name"]
+            dictOut[sName] = dictOutput
+            if fIncremental and dictOutput["results"]["result"]:
+                eventlog.store_test_result(sName, dictFingerprint[sName],
+                                           dictOutput["results"])
+        return [dictOut[sName] for sName in listSName]
             
 class SingleTest(object):
     def __init__(self, tsParent, test):
@@ -46,23 +239,35 @@ class SingleTest(object):
     @classmethod
     def extract_method_name(cls,test):
         return test._testMethodName
-    def run(self):
+    def execute(self):
+        """Run the test without recording it in the event log. Returns the
+        serialized result and the traceback of the first failure, or
+        None if the test passed."""
         tr = unittest.TestResult()
-        fileOldStdout = sys.stdout
-        sys.stdout = StringIO.StringIO()
-        sConsole = None
-        try:
-            self.test.run(tr)
-            sConsole = sys.stdout.getvalue()
-        finally:
-            sys.stdout.close()
-            sys.stdout = fileOldStdout
+        sConsole,_ = tftask.capture_stdout(self.test.run, tr)
+        sTb = None
         if tr.errors or tr.failures:
             sTb = str((map(lambda (a,b): b, tr.errors + tr.failures))[0])
+        return serialize_test_result(tr,sConsole),sTb
+    def log_result(self, sTb):
+        if sTb is not None:
             eventlog.test_failure(self.sName, 0, sTb)
         else:
             eventlog.test_success(self.sName, 0)
-        return serialize_test_result(tr,sConsole)
+    def run(self):
+        dictResults,sTb = self.execute()
+        self.log_result(sTb)
+        return dictResults
+    def fingerprint(self, mod, modWork):
+        """Returns a hash of the source of this test, the setUp and
+        tearDown of its test case, and everything in the test module mod
+        and the work module modWork that they use."""
+        clsTest = type(self.test)
+        listRoot = [getattr(self.test, self.sMethodName)]
+        for sName in ("setUp", "tearDown"):
+            if sName in clsTest.__dict__:
+                listRoot.append(clsTest.__dict__[sName])
+        return dependency_fingerprint(listRoot, [mod, modWork], [clsTest])
     def description(self):
         return self.test.__doc__ or "(no description)"
     def serialize(self):
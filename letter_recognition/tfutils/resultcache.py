@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+"""
+resultcache.py -- keep the results of tasks on disk, so that a task whose
+code, data and settings have not changed is not run again.
+"""
+
+import hashlib
+try:
+    import json
+except ImportError:
+    import simplejson as json
+import os
+from os import path
+import tempfile
+import threading
+
+import loadconfig
+
+CACHE_DIRNAME = ".taskcache"
+CACHE_SUFFIX = ".json"
+DEFAULT_MAX_BYTES = 32*1024*1024
+DEFAULT_MAX_ENTRIES = 256
+
+CONFIG_DIR = loadconfig.get_config_dir()
+
+def source_filename(sFilename):
+    """Returns the source file of a module file, which may be compiled."""
+    sPref,sSuff = path.splitext(sFilename)
+    if sSuff in (".pyc", ".pyo"):
+        return sPref + ".py"
+    return sFilename
+
+def hash_file(hasher, sFilename):
+    hasher.update(sFilename)
+    try:
+        infile = open(sFilename, 'rb')
+    except IOError:
+        hasher.update("\0missing")
+        return
+    try:
+        while True:
+            s = infile.read(1 << 16)
+            if not s:
+                break
+            hasher.update(s)
+    finally:
+        infile.close()
+
+def module_hash(mod):
+    """Returns a hash of the contents of the source file of mod."""
+    hasher = hashlib.sha1()
+    hash_file(hasher, path.abspath(source_filename(mod.__file__)))
+    return hasher.hexdigest()
+
+def task_constants(task):
+    """Returns the upper-case class attributes of task (ROUNDS,
+    LEARNING_RATE, NETWORK_CONFIGURATION and the like), which hold its
+    settings."""
+    dictConstant = {}
+    for sName in dir(type(task)):
+        if sName.isupper() and not sName.startswith("_"):
+            dictConstant[sName] = getattr(task, sName)
+    return dictConstant
+
+def task_key(sTask, task, listSModuleHash):
+    """Returns the cache key of the task with id sTask: a hash of the id,
+    the hashes in listSModuleHash of the sources the task's code was
+    loaded from (see module_hash), the contents of the files
+    task.get_data_files() names, and the task's constants."""
+    hasher = hashlib.sha1()
+    hasher.update(sTask)
+    for sModuleHash in listSModuleHash:
+        hasher.update(sModuleHash)
+    for sFilename in task.get_data_files() or []:
+        hash_file(hasher, path.abspath(sFilename))
+    hasher.update(json.dumps(task_constants(task), sort_keys=True,
+                             default=repr))
+    return hasher.hexdigest()
+
+class ResultCache(object):
+    """A directory of task results, one JSON file per key. Reading an
+    entry marks it as recently used; after each write, the least recently
+    used entries are removed until there are at most cMaxEntries of them,
+    taking at most cMaxBytes."""
+    def __init__(self, sDir=None, cMaxBytes=DEFAULT_MAX_BYTES,
+                 cMaxEntries=DEFAULT_MAX_ENTRIES):
+        if sDir is None:
+            sDir = path.join(CONFIG_DIR, CACHE_DIRNAME)
+        self.sDir = sDir
+        self.cMaxBytes = cMaxBytes
+        self.cMaxEntries = cMaxEntries
+        self.lock = threading.Lock()
+    def filename(self, sKey):
+        return path.join(self.sDir, sKey + CACHE_SUFFIX)
+    def get(self, sKey):
+        """Returns the result stored under sKey, or None."""
+        sFilename = self.filename(sKey)
+        try:
+            infile = open(sFilename, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                oResult = json.load(infile)
+            except ValueError:
+                return None
+        finally:
+            infile.close()
+        try:
+            os.utime(sFilename, None)
+        except OSError:
+            pass
+        return oResult
+    def put(self, sKey, oResult):
+        """Store oResult under sKey, replacing the entry atomically, then
+        evict entries beyond the limits."""
+        self.lock.acquire()
+        try:
+            if not path.isdir(self.sDir):
+                os.makedirs(self.sDir)
+            fd,sTmp = tempfile.mkstemp(dir=self.sDir, suffix=".tmp")
+            try:
+                outfile = os.fdopen(fd, 'wb')
+                try:
+                    json.dump(oResult, outfile)
+                finally:
+                    outfile.close()
+                os.rename(sTmp, self.filename(sKey))
+            except:
+                os.remove(sTmp)
+                raise
+            self.evict()
+        finally:
+            self.lock.release()
+    def entries(self):
+        """Returns (last use, size, filename) for each entry, least
+        recently used first."""
+        listTplEntry = []
+        for sName in os.listdir(self.sDir):
+            if not sName.endswith(CACHE_SUFFIX):
+                continue
+            sFilename = path.join(self.sDir, sName)
+            try:
+                st = os.stat(sFilename)
+            except OSError:
+                continue
+            listTplEntry.append((st.st_mtime, st.st_size, sFilename))
+        listTplEntry.sort()
+        return listTplEntry
+    def evict(self):
+        listTplEntry = self.entries()
+        cEntries = len(listTplEntry)
+        cBytes = sum(cSize for _,cSize,_ in listTplEntry)
+        for _,cSize,sFilename in listTplEntry:
+            if cEntries <= self.cMaxEntries and cBytes <= self.cMaxBytes:
+                break
+            try:
+                os.remove(sFilename)
+            except OSError:
+                pass
+            cEntries -= 1
+            cBytes -= cSize
+
+class CachedTask(object):
+    """Stands in for a task: run returns the result cached under sKey,
+    with "cached" set, unless fRefresh is set or there is none. Otherwise
+    it runs the task and caches its result if the task succeeded."""
+    def __init__(self, cache, sKey, task, fRefresh=False):
+        self.cache = cache
+        self.sKey = sKey
+        self.task = task
+        self.fRefresh = fRefresh
+    def run(self, fxnProgress=None):
+        if not self.fRefresh:
+            dictResult = self.cache.get(self.sKey)
+            if dictResult is not None:
+                dictResult["cached"] = True
+                return dictResult
+        dictResult = self.task.run(fxnProgress)
+        if dictResult["valid"] is not False and dictResult["tb"] is None:
+            self.cache.put(self.sKey, dictResult)
+        return dictResult
@@ -3,7 +3,7 @@
 import re
 def _import_c_make_scanner():
     try:
-        from simplejson._speedups import make_scanner
+        from _speedups import make_scanner
         return make_scanner
     except ImportError:
         return None
@@ -37,6 +37,7 @@ def all_tests_suite():
         'simplejson.tests.test_fail',
         'simplejson.tests.test_float',
         'simplejson.tests.test_indent',
+        'simplejson.tests.test_numbers',
         'simplejson.tests.test_pass1',
         'simplejson.tests.test_pass2',
         'simplejson.tests.test_pass3',
@@ -3,6 +3,8 @@
 var TfUtils = (function() {
     var dictTest = {};
     var dictTask = {};
+    // how often to ask the server whether a running task has finished
+    var JOB_POLL_INTERVAL_MS = 1000;
     
     var jTestResults = $("<span/>");
     var jUpdateNotification = $("<div id='update_notification'" +
@@ -25,6 +27,7 @@ var TfUtils = (function() {
 	var jExpandTb = $("<div class='test_expand collapsed'/>");
 	var jExpandConsole = $("<div class='test_expand collapsed'/>");
 	var jRunTestButton = $("<div class='test_button'/>");
+	var jCached = $("<div class='test_cached collapsed'/>");
 	var jTestContent = $("<div class='test_content collapsed'/>");
 	var jPre = $("<pre class='test_pre code'/>");
 	jHeader.attr("title",dictTestProperties.description);
@@ -34,6 +37,11 @@ var TfUtils = (function() {
 	jHeader.append(jExpandTb);
 	jExpandConsole.append($("<a href=''/>").text("Show Output"));
 	jHeader.append(jExpandConsole);
+	jCached.text("cached ");
+	jCached.append($("<a href=''/>").text("Rerun")
+		       .attr("title", "Run the test again even though it "
+			     + "passed last time with this code."));
+	jHeader.append(jCached);
 	jHeader.append(jRunTestButton);
 	jHeader.append($("<div class='clear'/>"));
 	jTestContent.append(jPre);
@@ -44,6 +52,7 @@ var TfUtils = (function() {
 	function prep() {
 	    jRunTestButton.unbind('click');
 	    jTest.addClass("running");
+	    jCached.hide();
 	    if (t.showing) {
 		jTestContent.slideUp();
 		t.showing = null;
@@ -56,6 +65,12 @@ var TfUtils = (function() {
 	}
 	jTest.click(cb);
 	jRunTestButton.attr("title","Click to run this test.");
+	jCached.find('a').click(function(event) {
+	    prep();
+	    runTest(sName, true);
+	    event.stopPropagation();
+	    event.preventDefault();
+	});
 
 	function buildShowText(sKey) {
 	    return function(event) {
@@ -98,7 +113,14 @@ var TfUtils = (function() {
 	    console: "",
 	    showing: null,
 	    setTraceback: setShowButton("traceback",jExpandTb),
-	    setConsole: setShowButton("console", jExpandConsole)
+	    setConsole: setShowButton("console", jExpandConsole),
+	    setCached: function(fCached) {
+		if (fCached) {
+		    jCached.show();
+		} else {
+		    jCached.hide();
+		}
+	    }
 	};
 
 	dictTest[sName] = t;
@@ -121,10 +143,15 @@ var TfUtils = (function() {
 	var jConsole = $("<pre class='task_console collapsed code'/>");
 	var jRunHolder = $("<div class='task_run_holder'/>");
 	var jUiError = $("<div class='task_ui_error'/>");
+	var jProgress = $("<div class='task_progress collapsed'/>");
 	
 	jTitleHolder.text(sName);
 	
 	jRunHolder.append($("<a class='button' href=''/>").text("Run"));
+	jRunHolder.append($("<a class='button task_rerun' href=''/>")
+			  .text("Rerun")
+			  .attr("title", "Run the task again even if its result "
+				+ "is cached."));
 	jHeader.append(jTitleHolder);
 	jHeader.append(jRunHolder);
 
@@ -143,6 +170,7 @@ var TfUtils = (function() {
 	    jTask.append(jDescription);
 	}
 	jTask.append(jUiError);
+	jTask.append(jProgress);
 	jTask.append(jError);
 	jTask.append(jConsole);
 	jTask.append(jTaskContent);
@@ -196,13 +224,70 @@ var TfUtils = (function() {
 		});
 	    }
 	})();
+	tk.startProgress = function() {
+	    tk.cRoundShown = 0;
+	    tk.liveChart = null;
+	};
+	tk.showProgress = function(dictProgress) {
+	    if (dictProgress.round <= tk.cRoundShown) {
+		return;
+	    }
+	    tk.cRoundShown = dictProgress.round;
+	    var sStatus = ("Round " + dictProgress.round + " of "
+			   + dictProgress.rounds);
+	    if (dictProgress.eta !== null) {
+		sStatus += ", about " + Math.ceil(dictProgress.eta) + "s left";
+	    }
+	    jProgress.text(sStatus);
+	    jProgress.slideDown();
+	    if (dictTaskProperties.type != "chart") {
+		return;
+	    }
+	    if (tk.liveChart === null) {
+		var listDictSeries = [];
+		$.each(dictProgress.values, function(sName, _) {
+		    listDictSeries.push({name: sName, data: []});
+		});
+		var iWidth = jTask.width();
+		tk.liveChart = new Highcharts.Chart({
+		    chart: {renderTo: sId + "_chart",
+			    defaultSeriesType: "line",
+			    width: iWidth,
+			    height: Math.floor(iWidth*9.0/16.0)},
+		    title: {text: sName},
+		    xAxis: {title: {text: "Round"}},
+		    yAxis: {title: {text: "Accuracy"}},
+		    series: listDictSeries
+		});
+		jTaskContent.slideDown();
+	    }
+	    $.each(tk.liveChart.series, function(_, series) {
+		var dbl = dictProgress.values[series.name];
+		if (dbl !== undefined) {
+		    series.addPoint([dictProgress.round - 1, dbl]);
+		}
+	    });
+	};
+	tk.endProgress = function() {
+	    jProgress.slideUp();
+	    if (tk.liveChart !== null) {
+		tk.liveChart.destroy();
+		tk.liveChart = null;
+	    }
+	};
+	tk.showCached = function() {
+	    jProgress.text("This result was cached. Click Rerun to run "
+			   + "the task again.");
+	    jProgress.slideDown();
+	};
 	tk.button = jRunHolder.find('a');
 	tk.button.click(function(event) {
 	    event.preventDefault();
+	    var fRefresh = $(this).hasClass("task_rerun");
 	    jTaskContent.slideUp(500, function(){
 		jTask.addClass("running");
 		jRunHolder.find('a').hide();
-		runTask(sId);
+		runTask(sId, fRefresh);
 	    });
 	});
 	tk.addError = function(xhr, sStatus, exn) {
@@ -258,34 +343,87 @@ var TfUtils = (function() {
 	$(canvas).springy(graph);
     }
 
-    function runTask(sTask) {
+    function runTask(sTask, fRefresh) {
 	var tk = dictTask[sTask];
 	function cleanup() {
 	    tk.j.removeClass("running");
 	    tk.button.show();
+	    tk.endProgress();
 	}
 	function handleSuccess(json) {
 	    cleanup();
 	    tk.cb(json);
+	    if (json.cached) {
+		tk.showCached();
+	    }
 	}
 	function handleError(xhr,sStatus,exn) {
 	    cleanup();
 	    tk.addError(xhr,sStatus,exn);
 	}
+	function pollJob(json) {
+	    $.each(json.progress, function(_, dictProgress) {
+		tk.showProgress(dictProgress);
+	    });
+	    if (json.status == "done") {
+		handleSuccess(json.result);
+		return;
+	    }
+	    window.setTimeout(function() {
+		$.ajax({
+		    type: "GET",
+		    url: "/job/" + json.id + "/",
+		    success: pollJob,
+		    error: handleError,
+		    dataType: "json",
+		    cache: false
+		});
+	    }, JOB_POLL_INTERVAL_MS);
+	}
+	// Follow the job's progress as it is streamed, or poll for it in
+	// browsers without server-sent events (or if the stream breaks).
+	function followJob(sJob) {
+	    var dictQueued = {id: sJob, status: "queued", progress: []};
+	    if (!window.EventSource) {
+		pollJob(dictQueued);
+		return;
+	    }
+	    var fDone = false;
+	    var source = new EventSource("/job/" + sJob + "/events/");
+	    source.addEventListener("progress", function(event) {
+		tk.showProgress($.parseJSON(event.data));
+	    }, false);
+	    source.addEventListener("done", function(event) {
+		fDone = true;
+		source.close();
+		handleSuccess($.parseJSON(event.data).result);
+	    }, false);
+	    source.onerror = function() {
+		source.close();
+		if (!fDone) {
+		    pollJob(dictQueued);
+		}
+	    };
+	}
+	tk.startProgress();
 	$.ajax({
 	    type: "POST",
 	    url: "/task/" + tk.id + "/",
-	    data: null,
-	    success: handleSuccess, 
+	    data: {refresh: fRefresh ? "1" : "0"},
+	    success: function(json) {
+		followJob(json.job);
+	    },
 	    error: handleError,
-	    dataType: "json",
-	    timeout: 1000.0 * 60.0 * 10.0 // ten minute timeout
+	    dataType: "json"
 	});
     }
 
-    function runTest(sTest) {
+    // With fRefresh, tests that passed before with the same code are run
+    // again instead of answered from the cache.
+    function runTest(sTest, fRefresh) {
 	$("div#run_all").hide();
-	$.post("/test/run/", {"tests":sTest}, showTestResults, "json");
+	$.post("/test/run/", {"tests": sTest, "refresh": fRefresh ? "1" : "0"},
+	       showTestResults, "json");
     }
 
     function showTestResults(json) {
@@ -293,12 +431,12 @@ var TfUtils = (function() {
 	    var t = dictTest[d.name];
 	    setTestResult(d.name, d.results.result,
 			  d.results.failures.join("\n\n"),
-			  d.results.console);
+			  d.results.console, d.results.cached);
 	});
 	$("div#run_all").show();
     }
 
-    function setTestResult(sTest,nResult,sTb,sConsole) {
+    function setTestResult(sTest,nResult,sTb,sConsole,fCached) {
 	var t = dictTest[sTest];
 	t.result = nResult;
 	var jTest = t.j;
@@ -306,6 +444,7 @@ var TfUtils = (function() {
 	setTestButtonColor(jButton, nResult);
 	t.setTraceback(sTb);
 	t.setConsole(sConsole);
+	t.setCached(fCached);
 	updateTestResults();
 	t.j.removeClass("running");
 	jButton.click(t.cb);
@@ -327,13 +466,18 @@ var TfUtils = (function() {
 	var jButton = $("<a class='button' href=''/>").text("Run All");
 	var jHolder = $("<div id='run_all' />");
 	jHolder.append(jButton);
+	jHolder.append($("<a class='button test_rerun' href=''/>")
+		       .text("Rerun All")
+		       .attr("title", "Run every test again, including the "
+			     + "ones whose result is cached."));
 	function cb(event) {
+	    var fRefresh = $(this).hasClass("test_rerun");
 	    var listToRun = [];
 	    $.each(dictTest, function(_,t) {
 		listToRun.push(t.name);
 		t.prep();
 	    });
-	    runTest(listToRun.join(','));
+	    runTest(listToRun.join(','), fRefresh);
 	    event.preventDefault();
 	}
 	jHolder.find('a').click(cb);
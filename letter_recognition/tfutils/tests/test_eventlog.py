@@ -0,0 +1,311 @@
+import os
+from os import path
+import shutil
+import sqlite3
+import sys
+import tempfile
+from StringIO import StringIO
+from unittest import TestCase
+
+from tfutils import eventlog
+
+DAY = eventlog.SECONDS_PER_DAY
+# the start of a day, as compact rounds timestamps down to one
+DAY0 = 15000*DAY
+
+class EventLogTestCase(TestCase):
+    """Runs each test against an empty event database in a directory of
+    its own."""
+    def setUp(self):
+        self.sDir = tempfile.mkdtemp()
+        self.sFilename = path.join(self.sDir, eventlog.FILENAME)
+        self.conn = sqlite3.connect(self.sFilename, isolation_level=None)
+        eventlog.build_db(eventlog.SCHEMA_TEMPLATE, self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.sDir)
+
+    def add(self, sName, dblTime, fSuccess, sTb=None, sKind="test"):
+        sTable,_,sNameField = eventlog.invocation_table(sKind)
+        self.conn.execute("""INSERT INTO %s
+        (timestamp, %s, %s_id, success, traceback) VALUES (?,?,0,?,?)"""
+                          % (sTable, sNameField, sKind),
+                          (dblTime, sName, int(fSuccess), sTb))
+
+    def invocations(self, sKind="test"):
+        sTable,_,sNameField = eventlog.invocation_table(sKind)
+        return self.conn.execute(
+            "SELECT %s, timestamp, success, traceback FROM %s ORDER BY id"
+            % (sNameField, sTable)).fetchall()
+
+    def summary(self, sKind="test"):
+        _,sSummary,sNameField = eventlog.invocation_table(sKind)
+        return self.conn.execute(
+            "SELECT %s, day, runs, successes FROM %s ORDER BY %s, day"
+            % (sNameField, sSummary, sNameField)).fetchall()
+
+
+class TestCompact(EventLogTestCase):
+    def test_rolls_up_by_name_and_day(self):
+        self.add("a", DAY0 + 10, True)
+        self.add("a", DAY0 + 20, False, "tb")
+        self.add("a", DAY0 + DAY + 10, True)
+        self.add("b", DAY0 + 30, False, "tb")
+        self.add("a", DAY0 + 5*DAY, True)
+        self.add("b", DAY0 + 5*DAY, True)
+        self.assertEquals(eventlog.compact(self.conn, DAY0 + 4*DAY), 4)
+        self.assertEquals(self.summary(),
+                          [("a", DAY0, 2, 1), ("a", DAY0 + DAY, 1, 1),
+                           ("b", DAY0, 1, 0)])
+        self.assertEquals(self.invocations(),
+                          [("a", DAY0 + 5*DAY, 1, None),
+                           ("b", DAY0 + 5*DAY, 1, None)])
+
+    def test_keeps_latest_invocation(self):
+        self.add("a", DAY0 + 10, True)
+        self.add("a", DAY0 + 20, False, "tb")
+        self.assertEquals(eventlog.compact(self.conn, DAY0 + 4*DAY), 1)
+        self.assertEquals(self.summary(), [("a", DAY0, 1, 1)])
+        self.assertEquals(self.invocations(), [("a", DAY0 + 20, 0, "tb")])
+
+    def test_adds_to_existing_summary(self):
+        self.add("a", DAY0 + 10, True)
+        self.add("a", DAY0 + 20, True)
+        eventlog.compact(self.conn, DAY0 + 4*DAY, fVacuum=False)
+        self.add("a", DAY0 + 30, False, "tb")
+        self.add("a", DAY0 + 5*DAY, True)
+        self.assertEquals(eventlog.compact(self.conn, DAY0 + 4*DAY), 2)
+        self.assertEquals(self.summary(), [("a", DAY0, 3, 2)])
+
+    def test_compacts_tasks(self):
+        self.add("t", DAY0 + 10, False, "tb", sKind="task")
+        self.add("t", DAY0 + 20, True, sKind="task")
+        self.add("a", DAY0 + 10, True)
+        self.assertEquals(eventlog.compact(self.conn, DAY0 + 4*DAY), 1)
+        self.assertEquals(self.summary("task"), [("t", DAY0, 1, 0)])
+        self.assertEquals(self.summary("test"), [])
+        self.assertEquals(self.invocations("test"),
+                          [("a", DAY0 + 10, 1, None)])
+
+    def test_nothing_to_compact(self):
+        self.add("a", DAY0 + 10, True)
+        self.add("a", DAY0 + 20, True)
+        self.assertEquals(eventlog.compact(self.conn, DAY0), 0)
+        self.assertEquals(len(self.invocations()), 2)
+        self.assertEquals(self.summary(), [])
+
+
+class TestQueries(EventLogTestCase):
+    def test_latest_results(self):
+        self.add("a", DAY0 + 10, True)
+        self.add("a", DAY0 + 20, False, "tb")
+        self.add("b", DAY0 + 30, False, "tb")
+        self.add("b", DAY0 + 30, True)
+        self.assertEquals(eventlog.latest_results(self.conn),
+                          {"a": (DAY0 + 20, False, "tb"),
+                           "b": (DAY0 + 30, True, None)})
+        self.assertEquals(eventlog.latest_results(self.conn, "task"), {})
+
+    def test_pass_rates(self):
+        self.add("a", DAY0 + 10, True)
+        self.add("a", DAY0 + 20, False, "tb")
+        self.add("b", DAY0 + 30, True)
+        self.assertEquals(eventlog.pass_rates(self.conn),
+                          {"a": (2, 1, 0.5), "b": (1, 1, 1.0)})
+
+    def test_pass_rates_window(self):
+        self.add("a", DAY0 + 10, False)
+        self.add("a", DAY0 + 20, True)
+        self.add("a", DAY0 + 30, True)
+        self.assertEquals(eventlog.pass_rates(self.conn, "test", DAY0 + 20,
+                                              DAY0 + 30),
+                          {"a": (1, 1, 1.0)})
+        self.assertEquals(eventlog.pass_rates(self.conn, "test", DAY0 + 40),
+                          {})
+
+    def test_pass_rates_count_summaries(self):
+        self.add("a", DAY0 + 10, False)
+        self.add("a", DAY0 + DAY + 10, True)
+        self.add("a", DAY0 + 2*DAY + 10, True)
+        self.add("a", DAY0 + 5*DAY, False)
+        dictBefore = eventlog.pass_rates(self.conn)
+        eventlog.compact(self.conn, DAY0 + 4*DAY)
+        self.assertEquals(eventlog.pass_rates(self.conn), dictBefore)
+        self.assertEquals(dictBefore, {"a": (4, 2, 0.5)})
+        # a summarized day counts only if it starts in the window
+        self.assertEquals(eventlog.pass_rates(self.conn, "test", DAY0 + 10),
+                          {"a": (3, 2, 2.0/3)})
+        self.assertEquals(eventlog.pass_rates(self.conn, "test", DAY0,
+                                              DAY0 + 2*DAY),
+                          {"a": (2, 1, 0.5)})
+
+    def test_failures_since(self):
+        self.add("a", DAY0 + 30, False, "tb3")
+        self.add("a", DAY0 + 10, False, "tb1")
+        self.add("b", DAY0 + 20, False, "tb2")
+        self.add("b", DAY0 + 40, True)
+        self.assertEquals(eventlog.failures_since(self.conn),
+                          [(DAY0 + 10, "a", "tb1"), (DAY0 + 20, "b", "tb2"),
+                           (DAY0 + 30, "a", "tb3")])
+        self.assertEquals(eventlog.failures_since(self.conn, "test",
+                                                  DAY0 + 15),
+                          [(DAY0 + 20, "b", "tb2"), (DAY0 + 30, "a", "tb3")])
+        self.assertEquals(eventlog.failures_since(self.conn, "test", 0, "a"),
+                          [(DAY0 + 10, "a", "tb1"), (DAY0 + 30, "a", "tb3")])
+
+    def test_unknown_kind(self):
+        self.assertRaises(ValueError, eventlog.latest_results, self.conn,
+                          "suite")
+
+
+class TestMain(EventLogTestCase):
+    def setUp(self):
+        EventLogTestCase.setUp(self)
+        self.sConfigDir = eventlog.CONFIG_DIR
+        eventlog.CONFIG_DIR = self.sDir
+
+    def tearDown(self):
+        eventlog.CONFIG_DIR = self.sConfigDir
+        EventLogTestCase.tearDown(self)
+
+    def main(self, *args):
+        stdout = sys.stdout
+        sys.stdout = sio = StringIO()
+        try:
+            self.assertEquals(eventlog.main(["eventlog.py"] + list(args)), 0)
+        finally:
+            sys.stdout = stdout
+        return sio.getvalue().splitlines()
+
+    def test_latest(self):
+        dblNow = eventlog.get_time_now()
+        self.add("b", dblNow - 20, True)
+        self.add("a", dblNow - 10, False, "tb")
+        listS = self.main("--latest")
+        self.assertEquals([s.split("\t")[1:] for s in listS],
+                          [["FAIL", "a"], ["pass", "b"]])
+
+    def test_pass_rate(self):
+        dblNow = eventlog.get_time_now()
+        self.add("a", dblNow - 3*DAY, False)
+        self.add("a", dblNow - 20, True)
+        self.add("a", dblNow - 10, False)
+        self.assertEquals(self.main("--pass-rate", "1"),
+                          [" 50.0%\t1/2\ta"])
+        self.assertEquals(self.main("--pass-rate", "7"),
+                          [" 33.3%\t1/3\ta"])
+
+    def test_failures(self):
+        dblNow = eventlog.get_time_now()
+        self.add("a", dblNow - 3*DAY, False, "tb")
+        self.add("b", dblNow - 10, False, "tb")
+        self.add("c", dblNow - 5, True)
+        listS = self.main("--failures", "1", "--kind", "test")
+        self.assertEquals([s.split("\t")[1] for s in listS], ["b"])
+
+    def test_compact(self):
+        dblNow = eventlog.get_time_now()
+        self.add("a", dblNow - 10*DAY, True)
+        self.add("a", dblNow - 9*DAY, True)
+        self.add("a", dblNow - 10, False, "tb")
+        self.add("t", dblNow - 10*DAY, True, sKind="task")
+        self.assertEquals(self.main("--compact", "7"),
+                          ["Compacted 2 invocations."])
+        self.assertEquals(len(self.invocations()), 1)
+        self.assertEquals(len(self.invocations("task")), 1)
+        self.assertEquals(sum(cRuns for _,_,cRuns,_ in self.summary()), 2)
+
+
+class TestEventWriter(EventLogTestCase):
+    def setUp(self):
+        EventLogTestCase.setUp(self)
+        self.stderr = sys.stderr
+        sys.stderr = StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+        EventLogTestCase.tearDown(self)
+
+    def writer(self, sFilename=None, dblInterval=0.05):
+        writer = eventlog.EventWriter(sFilename or self.sFilename,
+                                      cBatchSize=4, dblInterval=dblInterval)
+        self.addCleanup(writer.close)
+        return writer
+
+    def add(self, writer, sName, fSuccess=True):
+        writer.add("test_invocation", "test",
+                   {"test_name": sName, "test_id": 0, "success": fSuccess,
+                    "traceback": None if fSuccess else "tb"})
+
+    def test_flush_commits_everything(self):
+        writer = self.writer()
+        for i in xrange(10):
+            self.add(writer, "t%d" % i, i % 2 == 0)
+        writer.flush()
+        listRow = self.invocations()
+        self.assertEquals([sName for sName,_,_,_ in listRow],
+                          ["t%d" % i for i in xrange(10)])
+        self.assertEquals(sum(iSuccess for _,_,iSuccess,_ in listRow), 5)
+
+    def test_write(self):
+        writer = self.writer()
+        writer.write("""INSERT INTO test_result_cache
+        (test_name, fingerprint, timestamp, results) VALUES (?,?,?,?)""",
+                     ["a", "f", DAY0, "{}"])
+        writer.flush()
+        self.assertEquals(self.conn.execute(
+            "SELECT test_name, fingerprint FROM test_result_cache"
+            ).fetchall(), [("a", "f")])
+
+    def test_next_batch(self):
+        writer = self.writer()
+        writer.close()
+        for i in xrange(6):
+            writer.write("SELECT ?", [i])
+        self.assertEquals(len(writer.next_batch()), 4)
+        self.assertEquals(len(writer.next_batch()), 2)
+
+    def test_close(self):
+        writer = self.writer()
+        self.add(writer, "a")
+        writer.close()
+        self.failIf(writer.thread.isAlive())
+        self.assertEquals(len(self.invocations()), 1)
+        # flushing a closed writer returns at once
+        writer.flush()
+
+    def test_bad_statement(self):
+        # a long interval keeps both statements in one batch, which the
+        # flush ends
+        writer = self.writer(dblInterval=5.0)
+        self.add(writer, "a")
+        writer.write("INSERT INTO no_such_table VALUES (?)", [1])
+        writer.flush()
+        self.assertEquals(self.invocations(), [])
+        self.failUnless("could not record 2 invocations"
+                        in sys.stderr.getvalue())
+        self.add(writer, "b")
+        writer.flush()
+        self.assertEquals([sName for sName,_,_,_ in self.invocations()],
+                          ["b"])
+
+    def test_cannot_open(self):
+        sSubdir = path.join(self.sDir, "later")
+        writer = self.writer(path.join(sSubdir, eventlog.FILENAME))
+        self.add(writer, "a")
+        writer.flush()
+        self.failUnless(writer.thread.isAlive())
+        self.failUnless("could not record 1 invocations"
+                        in sys.stderr.getvalue())
+        # the writer connects again once the database can be opened
+        os.mkdir(sSubdir)
+        self.add(writer, "b")
+        writer.flush()
+        conn = sqlite3.connect(path.join(sSubdir, eventlog.FILENAME))
+        try:
+            self.assertEquals(conn.execute(
+                "SELECT test_name FROM test_invocation").fetchall(),
+                              [("b",)])
+        finally:
+            conn.close()
@@ -0,0 +1,146 @@
+import os
+from os import path
+import shutil
+import tempfile
+from unittest import TestCase
+
+from tfutils import resultcache
+
+class CountingTask(object):
+    ROUNDS = 3
+    def __init__(self, sDataFile=None, fValid=True):
+        self.sDataFile = sDataFile
+        self.fValid = fValid
+        self.cRuns = 0
+    def get_data_files(self):
+        return [self.sDataFile] if self.sDataFile else []
+    def run(self, fxnProgress=None):
+        self.cRuns += 1
+        return {"console": "", "result": self.cRuns, "valid": self.fValid,
+                "tb": None}
+
+
+class ResultCacheTestCase(TestCase):
+    def setUp(self):
+        self.sDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.sDir)
+
+    def write(self, sName, sContents):
+        sFilename = path.join(self.sDir, sName)
+        outfile = open(sFilename, "w")
+        try:
+            outfile.write(sContents)
+        finally:
+            outfile.close()
+        return sFilename
+
+    def cache(self, **kwargs):
+        return resultcache.ResultCache(path.join(self.sDir, "cache"),
+                                       **kwargs)
+
+    def keys(self, cache):
+        return sorted(path.basename(sFilename)[:-len(resultcache.CACHE_SUFFIX)]
+                      for _,_,sFilename in cache.entries())
+
+    def set_last_use(self, cache, sKey, dblTime):
+        os.utime(cache.filename(sKey), (dblTime, dblTime))
+
+
+class TestResultCache(ResultCacheTestCase):
+    def test_get(self):
+        cache = self.cache()
+        self.assertEquals(cache.get("a"), None)
+        cache.put("a", {"result": [1, 2]})
+        self.assertEquals(cache.get("a"), {"result": [1, 2]})
+
+    def test_corrupt_entry(self):
+        cache = self.cache()
+        cache.put("a", {"result": 1})
+        self.write(path.join("cache", "a" + resultcache.CACHE_SUFFIX), "{")
+        self.assertEquals(cache.get("a"), None)
+
+    def test_evict_entries(self):
+        cache = self.cache(cMaxEntries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.set_last_use(cache, "a", 1000)
+        self.set_last_use(cache, "b", 2000)
+        cache.put("c", 3)
+        self.assertEquals(self.keys(cache), ["b", "c"])
+
+    def test_get_marks_used(self):
+        cache = self.cache(cMaxEntries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.set_last_use(cache, "a", 1000)
+        self.set_last_use(cache, "b", 2000)
+        self.assertEquals(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertEquals(self.keys(cache), ["a", "c"])
+
+    def test_evict_bytes(self):
+        cache = self.cache(cMaxBytes=250)
+        for i,sKey in enumerate("abc"):
+            cache.put(sKey, "x"*100)
+            self.set_last_use(cache, sKey, 1000*(i + 1))
+        self.assertEquals(self.keys(cache), ["b", "c"])
+        cache.put("d", "x"*300)
+        self.assertEquals(self.keys(cache), [])
+
+
+class TestTaskKey(ResultCacheTestCase):
+    def test_module_hash(self):
+        sFilename = self.write("mod.py", "VALUE = 1\n")
+        class Module(object):
+            __file__ = sFilename + "c"
+        sHash = resultcache.module_hash(Module)
+        self.assertEquals(resultcache.module_hash(Module), sHash)
+        self.write("mod.py", "VALUE = 2\n")
+        self.assertNotEquals(resultcache.module_hash(Module), sHash)
+
+    def test_task_key(self):
+        sData = self.write("data.txt", "1 2 3\n")
+        task = CountingTask(sData)
+        sKey = resultcache.task_key("t", task, ["h1", "h2"])
+        self.assertEquals(resultcache.task_key("t", task, ["h1", "h2"]),
+                          sKey)
+        self.assertNotEquals(resultcache.task_key("u", task, ["h1", "h2"]),
+                             sKey)
+        self.assertNotEquals(resultcache.task_key("t", task, ["h1", "h3"]),
+                             sKey)
+        task.ROUNDS = 4
+        self.assertNotEquals(resultcache.task_key("t", task, ["h1", "h2"]),
+                             sKey)
+        del task.ROUNDS
+        self.write("data.txt", "1 2 4\n")
+        self.assertNotEquals(resultcache.task_key("t", task, ["h1", "h2"]),
+                             sKey)
+
+
+class TestCachedTask(ResultCacheTestCase):
+    def test_cached(self):
+        cache = self.cache()
+        task = CountingTask()
+        dictResult = resultcache.CachedTask(cache, "k", task).run()
+        self.assertEquals(dictResult["result"], 1)
+        self.failIf("cached" in dictResult)
+        dictResult = resultcache.CachedTask(cache, "k", task).run()
+        self.assertEquals(dictResult["result"], 1)
+        self.failUnless(dictResult["cached"])
+        self.assertEquals(task.cRuns, 1)
+
+    def test_refresh(self):
+        cache = self.cache()
+        task = CountingTask()
+        resultcache.CachedTask(cache, "k", task).run()
+        dictResult = resultcache.CachedTask(cache, "k", task, True).run()
+        self.assertEquals(dictResult["result"], 2)
+        self.assertEquals(cache.get("k")["result"], 2)
+
+    def test_invalid_not_cached(self):
+        cache = self.cache()
+        task = CountingTask(fValid=False)
+        resultcache.CachedTask(cache, "k", task).run()
+        self.assertEquals(cache.get("k"), None)
@@ -0,0 +1,254 @@
+from os import path
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from tfutils import serveui
+
+# seconds to wait for something that should happen at once
+TIMEOUT = 5.0
+
+def in_thread(fxn, *args):
+    """Run fxn on a thread of its own; returns an event set once it has
+    returned."""
+    evtDone = threading.Event()
+    def run():
+        fxn(*args)
+        evtDone.set()
+    tr = threading.Thread(target=run)
+    tr.daemon = True
+    tr.start()
+    return evtDone
+
+class BlockingTask(object):
+    """Reports progress, then waits for evtGo before returning."""
+    def __init__(self):
+        self.evtStarted = threading.Event()
+        self.evtGo = threading.Event()
+    def run(self, fxnProgress):
+        fxnProgress({"step": 1})
+        self.evtStarted.set()
+        self.evtGo.wait(TIMEOUT)
+        return {"console": "", "result": "blocked", "valid": True,
+                "tb": None}
+
+class ReportingTask(object):
+    """Makes cReports progress reports."""
+    def __init__(self, cReports):
+        self.cReports = cReports
+    def run(self, fxnProgress):
+        for i in xrange(self.cReports):
+            fxnProgress({"step": i})
+        return {"console": "", "result": "reported", "valid": True,
+                "tb": None}
+
+class FailingTask(object):
+    def run(self, fxnProgress):
+        raise RuntimeError("task failed")
+
+
+class TestModuleLock(TestCase):
+    def setUp(self):
+        self.lock = serveui.ModuleLock()
+
+    def test_shared(self):
+        self.lock.acquire_shared()
+        try:
+            self.failUnless(in_thread(self.lock.acquire_shared).wait(TIMEOUT))
+        finally:
+            self.lock.release_shared()
+        self.lock.release_shared()
+
+    def test_exclusive_waits_for_shared(self):
+        self.lock.acquire_shared()
+        evtExclusive = in_thread(self.lock.acquire_exclusive)
+        self.failIf(evtExclusive.wait(0.1))
+        self.lock.release_shared()
+        self.failUnless(evtExclusive.wait(TIMEOUT))
+        evtShared = in_thread(self.lock.acquire_shared)
+        self.failIf(evtShared.wait(0.1))
+        self.lock.release_exclusive()
+        self.failUnless(evtShared.wait(TIMEOUT))
+
+    def test_waiting_exclusive_blocks_shared(self):
+        self.lock.acquire_shared()
+        evtExclusive = in_thread(self.lock.acquire_exclusive)
+        self.failIf(evtExclusive.wait(0.1))
+        evtShared = in_thread(self.lock.acquire_shared)
+        self.failIf(evtShared.wait(0.1))
+        self.lock.release_shared()
+        self.failUnless(evtExclusive.wait(TIMEOUT))
+        self.failIf(evtShared.is_set())
+        self.lock.release_exclusive()
+        self.failUnless(evtShared.wait(TIMEOUT))
+
+
+class TestReloadModules(TestCase):
+    def setUp(self):
+        self.sDir = tempfile.mkdtemp()
+        sys.path.insert(0, self.sDir)
+        self.fDontWriteBytecode = sys.dont_write_bytecode
+        sys.dont_write_bytecode = True
+        self.write(1)
+        self.mod = __import__("tfutils_reload_test")
+        serveui.reload_modules(self.mod)
+
+    def tearDown(self):
+        sys.dont_write_bytecode = self.fDontWriteBytecode
+        sys.path.remove(self.sDir)
+        serveui.SOURCE_HASH.pop(self.mod.__name__, None)
+        del sys.modules[self.mod.__name__]
+        shutil.rmtree(self.sDir)
+
+    def write(self, iValue):
+        outfile = open(path.join(self.sDir, "tfutils_reload_test.py"), "w")
+        try:
+            outfile.write("VALUE = %d\n" % iValue)
+        finally:
+            outfile.close()
+
+    def test_unchanged(self):
+        # an unchanged module is not reloaded, so the reload does not wait
+        # for the lock
+        serveui.MODULE_LOCK.acquire_shared()
+        try:
+            self.failUnless(in_thread(serveui.reload_modules,
+                                      self.mod).wait(TIMEOUT))
+        finally:
+            serveui.MODULE_LOCK.release_shared()
+
+    def test_changed(self):
+        self.write(2)
+        serveui.MODULE_LOCK.acquire_shared()
+        evtReloaded = in_thread(serveui.reload_modules, self.mod)
+        self.failIf(evtReloaded.wait(0.1))
+        self.assertEquals(self.mod.VALUE, 1)
+        serveui.MODULE_LOCK.release_shared()
+        self.failUnless(evtReloaded.wait(TIMEOUT))
+        self.assertEquals(self.mod.VALUE, 2)
+
+
+class TaskPoolTestCase(TestCase):
+    def wait_done(self, pool, sJob):
+        dblDeadline = time.time() + TIMEOUT
+        while time.time() < dblDeadline:
+            dictJob = pool.poll(sJob)
+            if dictJob["status"] == "done":
+                return dictJob
+            time.sleep(0.01)
+        self.fail("Job %s did not finish." % sJob)
+
+
+class TestTaskPool(TaskPoolTestCase):
+    def test_tasks_run_at_once(self):
+        pool = serveui.TaskPool(2)
+        taskFirst = BlockingTask()
+        taskSecond = BlockingTask()
+        sFirst = pool.submit("first", taskFirst)
+        sSecond = pool.submit("second", taskSecond)
+        self.failUnless(taskFirst.evtStarted.wait(TIMEOUT))
+        self.failUnless(taskSecond.evtStarted.wait(TIMEOUT))
+        dictFirst = pool.poll(sFirst)
+        self.assertEquals(dictFirst["status"], "running")
+        self.assertEquals(dictFirst["task"], "first")
+        self.assertEquals(dictFirst["progress"], [{"step": 1}])
+        taskSecond.evtGo.set()
+        dictSecond = self.wait_done(pool, sSecond)
+        self.assertEquals(dictSecond["result"]["result"], "blocked")
+        self.assertEquals(pool.poll(sFirst)["status"], "running")
+        taskFirst.evtGo.set()
+        self.wait_done(pool, sFirst)
+
+    def test_queued(self):
+        pool = serveui.TaskPool(1)
+        taskFirst = BlockingTask()
+        taskSecond = BlockingTask()
+        sFirst = pool.submit("first", taskFirst)
+        sSecond = pool.submit("second", taskSecond)
+        self.failUnless(taskFirst.evtStarted.wait(TIMEOUT))
+        self.assertEquals(pool.poll(sSecond)["status"], "queued")
+        taskFirst.evtGo.set()
+        taskSecond.evtGo.set()
+        self.wait_done(pool, sFirst)
+        self.wait_done(pool, sSecond)
+
+    def test_failure(self):
+        pool = serveui.TaskPool(1)
+        dictJob = self.wait_done(pool, pool.submit("fail", FailingTask()))
+        self.failIf(dictJob["result"]["valid"])
+        self.failUnless("task failed" in dictJob["result"]["tb"])
+
+    def test_events(self):
+        pool = serveui.TaskPool(1)
+        task = BlockingTask()
+        sJob = pool.submit("events", task)
+        iterEvents = pool.events(sJob)
+        self.assertEquals(iterEvents.next(), ("progress", {"step": 1}))
+        task.evtGo.set()
+        sEvent,dictJob = iterEvents.next()
+        self.assertEquals(sEvent, "done")
+        self.assertEquals(dictJob["result"]["result"], "blocked")
+        self.assertRaises(StopIteration, iterEvents.next)
+
+    def test_no_such_job(self):
+        pool = serveui.TaskPool(1)
+        self.assertRaises(ValueError, pool.poll, "1")
+        self.assertRaises(ValueError, pool.events, "1")
+
+
+class TestJobLifetime(TaskPoolTestCase):
+    def setUp(self):
+        self.cMaxJobProgress = serveui.MAX_JOB_PROGRESS
+        serveui.MAX_JOB_PROGRESS = 3
+
+    def tearDown(self):
+        serveui.MAX_JOB_PROGRESS = self.cMaxJobProgress
+
+    def test_poll_keeps_job(self):
+        pool = serveui.TaskPool(1)
+        sJob = pool.submit("kept", ReportingTask(1))
+        dictJob = self.wait_done(pool, sJob)
+        self.assertEquals(pool.poll(sJob), dictJob)
+        self.assertEquals(dictJob["result"]["result"], "reported")
+
+    def test_expire(self):
+        pool = serveui.TaskPool(1, dblTtl=0.2)
+        sJob = pool.submit("expired", ReportingTask(1))
+        self.wait_done(pool, sJob)
+        time.sleep(0.3)
+        self.assertRaises(ValueError, pool.poll, sJob)
+
+    def test_events_end_on_expiry(self):
+        pool = serveui.TaskPool(1, dblTtl=0.2)
+        sJob = pool.submit("expired", ReportingTask(1))
+        self.wait_done(pool, sJob)
+        iterEvents = pool.events(sJob)
+        time.sleep(0.3)
+        self.wait_done(pool, pool.submit("later", ReportingTask(0)))
+        self.assertRaises(StopIteration, iterEvents.next)
+
+    def test_progress_cap(self):
+        pool = serveui.TaskPool(1)
+        sJob = pool.submit("capped", ReportingTask(5))
+        dictJob = self.wait_done(pool, sJob)
+        self.assertEquals(dictJob["progress"],
+                          [{"step": 2}, {"step": 3}, {"step": 4}])
+        self.assertEquals(dictJob["dropped"], 2)
+        listEvent = list(pool.events(sJob))
+        self.assertEquals([dictData for sEvent,dictData in listEvent
+                           if sEvent == "progress"], dictJob["progress"])
+        self.assertEquals(listEvent[-1], ("done", dictJob))
+
+    def test_poll_copies_progress(self):
+        pool = serveui.TaskPool(1)
+        task = BlockingTask()
+        sJob = pool.submit("copied", task)
+        self.failUnless(task.evtStarted.wait(TIMEOUT))
+        dictJob = pool.poll(sJob)
+        task.evtGo.set()
+        self.wait_done(pool, sJob)
+        self.assertEquals(dictJob["progress"], [{"step": 1}])
+        self.assertEquals(dictJob["status"], "running")
@@ -6,18 +6,51 @@ tftask.py -- programmtic utilities for designating problem set tasks.
 
 import StringIO
 import sys
+import threading
+import time
 
 import eventlog
 
-def _capture_stdout(fxn,*args,**kwargs):
-    fileOldStdout = sys.stdout
-    sys.stdout = StringIO.StringIO()
+class ThreadLocalStdout(object):
+    """Stands in for sys.stdout while output is being captured. Whatever a
+    thread writes goes to the file that thread is capturing into, if any,
+    and otherwise to the real stdout, so tasks and tests running on
+    several threads at once each capture only their own output."""
+    def __init__(self, fileDefault):
+        self.fileDefault = fileDefault
+        self.local = threading.local()
+    def current(self):
+        return getattr(self.local, "file", None) or self.fileDefault
+    def write(self, s):
+        self.current().write(s)
+    def writelines(self, listS):
+        self.current().writelines(listS)
+    def flush(self):
+        self.current().flush()
+    def __getattr__(self, sName):
+        return getattr(self.current(), sName)
+
+_STDOUT_LOCK = threading.Lock()
+
+def capture_stdout(fxn,*args,**kwargs):
+    """Call fxn, returning what it printed to stdout on this thread and
+    its return value."""
+    _STDOUT_LOCK.acquire()
+    try:
+        if not isinstance(sys.stdout, ThreadLocalStdout):
+            sys.stdout = ThreadLocalStdout(sys.stdout)
+        stdout = sys.stdout
+    finally:
+        _STDOUT_LOCK.release()
+    fileOldCapture = getattr(stdout.local, "file", None)
+    fileCapture = StringIO.StringIO()
+    stdout.local.file = fileCapture
     try:
         oRet = fxn(*args, **kwargs)
-        sOut = sys.stdout.getvalue()
-        sys.stdout.close()
+        sOut = fileCapture.getvalue()
     finally:
-        sys.stdout = fileOldStdout
+        stdout.local.file = fileOldCapture
+        fileCapture.close()
     return sOut,oRet
 
 class BaseTask(object):
@@ -34,17 +67,38 @@ class BaseTask(object):
         return 0
     def get_extra_data(self):
         return None
+    def get_data_files(self):
+        """Returns the names of the data files the task reads, so that its
+        cached result is dropped when they change."""
+        return []
     def validate(self, oOut):
         return None
     def task(self):
         raise TypeError("%s has no task." % self.__class__.__name__)
-    def run(self):
+    def report_progress(self, cRound, cRounds, dictValues=None):
+        """Report that the task has finished round cRound of cRounds.
+        dictValues maps the names of chart series to their values for
+        this round. The report goes to the fxnProgress given to run, with
+        an estimate of the seconds left, or None; it is ignored if run
+        was given none."""
+        fxnProgress = getattr(self, "fxnProgress", None)
+        if fxnProgress is None:
+            return
+        dblEta = None
+        if cRound > 0:
+            dblElapsed = time.time() - self.dblStartTime
+            dblEta = dblElapsed/cRound*(cRounds - cRound)
+        fxnProgress({"round": cRound, "rounds": cRounds, "eta": dblEta,
+                     "values": dictValues or {}})
+    def run(self, fxnProgress=None):
+        self.fxnProgress = fxnProgress
+        self.dblStartTime = time.time()
         fValidation = True
         tb = None
         sConsole = None
         oOut = None
         try:
-            sConsole,oOut = _capture_stdout(self.task)
+            sConsole,oOut = capture_stdout(self.task)
             fValidation = self.validate(oOut)
         except KeyboardInterrupt:
             raise